@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Zotero RAG Search System
+
+Run individual benchmarks from the repository root, e.g.:
+    python -m benchmarks.bench_extraction
+"""
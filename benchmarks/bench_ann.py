@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Recall@k vs. latency of the approximate FAISS index types
+
+Every index type is built over the same synthetic clustered vectors and its
+results are compared against the exact flat index for a sweep of nprobe
+(IVF) and efSearch (HNSW) values.
+
+Usage:
+    python -m benchmarks.bench_ann [--vectors 200000] [--dim 1024] [--queries 500]
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from fast_pdf_opener import create_faiss_index, faiss_search_params, train_faiss_index
+
+SWEEPS = {
+    'flat': [{}],
+    'hnsw': [{'ef_search': ef} for ef in (16, 32, 64, 128, 256)],
+    'ivf-flat': [{'nprobe': nprobe} for nprobe in (1, 4, 16, 64)],
+    'ivf-pq': [{'nprobe': nprobe} for nprobe in (1, 4, 16, 64)],
+}
+
+
+def make_vectors(n_vectors: int, dim: int, n_queries: int, seed: int = 0):
+    """Normalized vectors drawn around random centroids, plus perturbed queries."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((max(1, n_vectors // 100), dim)).astype('float32')
+    assignment = rng.integers(0, len(centroids), n_vectors)
+    noise = rng.standard_normal((n_vectors, dim)).astype('float32')
+    vectors = centroids[assignment] + 0.5 * noise
+    faiss.normalize_L2(vectors)
+    queries = vectors[rng.choice(n_vectors, n_queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype('float32')
+    faiss.normalize_L2(queries)
+    return vectors, queries
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Fraction of the true top-k neighbours that were returned."""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN index recall/latency benchmark")
+    parser.add_argument("--vectors", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+    
+    vectors, queries = make_vectors(args.vectors, args.dim, args.queries)
+    truth = None
+    
+    print(f"{'index':>9} {'params':>14} {'build (s)':>10} "
+          f"{'recall@' + str(args.top_k):>10} "
+          f"{'ms/query':>9}")
+    for index_type, sweep in SWEEPS.items():
+        start = time.perf_counter()
+        index = create_faiss_index(args.dim, len(vectors), index_type)
+        train_faiss_index(index, vectors)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+        
+        for params in sweep:
+            search_params = faiss_search_params(index, **params)
+            # One query at a time, as interactive searches are issued
+            found = np.empty((len(queries), args.top_k), dtype='int64')
+            start = time.perf_counter()
+            for i in range(len(queries)):
+                _, found[i:i + 1] = index.search(queries[i:i + 1], args.top_k,
+                                                 params=search_params)
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+            
+            if truth is None:
+                truth = found.copy()
+            label = ", ".join(f"{key}={value}"
+                              for key, value in params.items()) or "exact"
+            print(f"{index_type:>9} {label:>14} {build_time:>10.2f} "
+                  f"{recall_at_k(found, truth):>10.3f} {latency:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Concurrent query throughput and latency: thread per call vs. AsyncZoteroRAG
+
+Simulates a number of concurrent clients, each sending queries back to back,
+and reports queries per second and p50/p99 latency when every call runs
+search() on its own thread and when calls are coalesced into batches by
+AsyncZoteroRAG.
+
+Usage:
+    python -m benchmarks.bench_async [--documents 100000] [--clients 1 8 32] [--model]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from fast_pdf_opener import MODEL_NAME, AsyncZoteroRAG
+
+from .bench_search_many import build_rag
+from .encoders import HashingEncoder
+
+
+async def run_clients(search, queries: List[str],
+                      n_clients: int) -> Tuple[float, np.ndarray]:
+    """Run ``n_clients`` query loops over ``queries``; returns (seconds, latencies)."""
+    latencies = []
+
+    async def client(offset: int):
+        for query in queries[offset::n_clients]:
+            start = time.perf_counter()
+            await search(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(n_clients)))
+    return time.perf_counter() - start, np.array(latencies)
+
+
+async def benchmark(rag, queries: List[str], clients: List[int], top_k: int, mode: str,
+                    max_wait: float, max_batch: int):
+    loop = asyncio.get_running_loop()
+    print(f"{'clients':>7} {'mode':>9} {'q/s':>7} {'p50 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'mean batch':>11}")
+    for n_clients in clients:
+        with ThreadPoolExecutor(max_workers=n_clients) as pool:
+            async def threaded(query):
+                return await loop.run_in_executor(
+                    pool, lambda: rag.search(query, top_k=top_k, mode=mode))
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds, latencies = await run_clients(threaded, queries, n_clients)
+        print(f"{n_clients:>7} {'threads':>9} {len(queries) / seconds:>7.0f} "
+              f"{np.percentile(latencies, 50) * 1000:>9.2f} "
+              f"{np.percentile(latencies, 99) * 1000:>9.2f} {'':>11}")
+
+        async with AsyncZoteroRAG(rag, max_wait, max_batch) as async_rag:
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds, latencies = await run_clients(
+                    lambda query: async_rag.search(query, top_k=top_k, mode=mode),
+                    queries, n_clients)
+            stats = async_rag.stats()
+        print(f"{n_clients:>7} {'coalesced':>9} {len(queries) / seconds:>7.0f} "
+              f"{np.percentile(latencies, 50) * 1000:>9.2f} "
+              f"{np.percentile(latencies, 99) * 1000:>9.2f} "
+              f"{stats['mean_batch_size']:>11.1f}")
+    print()
+    print(f"last run batch sizes: {stats['batch_sizes']}")
+    print(f"last run queue depths: {stats['queue_depths']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent query benchmark")
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--mode", choices=["dense", "hybrid"], default="dense")
+    parser.add_argument("--max-wait", type=float, default=0.002)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--model", action="store_true",
+                        help="Encode queries with the real sentence transformer")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = [f"Synthetic paper {i} Author {i % 997} Journal {i % 50}"
+               for i in rng.integers(0, args.documents, args.queries)]
+
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        if args.model:
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer(MODEL_NAME)
+        else:
+            encoder = HashingEncoder(1024)
+        rag = build_rag(zotero_dir, args.documents,
+                        encoder.get_sentence_embedding_dimension())
+        rag.model = encoder
+        print(f"{args.documents} documents, {args.queries} {args.mode} queries, "
+              f"top_k={args.top_k}, max_wait={args.max_wait * 1000:g} ms, "
+              f"max_batch={args.max_batch}")
+        asyncio.run(benchmark(rag, queries, args.clients, args.top_k, args.mode,
+                              args.max_wait, args.max_batch))
+
+
+if __name__ == "__main__":
+    main()
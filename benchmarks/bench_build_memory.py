@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Build time and peak memory across library sizes
+
+Builds an index over synthetic libraries of increasing size in fresh
+processes and reports the peak resident memory, the size of the finished
+index (FAISS vectors plus the stored embedding matrix) and the difference,
+which is the memory the build pipeline itself needed. With chunked
+building that overhead should stay flat as the library grows (Linux only).
+
+Usage:
+    python -m benchmarks.bench_build_memory [--sizes 1000 4000 16000] [--dim 384]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from .pdfgen import build_pdf
+from .synthetic import create_storage, create_zotero_database
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUILD_SNIPPET = """
+import contextlib, io, time
+from fast_pdf_opener import ZoteroRAG
+from benchmarks.encoders import HashingEncoder
+with contextlib.redirect_stdout(io.StringIO()):
+    rag = ZoteroRAG({zotero_dir!r}, index_type='flat')
+    rag.model = HashingEncoder({dim})
+    start = time.perf_counter()
+    rag.build_index()
+    seconds = time.perf_counter() - start
+index_bytes = rag.faiss_index.ntotal * rag.faiss_index.d * 4 + rag.embeddings.nbytes
+with open('/proc/self/status') as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+print("RESULT", seconds, peak_kb, index_bytes)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index build memory benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000])
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    lines = [f"Synthetic paper text line {line}" for line in range(40)]
+    pdf_bytes = build_pdf([lines] * 3)
+    print(f"{'documents':>9} {'build (s)':>10} {'peak RSS (MB)':>14} "
+          f"{'index (MB)':>11} "
+          f"{'overhead (MB)':>14}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as zotero_dir:
+            keys = create_zotero_database(os.path.join(zotero_dir, "zotero.sqlite"),
+                                          size)
+            create_storage(zotero_dir, keys, pdf_bytes)
+            code = BUILD_SNIPPET.format(zotero_dir=zotero_dir, dim=args.dim)
+            result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True)
+            seconds, peak_kb, index_bytes = result.stdout.split("RESULT")[-1].split()
+            peak_mb = int(peak_kb) / 1024
+            index_mb = int(index_bytes) / 2**20
+            print(f"{size:>9} {float(seconds):>10.1f} {peak_mb:>14.0f} "
+                  f"{index_mb:>11.0f} "
+                  f"{peak_mb - index_mb:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
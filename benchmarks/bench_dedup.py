@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Duplicate PDFs: redundant extraction and encoding, with and without grouping
+
+Generates a synthetic library, then adds byte-identical copies of a
+fraction of its papers (--identical) and, for another fraction, a pair of
+revised versions that differ in a few lines (--versions, like arXiv v1 and
+v2). Builds the index with duplicate grouping off and on and reports the
+files extracted, the documents encoded and the build time of each, how many
+of the planted groups were found exactly and how many groups were not
+planted, and the share of top 5 results that repeat a paper already listed
+for queries about the revised papers. Without --chunked only the first
+PDF_TEXT_CHARS of each PDF are compared, so revisions whose changes fall
+there are less similar, and some end up below NEAR_DUPLICATE_THRESHOLD.
+
+Usage:
+    python -m benchmarks.bench_dedup [--items 2000] [--identical 0.1] [--versions 0.1]
+        [--changed-lines 2] [--chunked]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from fast_pdf_opener import Profiler, ZoteroRAG
+
+from .encoders import HashingEncoder
+from .pdfgen import build_pdf
+from .synthetic import COMMON_WORDS, N_TOPICS, add_paper, create_library
+
+
+def revised_versions(j: int, rng: random.Random, changed_lines: int, lines: int = 40):
+    """Page lines of a paper and of a revision with ``changed_lines`` rewritten."""
+    vocabulary = COMMON_WORDS + [f"revision{j}", f"finding{j}", f"dataset{j % 7}"]
+    original = [f"Revised study {j}"] + [
+        " ".join(rng.choice(vocabulary) for _ in range(12)) for _ in range(lines - 1)]
+    revision = list(original)
+    for line in rng.sample(range(1, lines), changed_lines):
+        revision[line] = " ".join(rng.choice(vocabulary) for _ in range(12))
+    return [original], [revision]
+
+
+def attachment_path(storage_dir: str, key: str) -> str:
+    folder = os.path.join(storage_dir, key)
+    return os.path.join(folder, os.listdir(folder)[0])
+
+
+def build(zotero_dir: str, args, deduplicate: bool):
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = ZoteroRAG(zotero_dir, index_type='flat', chunked=args.chunked,
+                        deduplicate=deduplicate)
+        rag.query_cache = None
+        rag.model = HashingEncoder(args.dim)
+        rag.profiler = Profiler()
+        start = time.perf_counter()
+        rag.build_index()
+        seconds = time.perf_counter() - start
+    return rag, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Duplicate PDF benchmark")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--identical", type=float, default=0.1,
+                        help="Fraction of papers imported a second time")
+    parser.add_argument("--versions", type=float, default=0.1,
+                        help="Papers added as two revised versions, as a fraction of "
+                             "--items")
+    parser.add_argument("--changed-lines", type=int, default=2,
+                        help="Lines (of 40) rewritten in each revision")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--chunked", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        print(f"Generating a synthetic library of {args.items} items...")
+        keys = create_library(zotero_dir, args.items, page_range=(1, 3))
+        storage_dir = os.path.join(zotero_dir, "storage")
+        planted = set()
+        seed = args.items
+        for i in rng.sample(range(args.items), round(args.items * args.identical)):
+            path = os.path.join(storage_dir, keys[i], f"paper_{i}.pdf")
+            with open(path, 'rb') as f:
+                # Same title: copies of different papers are never grouped
+                title = f"Synthetic paper {i} on topic {i % N_TOPICS}"
+                copy_key = add_paper(zotero_dir, title, f.read(), seed)
+            planted.add(frozenset([path, attachment_path(storage_dir, copy_key)]))
+            seed += 1
+        n_versions = round(args.items * args.versions)
+        for j in range(n_versions):
+            paths = []
+            versions = revised_versions(j, rng, args.changed_lines)
+            for pages in versions:
+                key = add_paper(zotero_dir, f"Revised study {j}", build_pdf(pages),
+                                seed)
+                paths.append(attachment_path(storage_dir, key))
+                seed += 1
+            planted.add(frozenset(paths))
+        n_files = args.items + len(planted) + n_versions
+
+        print(f"{n_files} files: {args.items} papers, {len(planted) - n_versions} "
+              "identical copies, "
+              f"{n_versions} papers in two versions ({args.changed_lines} of 40 lines "
+              "changed)")
+        print(f"{'grouping':>9} {'extracted':>10} {'encoded':>8} {'vectors':>8} "
+              f"{'build s':>8} "
+              f"{'groups found':>13} {'unplanted':>10} {'repeats in top 5':>17}")
+        for deduplicate in (False, True):
+            rag, seconds = build(zotero_dir, args, deduplicate)
+            extracted = n_files - rag.profiler.counters['identical_duplicates']
+            groups = {frozenset([doc['path']]
+                                + [alt['path'] for alt in doc['duplicates']])
+                      for doc in rag.documents if doc.get('duplicates')}
+            repeats = results = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                for j in range(n_versions):
+                    hits = rag.search(f"Revised study {j} revision{j} finding{j}",
+                                      top_k=5, mode='lexical')
+                    titles = [doc['title'] for doc, _ in hits]
+                    repeats += len(titles) - len(set(titles))
+                    results += len(titles)
+            print(f"{'on' if deduplicate else 'off':>9} {extracted:>10} "
+                  f"{len(rag.documents):>8} "
+                  f"{rag.faiss_index.ntotal:>8} {seconds:>8.2f} "
+                  f"{len(groups & planted):>6}/{len(planted):<6} "
+                  f"{len(groups - planted):>10} "
+                  f"{repeats / max(results, 1):>17.1%}")
+
+
+if __name__ == "__main__":
+    main()
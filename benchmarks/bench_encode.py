@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Corpus encoding throughput: plain model.encode() vs. token-budget batches
+
+Encodes a corpus mixing title-only entries with long ones (metadata plus
+2000 characters of PDF text), in ENCODE_CHUNK_SIZE chunks as build_index()
+does, once with model.encode()'s fixed batch size and once with
+encode_texts(), which batches by tokenized length under a token budget.
+Reports documents per second, the padded tokens processed and the peak
+memory allocated while encoding (the latter two for the stand-in encoder,
+which pads and attends like a transformer; --model uses the real one).
+
+Usage:
+    python -m benchmarks.bench_encode [--documents 4000] [--title-fraction 0.5]
+        [--model]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from fast_pdf_opener import (ENCODE_CHUNK_SIZE, ENCODE_MAX_BATCH, ENCODE_TOKEN_BUDGET,
+                             MODEL_NAME, PDF_TEXT_CHARS, encode_texts)
+
+from .encoders import PaddedAttentionEncoder
+from .synthetic import COMMON_WORDS, N_TOPICS, topic_words
+
+
+def mixed_corpus(n_documents: int, title_fraction: float, seed: int = 0):
+    """Search texts as built for the index: metadata only, or metadata plus PDF text."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n_documents):
+        text = (f"passage: Synthetic paper {i} on topic {i % N_TOPICS} Author{i} "
+                f"Journal {i % 50} {1990 + i % 35}")
+        if rng.random() >= title_fraction:
+            vocabulary = COMMON_WORDS + topic_words(i % N_TOPICS)
+            words = []
+            while sum(len(word) + 1 for word in words) < PDF_TEXT_CHARS:
+                words.append(rng.choice(vocabulary))
+            text += " " + " ".join(words)[:PDF_TEXT_CHARS]
+        corpus.append(text)
+    return corpus
+
+
+def run(encode, corpus):
+    """Encode ``corpus`` chunk by chunk; return (embeddings, seconds, peak MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = [encode(corpus[i:i + ENCODE_CHUNK_SIZE])
+              for i in range(0, len(corpus), ENCODE_CHUNK_SIZE)]
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return np.vstack(chunks), seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corpus encoding benchmark")
+    parser.add_argument("--documents", type=int, default=4000)
+    parser.add_argument("--title-fraction", type=float, default=0.5,
+                        help="Fraction of entries without PDF text")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Batch size of the plain model.encode() call")
+    parser.add_argument("--token-budget", type=int, default=ENCODE_TOKEN_BUDGET)
+    parser.add_argument("--max-batch", type=int, default=ENCODE_MAX_BATCH)
+    parser.add_argument("--model", action="store_true",
+                        help="Use the real sentence transformer instead of the "
+                             "stand-in encoder")
+    args = parser.parse_args()
+
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(MODEL_NAME)
+    else:
+        model = PaddedAttentionEncoder()
+    corpus = mixed_corpus(args.documents, args.title_fraction)
+    # Warm up
+    model.encode(corpus[:8])
+
+    print(f"{args.documents} documents, {args.title_fraction:.0%} title only, "
+          f"token budget {args.token_budget}, max batch {args.max_batch}")
+    print(f"{'method':>14} {'docs/s':>8} {'padded tokens':>14} {'peak MB':>8}")
+    results = {}
+    for name, encode in [
+        ('encode()', lambda texts: model.encode(texts, batch_size=args.batch_size)),
+        ('encode_texts()', lambda texts: encode_texts(model, texts, args.token_budget,
+                                                      args.max_batch)),
+    ]:
+        padded_before = getattr(model, 'padded_tokens', 0)
+        embeddings, seconds, peak = run(encode, corpus)
+        padded = getattr(model, 'padded_tokens', 0) - padded_before
+        results[name] = embeddings
+        print(f"{name:>14} {len(corpus) / seconds:>8.1f} "
+              f"{padded if padded else '-':>14} "
+              f"{peak:>8.0f}")
+    same = np.allclose(results['encode()'], results['encode_texts()'], atol=1e-3)
+    print(f"embeddings in the same order: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Encoder backends: throughput and retrieval quality against fp32
+
+Encodes a mixed corpus (titles and 2000-character passages) with the fp32
+torch model, then with each of --backends and with EncodePools of
+--workers processes. For each configuration it reports documents per
+second, the speedup over fp32, the mean and lowest cosine similarity of
+its document embeddings to the fp32 ones, and recall@10: the share of the
+fp32 top 10 documents for --queries queries it also returns (queries and
+documents both encoded with the configuration under test).
+
+Without --model a small randomly initialised BERT is generated so the
+benchmark runs offline; its speed ratios are indicative only.
+
+Usage:
+    python -m benchmarks.bench_encoders [--documents 2000] [--backends int8 onnx]
+        [--workers 2 4] [--model intfloat/e5-large-v2]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from fast_pdf_opener import ENCODER_BACKENDS, EncodePool, encode_texts, load_encoder
+
+from .bench_encode import mixed_corpus
+from .encoders import create_tiny_transformer
+from .synthetic import N_TOPICS, topic_words
+
+
+def normalized(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype='float32')
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def top_k(queries: np.ndarray, documents: np.ndarray, k: int = 10) -> np.ndarray:
+    return np.argsort(-(queries @ documents.T), axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder backend benchmark")
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--backends", nargs="+", default=["int8", "onnx"],
+                        choices=[b for b in ENCODER_BACKENDS if b != 'torch'])
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[2, os.cpu_count() or 1],
+                        help="EncodePool sizes to run (fp32)")
+    parser.add_argument("--model",
+                        help="Sentence transformer to benchmark (default: a small "
+                             "generated model)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_name = args.model or create_tiny_transformer(os.path.join(tmp, "tiny"),
+                                                           hidden_size=384, layers=6)
+        corpus = mixed_corpus(args.documents, 0.5)
+        rng = np.random.default_rng(0)
+        queries = [f"query: {' '.join(topic_words(topic)[:2])} synthetic paper"
+                   for topic in rng.integers(0, N_TOPICS, args.queries)]
+
+        def run(encoder):
+            encoder.encode(corpus[:8])  # warm up
+            start = time.perf_counter()
+            documents = encode_texts(encoder, corpus)
+            seconds = time.perf_counter() - start
+            query_embeddings = encode_texts(encoder, queries)
+            return normalized(documents), normalized(query_embeddings), seconds
+
+        reference, reference_queries, reference_seconds = run(load_encoder(model_name))
+        reference_top = top_k(reference_queries, reference)
+        print(f"{args.documents} documents, {args.queries} queries, model "
+              f"{args.model or 'generated'}, {os.cpu_count()} cores")
+        print(f"{'encoder':>16} {'docs/s':>8} {'speedup':>8} {'mean cos':>9} "
+              f"{'min cos':>8} {'recall@10':>10}")
+
+        def report(label, documents, query_embeddings, seconds):
+            cosines = (documents * reference).sum(axis=1)
+            found = top_k(query_embeddings, documents)
+            recall = np.mean([len(set(a) & set(b)) / len(a)
+                              for a, b in zip(found, reference_top)])
+            print(f"{label:>16} {len(corpus) / seconds:>8.1f} "
+                  f"{reference_seconds / seconds:>7.2f}x "
+                  f"{cosines.mean():>9.4f} {cosines.min():>8.4f} {recall:>10.3f}")
+
+        report("torch fp32", reference, reference_queries, reference_seconds)
+        for backend in args.backends:
+            try:
+                encoder = load_encoder(model_name, backend)
+            except Exception as e:
+                print(f"{backend:>16} unavailable: {str(e).splitlines()[0]}")
+                continue
+            report(backend, *run(encoder))
+        for workers in dict.fromkeys(args.workers):
+            start = time.perf_counter()
+            pool = EncodePool(model_name, workers)
+            try:
+                # Waits for every worker to load the model
+                pool.encode(corpus[:workers])
+                startup = time.perf_counter() - start
+                report(f"{workers} processes", *run(pool))
+            finally:
+                pool.close()
+            print(f"{'':>16} ({pool.threads} torch threads each, {startup:.1f} s to "
+                  "start)")
+
+
+if __name__ == "__main__":
+    main()
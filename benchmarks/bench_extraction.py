@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark full-document PDF extraction against page-bounded early exit
+
+Times extracting single PDFs of --pages pages in full and up to the
+PDF_TEXT_CHARS budget, then builds an index over a synthetic library of
+--items papers of up to --build-pages pages twice: reading every page, as
+before the budget, and stopping at the budget, as build_index() does.
+
+Usage:
+    python -m benchmarks.bench_extraction [--pages 10 100 300] [--repeat 3]
+        [--items 50] [--build-pages 100]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from fast_pdf_opener import PDF_TEXT_CHARS, ZoteroRAG, extract_pdf_text
+
+from .encoders import HashingEncoder
+from .pdfgen import write_pdf
+from .synthetic import create_library
+
+WORDS = ("retrieval embedding transformer attention gradient corpus dense sparse "
+         "index vector library citation benchmark latency throughput model").split()
+
+
+def make_document(path: str, n_pages: int, lines_per_page: int = 60, seed: int = 0):
+    """Write a PDF with ``n_pages`` pages of pseudo-random prose."""
+    rng = random.Random(seed)
+    pages = [
+        [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        for _ in range(n_pages)
+    ]
+    write_pdf(path, pages)
+
+
+def time_extraction(path: str, max_chars, repeat: int) -> float:
+    """Return the best wall-clock time of ``repeat`` extractions."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_pdf_text(path, max_chars)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_build(zotero_dir: str, max_chars) -> float:
+    """Seconds to build a flat index of the library, reading ``max_chars`` per PDF."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = ZoteroRAG(zotero_dir, index_type='flat', deduplicate=False)
+        rag.query_cache = None
+        rag.model = HashingEncoder(384)
+        rag.max_text_chars = max_chars
+        start = time.perf_counter()
+        rag.build_index()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF extraction benchmark")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--items", type=int, default=50,
+                        help="Papers in the build library")
+    parser.add_argument("--build-pages", type=int, default=100,
+                        help="Most pages of a paper in the build library")
+    args = parser.parse_args()
+    
+    print(f"{'pages':>6} {'full (s)':>10} {'budget (s)':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_pages in args.pages:
+            path = os.path.join(tmp, f"doc_{n_pages}.pdf")
+            make_document(path, n_pages)
+            full = time_extraction(path, None, args.repeat)
+            bounded = time_extraction(path, PDF_TEXT_CHARS, args.repeat)
+            print(f"{n_pages:>6} {full:>10.3f} {bounded:>11.4f} "
+                  f"{full / bounded:>7.1f}x")
+            
+        zotero_dir = os.path.join(tmp, "zotero")
+        create_library(zotero_dir, args.items, page_range=(1, args.build_pages))
+        full = time_build(zotero_dir, None)
+        bounded = time_build(zotero_dir, PDF_TEXT_CHARS)
+        print(f"\nbuild_index() over {args.items} papers of 1-{args.build_pages} "
+              "pages: "
+              f"{full:.2f} s reading every page, {bounded:.2f} s with the budget "
+              f"({full / bounded:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Federated search: one index per library vs. one index over all of them
+
+Splits synthetic documents between --shards libraries, saves an index per
+library and one over all documents, and answers the same queries from the
+single index and from a FederatedSearch over the shards (with one search
+thread, and one per shard), in every search mode and for hybrid search
+reranked by a stand-in cross-encoder. Reports queries per second and how
+often the merged top 1 and top k match the single index's, then the time
+reload() takes when no shard changed and when one of them was rewritten.
+
+Usage:
+    python -m benchmarks.bench_federated [--documents 300000] [--shards 3]
+        [--queries 500]
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import os
+import tempfile
+import time
+import uuid
+
+import faiss
+import numpy as np
+
+from fast_pdf_opener import FederatedSearch, LexicalIndex, ZoteroRAG, create_faiss_index
+
+from .bench_index_io import synthetic_documents
+from .encoders import HashingEncoder, PhraseCrossEncoder
+
+
+def make_rag(zotero_dir: str, documents, embeddings: np.ndarray) -> ZoteroRAG:
+    """A ZoteroRAG over given documents and embeddings, with a keyword index."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = ZoteroRAG(zotero_dir, index_type='flat')
+    rag.query_cache = None
+    rag.model = HashingEncoder(embeddings.shape[1])
+    rag.documents = documents
+    rag.faiss_index = create_faiss_index(embeddings.shape[1], len(embeddings), 'flat')
+    rag.faiss_index.add(embeddings)
+    rag.lexical_index = LexicalIndex()
+    rag.lexical_index.add([f"{doc['title']} {doc['author']} {doc['journal']}"
+                           for doc in documents])
+    rag.build_id = uuid.uuid4().hex
+    rag.reranker = "stand-in"
+    rag.cross_encoder = PhraseCrossEncoder(0)
+    return rag
+
+
+def queries_per_second(search, queries, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            search(queries)
+        best = min(best, time.perf_counter() - start)
+    return len(queries) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Federated search benchmark")
+    parser.add_argument("--documents", type=int, default=300_000)
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    documents = list(synthetic_documents(args.documents))
+    embeddings = rng.standard_normal((args.documents, args.dim)).astype('float32')
+    faiss.normalize_L2(embeddings)
+    queries = [f"Synthetic paper {i} Author {i % 997}"
+               for i in rng.integers(0, args.documents, args.queries)]
+    bounds = np.linspace(0, args.documents, args.shards + 1).astype(int)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single = make_rag(tmp, documents, embeddings)
+        shards = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+                rag = make_rag(tmp, documents[start:end], embeddings[start:end])
+                rag.save_index(os.path.join(tmp, f"library{i}.zrag"))
+                shards[f"library{i}"] = rag
+
+        print(f"{args.documents} documents in {args.shards} libraries, "
+              f"{args.queries} queries, top_k={args.top_k}, {os.cpu_count()} cores")
+        print(f"{'mode':>8} {'single index':>13} {'1 thread':>10} "
+              f"{f'{args.shards} threads':>11} {'same top 1':>11} {'same top k':>11}")
+        federations = []
+        for workers in (1, args.shards):
+            federation = FederatedSearch(workers)
+            for name, rag in shards.items():
+                federation.add_library(name, rag, os.path.join(tmp, f"{name}.zrag"))
+            federations.append(federation)
+        for mode in ('dense', 'hybrid', 'lexical', 'rerank'):
+            options = (dict(mode='hybrid', rerank=True) if mode == 'rerank'
+                       else dict(mode=mode, rerank=False))
+            rates = [queries_per_second(lambda q: searcher.search_many(q, args.top_k,
+                                                                       **options),
+                                        queries)
+                     for searcher in [single] + federations]
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = single.search_many(queries, args.top_k, **options)
+                merged = federations[-1].search_many(queries, args.top_k, **options)
+            paths = [([doc['path'] for doc, _ in a], [doc['path'] for doc, _ in b])
+                     for a, b in zip(expected, merged)]
+            same_top = np.mean([a[:1] == b[:1] for a, b in paths])
+            same = np.mean([a == b for a, b in paths])
+            print(f"{mode:>8} {rates[0]:>9.0f} q/s {rates[1]:>6.0f} q/s "
+                  f"{rates[2]:>7.0f} q/s {same_top:>11.0%} {same:>11.0%}")
+
+        federation = federations[-1]
+        with contextlib.redirect_stdout(io.StringIO()):
+            federation.load()
+        start = time.perf_counter()
+        federation.reload()
+        unchanged = time.perf_counter() - start
+        # Rewrite one library's index from a separate copy, as an updating process would
+        writer = copy.copy(federation.shards['library0'])
+        writer.documents = list(writer.documents)
+        writer.build_id = uuid.uuid4().hex
+        with contextlib.redirect_stdout(io.StringIO()):
+            writer.save_index(os.path.join(tmp, "library0.zrag"))
+            start = time.perf_counter()
+            reloaded = federation.reload()
+        one_changed = time.perf_counter() - start
+        print(f"reload(): {unchanged * 1000:.2f} ms with no library changed, "
+              f"{one_changed * 1000:.2f} ms reopening {reloaded}")
+        for federation in federations:
+            federation.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Filtered search latency: post-filtering vs. filters pushed into the index
+
+Builds indexes over synthetic documents and runs dense queries with filters
+of increasing selectivity. Each filter is answered three ways: searching
+unfiltered for top_k * --overfetch hits and dropping non-matching ones
+afterwards (the hits left are usually fewer than top_k), passing the filter
+to FAISS as an ID selector, and the default search(filters=...), which
+scores small selections exactly from the stored embeddings.
+
+Usage:
+    python -m benchmarks.bench_filters [--documents 100000]
+        [--index-types flat ivf-flat hnsw]
+"""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+import numpy as np
+
+import fast_pdf_opener
+from fast_pdf_opener import (MetadataIndex, create_faiss_index, normalize_filters,
+                             train_faiss_index)
+
+from .bench_search_many import build_rag
+from .encoders import HashingEncoder
+
+FILTERS = [
+    ('broad', {'year': '1991-'}),
+    ('one year', {'year': 2005}),
+    ('journal', {'journal': 'Journal 7'}),
+    ('tag + year', {'tag': 'tag3', 'year': '2010-2014'}),
+    ('author', {'author': 'Author 5'}),
+]
+
+
+def time_queries(search, queries):
+    """Mean milliseconds per query and mean number of results."""
+    n_results = 0
+    start = time.perf_counter()
+    for query in queries:
+        n_results += len(search(query))
+    return (time.perf_counter() - start) / len(queries) * 1000, n_results / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filtered search benchmark")
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--overfetch", type=int, default=10,
+                        help="Unfiltered hits fetched per result for post-filtering")
+    parser.add_argument("--index-types", nargs="+",
+                        default=["flat", "ivf-flat", "hnsw"])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = [f"Synthetic paper {i} Author {i % 997} Journal {i % 50}"
+               for i in rng.integers(0, args.documents, args.queries)]
+
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        rag = build_rag(zotero_dir, args.documents, args.dim)
+        rag.model = HashingEncoder(args.dim)
+        for i, doc in enumerate(rag.documents):
+            doc['item_tags'] = [f"tag{i % 20}"]
+        rag.metadata_index = MetadataIndex.build(rag.documents)
+        embeddings = rag.faiss_index.reconstruct_n(0, rag.faiss_index.ntotal)
+        rag.embeddings = embeddings
+        positions = {doc['path']: i for i, doc in enumerate(rag.documents)}
+
+        print(f"{args.documents} documents, dim {args.dim}, {args.queries} dense "
+              "queries, "
+              f"top_k={args.top_k}")
+        print(f"{'index':>8} {'filter':>10} {'matches':>8} {'unfiltered':>11} "
+              f"{'post-filter':>16} {'selector':>16} {'search()':>16}")
+        for index_type in args.index_types:
+            rag.faiss_index = create_faiss_index(args.dim, len(embeddings), index_type)
+            train_faiss_index(rag.faiss_index, embeddings)
+            rag.faiss_index.add(embeddings)
+
+            def search(query, **options):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return rag.search(query, mode='dense', **options)
+
+            base_ms, _ = time_queries(lambda q: search(q, top_k=args.top_k), queries)
+            for label, filters in FILTERS:
+                mask = rag.metadata_index.mask(normalize_filters(filters))
+
+                def post_filter(query):
+                    hits = search(query, top_k=args.top_k * args.overfetch)
+                    hits = [hit for hit in hits if mask[positions[hit[0]['path']]]]
+                    return hits[:args.top_k]
+
+                post_ms, post_n = time_queries(post_filter, queries)
+                exact_max = fast_pdf_opener.FILTER_EXACT_MAX_VECTORS
+                fast_pdf_opener.FILTER_EXACT_MAX_VECTORS = 0
+                try:
+                    sel_ms, sel_n = time_queries(
+                        lambda q: search(q, top_k=args.top_k, filters=filters), queries)
+                finally:
+                    fast_pdf_opener.FILTER_EXACT_MAX_VECTORS = exact_max
+                pushed_ms, pushed_n = time_queries(
+                    lambda q: search(q, top_k=args.top_k, filters=filters), queries)
+                print(f"{index_type:>8} {label:>10} {int(mask.sum()):>8} "
+                      f"{base_ms:>8.2f} ms "
+                      f"{post_ms:>8.2f} ms {post_n:>4.1f} {sel_ms:>8.2f} ms "
+                      f"{sel_n:>4.1f} "
+                      f"{pushed_ms:>8.2f} ms {pushed_n:>4.1f}")
+    print("(post-filter, selector and search() columns: ms per query and mean results "
+          "returned)")
+
+
+if __name__ == "__main__":
+    main()
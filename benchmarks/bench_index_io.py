@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Index load time and memory: legacy JSON + .faiss pair vs. index directory
+
+Writes the same synthetic index in both formats and loads each in a fresh
+process, reporting the time to open it, the time to also run one dense
+search, and the peak resident memory of the process (Linux only).
+
+Usage:
+    python -m benchmarks.bench_index_io [--documents 100000] [--dim 1024]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import faiss
+import numpy as np
+
+from fast_pdf_opener import convert_legacy_index, create_faiss_index
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOAD_SNIPPET = """
+import time
+import numpy as np
+from fast_pdf_opener import ZoteroRAG
+rag = ZoteroRAG({zotero_dir!r})
+start = time.perf_counter()
+rag.load_index({index_path!r})
+title = rag.documents[len(rag.documents) // 2]['title']
+opened = time.perf_counter() - start
+query = np.random.default_rng(1).standard_normal((1, {dim})).astype('float32')
+rag.faiss_index.search(query, 10)
+searched = time.perf_counter() - start
+# Peak RSS of this process image (ru_maxrss would include the parent's peak)
+with open('/proc/self/status') as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+print("RESULT", opened, searched, peak_kb)
+"""
+
+
+def synthetic_documents(n_documents: int):
+    """Document dicts shaped like the ones built by scan_storage()."""
+    for i in range(n_documents):
+        key = f"K{i:07d}"
+        yield {
+            'path': f"/zotero/storage/{key}/paper_{i}.pdf",
+            'filename': f"paper_{i}.pdf",
+            'folder': key, 'key': key, 'size': 100_000 + i, 'mtime': 1.7e9 + i,
+            'date_modified': '2024-01-01 00:00:00', 'title': f"Synthetic paper {i}",
+            'author': f"Author {i % 997}", 'year': str(1990 + i % 35),
+            'journal': f"Journal {i % 50}", 'abstract': f"Abstract of paper {i}. " * 20,
+            'tags': '', 'url': '', 'doi': f"10.0000/{i}",
+        }
+
+
+def measure_load(zotero_dir: str, index_path: str, dim: int):
+    code = LOAD_SNIPPET.format(zotero_dir=zotero_dir, index_path=index_path, dim=dim)
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True)
+    opened, searched, max_rss = result.stdout.split("RESULT")[-1].split()
+    return float(opened), float(searched), int(max_rss) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index load benchmark")
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1024)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.documents, args.dim)).astype('float32')
+    faiss.normalize_L2(embeddings)
+    index = create_faiss_index(args.dim, args.documents, 'flat')
+    index.add(embeddings)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "index.json")
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump({'documents': list(synthetic_documents(args.documents)),
+                       'zotero_dir': tmp,
+                       'chunked': False}, f, indent=2, ensure_ascii=False)
+        faiss.write_index(index, os.path.join(tmp, "index.faiss"))
+        del index, embeddings
+
+        index_path = os.path.join(tmp, "index.zrag")
+        convert_legacy_index(legacy_path, index_path)
+
+        print(f"{args.documents} documents, dim {args.dim}")
+        print(f"{'format':>10} {'open (s)':>9} {'open+search (s)':>16} "
+              f"{'peak RSS (MB)':>14}")
+        for label, path in [('json', legacy_path), ('directory', index_path)]:
+            opened, searched, max_rss = measure_load(tmp, path, args.dim)
+            print(f"{label:>10} {opened:>9.3f} {searched:>16.3f} {max_rss:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark Zotero metadata loading and PDF-to-metadata matching at scale
+
+Compares the pivoted, keyed metadata load against the previous per-field
+join and linear per-file metadata scan. The linear scan is quadratic, so it
+is timed on a sample of files and extrapolated.
+
+Usage:
+    python -m benchmarks.bench_metadata [--sizes 1000 10000 100000]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from fast_pdf_opener import load_zotero_metadata, scan_storage
+
+from .synthetic import create_storage, create_zotero_database
+
+# The one-row-per-field query used before metadata loading was pivoted
+LEGACY_QUERY = """
+SELECT items.key, itemAttachments.path, itemData.valueID, fields.fieldName,
+       itemDataValues.value
+FROM items
+LEFT JOIN itemAttachments ON items.itemID = itemAttachments.parentItemID
+LEFT JOIN itemData ON items.itemID = itemData.itemID
+LEFT JOIN fields ON itemData.fieldID = fields.fieldID
+LEFT JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
+WHERE itemAttachments.path IS NOT NULL
+AND itemAttachments.path LIKE '%.pdf'
+"""
+
+
+def time_legacy_query(db_path: str) -> float:
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    metadata = {}
+    for key, path, _, field_name, value in conn.execute(LEGACY_QUERY):
+        entry = metadata.setdefault(key, {'path': path, 'fields': {}})
+        if field_name and value:
+            entry['fields'][field_name] = value
+    conn.close()
+    return time.perf_counter() - start
+
+
+def estimate_legacy_matching(storage_dir: str, metadata: dict, sample: int) -> float:
+    """Time the old linear metadata scan on ``sample`` folders and scale to all."""
+    folders = sorted(os.listdir(storage_dir))
+    sampled = folders[:sample]
+    start = time.perf_counter()
+    for folder_name in sampled:
+        root = os.path.join(storage_dir, folder_name)
+        for key, meta in metadata.items():
+            if key in root or folder_name == key:
+                break
+    elapsed = time.perf_counter() - start
+    return elapsed * len(folders) / max(len(sampled), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metadata loading benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--sample", type=int, default=200,
+                        help="Folders timed for the quadratic legacy matching estimate")
+    args = parser.parse_args()
+    
+    rows = []
+    for n_items in args.sizes:
+        with tempfile.TemporaryDirectory() as zotero_dir:
+            db_path = os.path.join(zotero_dir, "zotero.sqlite")
+            keys = create_zotero_database(db_path, n_items)
+            storage_dir = create_storage(zotero_dir, keys)
+            
+            legacy_query = time_legacy_query(db_path)
+            
+            start = time.perf_counter()
+            metadata = load_zotero_metadata(db_path)
+            load_time = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            pdf_files = scan_storage(storage_dir, metadata)
+            scan_time = time.perf_counter() - start
+            assert all(doc['title'].startswith("Synthetic paper") for doc in pdf_files)
+            
+            legacy_matching = estimate_legacy_matching(storage_dir, metadata,
+                                                       args.sample)
+            rows.append((n_items, legacy_query, load_time, legacy_matching, scan_time))
+    
+    print()
+    print(f"{'items':>8} {'legacy query':>13} {'pivot query':>12} "
+          f"{'legacy match (est.)':>20} {'keyed scan':>11}")
+    for n_items, legacy_query, load_time, legacy_matching, scan_time in rows:
+        print(f"{n_items:>8} {legacy_query:>12.3f}s {load_time:>11.3f}s "
+              f"{legacy_matching:>19.2f}s {scan_time:>10.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Cascade search: first stage alone vs. cross-encoder reranking under budgets
+
+Builds an in-memory index over synthetic documents and searches for
+"Author A Journal J" queries, each matching exactly one document but
+sharing words with many (a bag-of-words first stage often ranks another
+document first). Each first-stage mode is run alone and then with its
+--candidates best documents reranked, without a time budget and with each
+of --budgets. Reports precision at rank 1, the latency percentiles and
+the share of queries whose rerank ran out of budget.
+
+The stand-in cross-encoder scores query phrases found in the document and
+costs --pair-ms per pair; --reranker uses a real cross-encoder instead.
+
+Usage:
+    python -m benchmarks.bench_rerank [--documents 20000] [--budgets 0.05 0.02 0.005]
+        [--reranker cross-encoder/ms-marco-MiniLM-L-6-v2]
+"""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from fast_pdf_opener import RERANK_CANDIDATES, create_faiss_index, encode_texts
+
+from .bench_search_many import build_rag
+from .encoders import HashingEncoder, PhraseCrossEncoder
+from .suite import latency_summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cascade reranking benchmark")
+    parser.add_argument("--documents", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--modes", nargs="+", default=["lexical", "dense", "hybrid"])
+    parser.add_argument("--candidates", type=int, default=RERANK_CANDIDATES)
+    parser.add_argument("--budgets", type=float, nargs="+", default=[0.05, 0.02, 0.005],
+                        help="Per-query rerank budgets in seconds")
+    parser.add_argument("--pair-ms", type=float, default=1.0,
+                        help="Cost per pair of the stand-in cross-encoder")
+    parser.add_argument("--reranker",
+                        help="Cross-encoder to use instead of the stand-in")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    targets = rng.integers(0, args.documents, args.queries)
+    queries = [f"Author {i % 997} Journal {i % 50}" for i in targets]
+
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        rag = build_rag(zotero_dir, args.documents, args.dim)
+        rag.model = HashingEncoder(args.dim)
+        # Embed the documents for a meaningful dense stage
+        embeddings = encode_texts(rag.model,
+                                  [rag._metadata_text(doc) for doc in rag.documents])
+        faiss.normalize_L2(embeddings)
+        rag.faiss_index = create_faiss_index(args.dim, len(embeddings), 'flat')
+        rag.faiss_index.add(embeddings)
+        rag.reranker = args.reranker or "stand-in"
+        rag.rerank_candidates = args.candidates
+        if not args.reranker:
+            rag.cross_encoder = PhraseCrossEncoder(args.pair_ms / 1000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rag.cross_encoder
+        # Targets are looked up by path: each document's is unique
+        target_paths = [rag.documents[i]['path'] for i in targets]
+
+        print(f"{args.documents} documents, {args.queries} queries, "
+              f"{args.candidates} candidates reranked, reranker "
+              f"{args.reranker or 'stand-in'}")
+        print(f"{'first stage':>12} {'rerank budget':>14} {'P@1':>6} {'p50 ms':>8} "
+              f"{'p99 ms':>8} {'over budget':>12}")
+        configurations = [(False, None), (True, None)] + [(True, b)
+                                                          for b in args.budgets]
+        for mode in args.modes:
+            for rerank, budget in configurations:
+                rag.rerank_budget = budget
+                latencies, correct, truncated = [], 0, 0
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for query, path in zip(queries, target_paths):
+                        start = time.perf_counter()
+                        hits = rag._cascade_batch([query], 1, None, None, mode, (),
+                                                  rerank)
+                        latencies.append(time.perf_counter() - start)
+                        (top, *_), (complete,) = hits
+                        correct += bool(top) and \
+                            rag.documents[top[0][0]]['path'] == path
+                        truncated += not complete
+                summary = latency_summary(latencies)
+                label = ("-" if not rerank else "none" if budget is None
+                         else f"{budget * 1000:.0f} ms")
+                print(f"{mode:>12} {label:>14} {correct / len(queries):>6.2f} "
+                      f"{summary['p50_ms']:>8.2f} {summary['p99_ms']:>8.2f} "
+                      f"{truncated / len(queries):>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
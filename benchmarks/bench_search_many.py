@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Query throughput: per-query search() loop vs. batched search_many()
+
+Builds an in-memory index over synthetic documents and answers the same
+query list both ways. The stand-in hashing encoder isolates the FAISS and
+Python overhead; --model uses the real sentence transformer, where batching
+the forward passes is the main gain.
+
+Usage:
+    python -m benchmarks.bench_search_many [--documents 100000] [--queries 2000]
+        [--model]
+"""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from fast_pdf_opener import MODEL_NAME, LexicalIndex, ZoteroRAG, create_faiss_index
+
+from .bench_index_io import synthetic_documents
+from .encoders import HashingEncoder
+
+
+def build_rag(zotero_dir: str, n_documents: int, dimension: int) -> ZoteroRAG:
+    """A ZoteroRAG over synthetic documents with random embeddings."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = ZoteroRAG(zotero_dir)
+    # Measure the search itself, not repeated queries answered from the cache
+    rag.query_cache = None
+    rag.documents = list(synthetic_documents(n_documents))
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((n_documents, dimension)).astype('float32')
+    faiss.normalize_L2(embeddings)
+    rag.faiss_index = create_faiss_index(dimension, n_documents, 'flat')
+    rag.faiss_index.add(embeddings)
+    rag.lexical_index = LexicalIndex()
+    rag.lexical_index.add([f"{doc['title']} {doc['author']} {doc['journal']}"
+                           for doc in rag.documents])
+    return rag
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched search throughput benchmark")
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--model", action="store_true",
+                        help="Encode queries with the real sentence transformer")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = [f"Synthetic paper {i} Author {i % 997} Journal {i % 50}"
+               for i in rng.integers(0, args.documents, args.queries)]
+
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        if args.model:
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer(MODEL_NAME)
+        else:
+            encoder = HashingEncoder(1024)
+        rag = build_rag(zotero_dir, args.documents,
+                        encoder.get_sentence_embedding_dimension())
+        rag.model = encoder
+
+        print(f"{args.documents} documents, {args.queries} queries, top_k={args.top_k}")
+        print(f"{'mode':>7} {'loop (q/s)':>11} {'batched (q/s)':>14} {'speedup':>8}")
+        for mode in ('dense', 'hybrid'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                looped = [rag.search(query, top_k=args.top_k, mode=mode)
+                          for query in queries]
+                loop_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                batched = rag.search_many(queries, top_k=args.top_k, mode=mode)
+                batch_seconds = time.perf_counter() - start
+            assert [[doc['key'] for doc, _ in r] for r in looped] == \
+                   [[doc['key'] for doc, _ in r] for r in batched]
+            print(f"{mode:>7} {args.queries / loop_seconds:>11.0f} "
+                  f"{args.queries / batch_seconds:>14.0f} "
+                  f"{loop_seconds / batch_seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: import time and wall-clock to first search result
+
+Measures ``python -X importtime`` for fast_pdf_opener, checks that importing it
+does not pull in heavy dependencies, and times fresh processes that load a
+saved index and answer one query. Exits non-zero when a heavy module is
+imported eagerly or the import exceeds --max-import-seconds, so it can guard
+against startup regressions.
+
+Usage:
+    python -m benchmarks.bench_startup [--items 500] [--dense]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+from fast_pdf_opener import ZoteroRAG
+
+from .encoders import HashingEncoder
+from .synthetic import create_storage, create_zotero_database
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported by the code paths that need them
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'transformers', 'PyPDF2', 'faiss',
+                 'scipy']
+
+FIRST_RESULT_SNIPPET = """
+import time
+start = time.perf_counter()
+from fast_pdf_opener import ZoteroRAG
+rag = ZoteroRAG({zotero_dir!r}, search_mode={mode!r})
+rag.load_index({index_path!r})
+{setup}
+results = rag.search("Synthetic paper 42 topic 42")
+assert results, "no results"
+print("FIRST_RESULT", time.perf_counter() - start)
+"""
+
+
+def run_python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=REPO_ROOT,
+                          capture_output=True, text=True, check=True)
+
+
+def measure_import() -> Tuple[float, List[str]]:
+    """Cumulative import time of fast_pdf_opener, and the heavy modules it loaded."""
+    code = ("import json, sys, fast_pdf_opener; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    result = run_python(code, "-X", "importtime")
+    cumulative = 0.0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == "fast_pdf_opener":
+            cumulative = int(parts[1]) / 1e6
+    return cumulative, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_first_result(zotero_dir: str, index_path: str, mode: str,
+                         setup: str = "") -> Tuple[float, float]:
+    """Seconds to the first search result, from process and from interpreter start."""
+    code = FIRST_RESULT_SNIPPET.format(zotero_dir=zotero_dir, index_path=index_path,
+                                       mode=mode, setup=setup)
+    start = time.perf_counter()
+    result = run_python(code)
+    total = time.perf_counter() - start
+    in_process = float(result.stdout.split("FIRST_RESULT")[-1])
+    return total, in_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dense", action="store_true",
+                        help="Also time a dense query with the real embedding model")
+    parser.add_argument("--max-import-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    
+    import_time, eager = measure_import()
+    print(f"import fast_pdf_opener: {import_time * 1000:.1f} ms")
+    print(f"heavy modules imported eagerly: {eager or 'none'}")
+    
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        keys = create_zotero_database(os.path.join(zotero_dir, "zotero.sqlite"),
+                                      args.items)
+        create_storage(zotero_dir, keys)
+        index_path = os.path.join(zotero_dir, "index.zrag")
+        rag = ZoteroRAG(zotero_dir)
+        rag.model = HashingEncoder()
+        rag.build_index()
+        rag.save_index(index_path)
+        
+        modes = [('lexical', 'lexical', ''),
+                 ('hybrid (stand-in encoder)', 'hybrid',
+                  'from benchmarks.encoders import HashingEncoder; rag.model = '
+                  'HashingEncoder()')]
+        if args.dense:
+            modes.append(('dense (real model)', 'dense', ''))
+        print()
+        print(f"{'mode':>26} {'process wall (s)':>17} {'to first result (s)':>20}")
+        for label, mode, setup in modes:
+            timings = [measure_first_result(zotero_dir, index_path, mode, setup)
+                       for _ in range(args.repeat)]
+            total, in_process = min(timings)
+            print(f"{label:>26} {total:>17.3f} {in_process:>20.3f}")
+    
+    if eager or import_time > args.max_import_seconds:
+        print("Startup regression detected")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
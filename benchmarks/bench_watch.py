@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Watch mode: idle polling cost and change-to-searchable latency
+
+Builds and saves an index over a synthetic library, then runs a
+LibraryWatcher on it in a background thread. Reports the CPU the watcher
+uses while the library is idle (next to the cost of one full
+update_index(), which re-reads the database and re-walks storage), and
+the time from a change being written to the Zotero database until it is
+searchable, for a new paper, a renamed one, a deleted one and a burst of
+new papers, which should be indexed in one update.
+
+Usage:
+    python -m benchmarks.bench_watch [--items 2000] [--idle 10] [--poll 0.5]
+        [--debounce 0.5]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from fast_pdf_opener import LibraryWatcher, ZoteroRAG
+
+from .encoders import HashingEncoder
+from .pdfgen import build_pdf
+from .synthetic import add_paper, create_library, delete_paper, rename_paper
+
+
+def wait_for_update(watcher: LibraryWatcher, updates: int,
+                    timeout: float = 120.0) -> float:
+    """Wait until the watcher has applied over ``updates`` updates; returns the time."""
+    deadline = time.time() + timeout
+    while watcher.updates <= updates:
+        if time.time() > deadline:
+            raise TimeoutError("the watcher did not pick up the change")
+        time.sleep(0.005)
+    return time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch mode benchmark")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--idle", type=float, default=10.0,
+                        help="Seconds of idle watching")
+    parser.add_argument("--poll", type=float, default=0.5, help="Watcher poll interval")
+    parser.add_argument("--debounce", type=float, default=0.5, help="Watcher debounce")
+    parser.add_argument("--burst", type=int, default=10,
+                        help="Papers added in the burst")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        print(f"Generating a synthetic library of {args.items} items...")
+        keys = create_library(zotero_dir, args.items, page_range=(1, 3))
+        index_path = os.path.join(zotero_dir, "index.zrag")
+        with contextlib.redirect_stdout(io.StringIO()):
+            rag = ZoteroRAG(zotero_dir, index_type='flat', search_mode='lexical')
+            rag.query_cache = None
+            rag.model = HashingEncoder(args.dim)
+            rag.build_index()
+            rag.save_index(index_path)
+            start = time.perf_counter()
+            rag.update_index()
+            full_update = time.perf_counter() - start
+            watcher = LibraryWatcher(rag, index_path, args.poll, args.debounce)
+        print(f"Full update_index() with nothing changed: {full_update * 1000:.0f} ms")
+
+        # The watcher prints its progress; results are printed once it has stopped
+        lines = []
+        thread = threading.Thread(target=watcher.run, daemon=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cpu_start = time.process_time()
+            thread.start()
+            time.sleep(args.idle)
+            idle_cpu = time.process_time() - cpu_start
+            stats = watcher.stats()
+            lines.append(f"Idle for {args.idle:.0f} s polling every {args.poll} s: "
+                         f"{stats['ticks']} polls, "
+                         f"{idle_cpu / args.idle * 100:.3f}% CPU, "
+                         f"{stats['cpu_ms_per_tick']:.3f} ms CPU per poll")
+
+            pdf_bytes = build_pdf([["A freshly added paper about zebrafish"]])
+
+            def measure(label, change, query, present=True):
+                updates = watcher.updates
+                start = time.time()
+                change()
+                searchable = wait_for_update(watcher, updates) - start
+                # Let a burst that outlasted the debounce finish too
+                time.sleep(args.debounce + args.poll)
+                hits = rag.search(query, top_k=args.burst)
+                found = any(query in doc['title'] for doc, _ in hits)
+                lines.append(f"{label:>26}: searchable after {searchable:5.2f} s, "
+                             f"{watcher.updates - updates} update(s), "
+                             f"{'ok' if found == present else 'WRONG RESULTS'}")
+
+            title = "Zebrafish regeneration"
+            measure("new paper", lambda: add_paper(zotero_dir, title, pdf_bytes, 1),
+                    "Zebrafish")
+            measure("renamed paper",
+                    lambda: rename_paper(zotero_dir, keys[0], "Axolotl limb regrowth"),
+                    "Axolotl")
+            measure("deleted paper", lambda: delete_paper(zotero_dir, keys[0]),
+                    "Axolotl", present=False)
+
+            def burst():
+                for i in range(args.burst):
+                    # Distinct PDFs, or duplicate grouping would fold them together
+                    pdf = build_pdf([[f"Platypus venom study {i}"]])
+                    add_paper(zotero_dir, f"Platypus venom study {i}", pdf, 100 + i)
+                    time.sleep(args.debounce / 4)
+            measure(f"burst of {args.burst} new papers", burst, "Platypus")
+            watcher.stop()
+            thread.join()
+        print("\n".join(lines))
+        print(f"Watcher: {watcher.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Stand-in encoders so benchmarks run without network access or model downloads
+"""
+
+import re
+import zlib
+from typing import List
+
+import numpy as np
+
+
+class HashingEncoder:
+    """Deterministic bag-of-words feature-hashing encoder.
+    
+    Implements the subset of SentenceTransformer's interface used by
+    ZoteroRAG, so it can be assigned to ``ZoteroRAG.model``.
+    """
+    
+    TOKEN_PATTERN = re.compile(r"\w+")
+    tokenizer = None
+    
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: List[str], batch_size: int = 32,
+               show_progress_bar: bool = None, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        for row, sentence in enumerate(sentences):
+            for token in self.TOKEN_PATTERN.findall(sentence.lower()):
+                h = zlib.crc32(token.encode('utf-8'))
+                embeddings[row, h % self.dimension] += 1.0 if h & 0x80000000 else -1.0
+        return embeddings
+
+
+class PaddedAttentionEncoder:
+    """Encoder whose cost and memory follow a transformer's padded batches.
+    
+    Like SentenceTransformer.encode(), it sorts the texts of one call by
+    character length, splits them into batches of ``batch_size`` and pads
+    every batch to its longest text (truncated to ``max_seq_length``
+    tokens). Each batch then runs one self-attention layer over the padded
+    token matrix, so time and memory grow with batch size times the square
+    of the padded length, as they do for the real model. ``padded_tokens``
+    counts the tokens processed, padding included.
+    """
+    
+    TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+    tokenizer = None
+    
+    def __init__(self, dimension: int = 384, width: int = 256,
+                 max_seq_length: int = 512, vocabulary: int = 8192):
+        rng = np.random.default_rng(0)
+        self.dimension = dimension
+        self.max_seq_length = max_seq_length
+        embeddings = rng.standard_normal((vocabulary, width))
+        self.token_embeddings = embeddings.astype(np.float32)
+        self.projection = rng.standard_normal((width, dimension)).astype(np.float32)
+        self.padded_tokens = 0
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _token_ids(self, sentence: str) -> List[int]:
+        ids = [zlib.crc32(token.encode('utf-8')) % len(self.token_embeddings)
+               for token in self.TOKEN_PATTERN.findall(sentence.lower())]
+        return ids[:self.max_seq_length - 2]
+
+    def encode(self, sentences: List[str], batch_size: int = 32,
+               show_progress_bar: bool = None, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        order = np.argsort([-len(sentence) for sentence in sentences], kind='stable')
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            ids = [self._token_ids(sentences[i]) for i in batch]
+            length = max(len(row) for row in ids) + 2
+            padded = np.zeros((len(batch), length), dtype=np.int64)
+            mask = np.zeros((len(batch), length), dtype=np.float32)
+            for row, row_ids in enumerate(ids):
+                padded[row, 1:len(row_ids) + 1] = row_ids
+                mask[row, :len(row_ids) + 2] = 1
+            hidden = self.token_embeddings[padded]
+            attention = hidden @ hidden.transpose(0, 2, 1) / np.sqrt(hidden.shape[2])
+            attention += (mask[:, None, :] - 1) * 1e9
+            attention = np.exp(attention - attention.max(axis=2, keepdims=True))
+            attention /= attention.sum(axis=2, keepdims=True)
+            hidden = attention @ hidden
+            pooled = ((hidden * mask[:, :, None]).sum(axis=1)
+                      / mask.sum(axis=1, keepdims=True))
+            embeddings[batch] = pooled @ self.projection
+            self.padded_tokens += padded.size
+        return embeddings
+
+
+def create_tiny_transformer(path: str, hidden_size: int = 256, layers: int = 4,
+                            seed: int = 0) -> str:
+    """Save a small, randomly initialised BERT sentence transformer under ``path``.
+    
+    It loads with SentenceTransformer(path) (mean pooling) like a real
+    model, so the encoder backends and the encode pool can be benchmarked
+    offline. Its vocabulary holds the synthetic library's words plus single
+    characters and digits for everything else. Returns ``path``.
+    """
+    import os
+
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    from .synthetic import COMMON_WORDS, N_TOPICS, topic_words
+
+    words = list(COMMON_WORDS) + [word for topic in range(N_TOPICS)
+                                  for word in topic_words(topic)]
+    characters = "abcdefghijklmnopqrstuvwxyz0123456789"
+    vocabulary = (["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words
+                  + list(characters) + [f"##{c}" for c in characters]
+                  + ["synthetic", "paper", "on", "topic", "journal"])
+    os.makedirs(path, exist_ok=True)
+    vocabulary_path = os.path.join(path, "vocab.txt")
+    with open(vocabulary_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(dict.fromkeys(vocabulary)))
+    BertTokenizerFast(vocabulary_path).save_pretrained(path)
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=len(dict.fromkeys(vocabulary)),
+                        hidden_size=hidden_size,
+                        num_hidden_layers=layers,
+                        num_attention_heads=max(1, hidden_size // 64),
+                        intermediate_size=4 * hidden_size, max_position_embeddings=512)
+    BertModel(config).save_pretrained(path)
+    return path
+
+
+class PhraseCrossEncoder:
+    """Stand-in cross-encoder that rewards query phrases found in the document.
+    
+    Implements the subset of CrossEncoder's interface used by ZoteroRAG, so
+    it can be assigned to ``ZoteroRAG.cross_encoder``. A pair scores one
+    point per query word bigram occurring in the document and a tenth per
+    query word, so unlike bag-of-words rankings it tells "Author 5 Journal
+    7" from "Author 7 Journal 5". Each pair costs ``seconds_per_pair``,
+    standing in for a transformer forward pass.
+    """
+    
+    TOKEN_PATTERN = re.compile(r"\w+")
+    
+    def __init__(self, seconds_per_pair: float = 0.002):
+        self.seconds_per_pair = seconds_per_pair
+        self.pairs_scored = 0
+
+    def predict(self, pairs, batch_size: int = 32, show_progress_bar: bool = None,
+                **kwargs) -> np.ndarray:
+        import time
+        
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for row, (query, document) in enumerate(pairs):
+            query_tokens = self.TOKEN_PATTERN.findall(query.lower())
+            document_tokens = self.TOKEN_PATTERN.findall(document.lower())
+            bigrams = set(zip(document_tokens, document_tokens[1:]))
+            words = set(document_tokens)
+            query_bigrams = zip(query_tokens, query_tokens[1:])
+            scores[row] = (sum(bigram in bigrams for bigram in query_bigrams)
+                           + 0.1 * sum(token in words for token in query_tokens))
+        time.sleep(self.seconds_per_pair * len(pairs))
+        self.pairs_scored += len(pairs)
+        return scores
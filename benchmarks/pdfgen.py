@@ -0,0 +1,58 @@
+"""
+Minimal PDF writer used to generate benchmark inputs without extra dependencies
+"""
+
+from typing import List
+
+
+def _escape(text: str) -> str:
+    """Escape a string for use inside a PDF literal."""
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(pages: List[List[str]]) -> bytes:
+    """Build a PDF document where each page shows the given lines of text."""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    font_id = 1
+    pages_id = 2 + 2 * len(pages)
+    page_ids = []
+    
+    for lines in pages:
+        ops = ["BT /F1 9 Tf 11 TL 40 760 Td"]
+        for line in lines:
+            ops.append(f"({_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode('latin-1', errors='replace')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream"
+                       % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content_id,
+                                                             font_id)
+        )
+        page_ids.append(len(objects))
+        
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+    catalog_id = len(objects)
+    
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, obj)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_id, xref_offset)
+    return bytes(out)
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a generated PDF to ``path``."""
+    with open(path, 'wb') as f:
+        f.write(build_pdf(pages))
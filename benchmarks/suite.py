@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite over a synthetic Zotero library
+
+Generates a Zotero data directory of the requested size (PDFs of varying
+page counts), then times each stage of fast_pdf_opener separately: metadata
+loading, the storage walk, corpus building (PDF extraction), encoding,
+FAISS index construction, a complete build_index(), save/load, and search
+latency percentiles for every search mode. The stand-in hashing encoder is
+used unless --model is given, so the suite runs offline.
+
+Results are written as JSON; pass a previous results file to --compare to
+print the change per stage.
+
+Usage:
+    python -m benchmarks.suite [--items 1000] [--output results.json]
+        [--compare old.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from fast_pdf_opener import (MODEL_NAME, SEARCH_MODES, ZoteroRAG, create_faiss_index,
+                             encode_texts, resolve_index_type, train_faiss_index)
+
+from .encoders import HashingEncoder
+from .synthetic import N_TOPICS, create_library, topic_words
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence ZoteroRAG's progress output while a stage is timed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def timed(results: Dict, name: str, **extra):
+    """Context manager recording the wall time of a stage under ``results[name]``."""
+    @contextlib.contextmanager
+    def stage():
+        start = time.perf_counter()
+        yield
+        results[name] = dict(seconds=time.perf_counter() - start, **extra)
+        print(f"{name:>24}: {results[name]['seconds']:.3f} s")
+    return stage()
+
+
+def make_queries(n_queries: int, n_items: int, seed: int = 1) -> List[str]:
+    """Title, author and topic queries like the ones users type."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        i = rng.randrange(n_items)
+        kind = rng.randrange(3)
+        if kind == 0:
+            queries.append(f"Synthetic paper {i} on topic {i % N_TOPICS}")
+        elif kind == 1:
+            queries.append(f"Author{i} Journal {i % 50}")
+        else:
+            queries.append(" ".join(topic_words(i % N_TOPICS)[:2]))
+    return queries
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {'mean_ms': float(latencies_ms.mean()),
+            **{f"p{p}_ms": float(np.percentile(latencies_ms, p)) for p in (50, 90, 99)}}
+
+
+def run_suite(zotero_dir: str, args) -> Dict:
+    stages = {}
+    with quiet():
+        rag = ZoteroRAG(zotero_dir, workers=args.workers, index_type=args.index_type)
+    rag.query_cache = None
+    if args.model:
+        from sentence_transformers import SentenceTransformer
+        rag.model = SentenceTransformer(MODEL_NAME)
+    else:
+        rag.model = HashingEncoder(args.dim)
+
+    with timed(stages, 'extract_zotero_metadata'), quiet():
+        metadata = rag.extract_zotero_metadata()
+    stages['extract_zotero_metadata']['items'] = len(metadata)
+
+    with timed(stages, 'find_pdf_files'), quiet():
+        pdf_files = rag.find_pdf_files()
+    stages['find_pdf_files']['files'] = len(pdf_files)
+
+    with timed(stages, 'build_search_corpus'), quiet():
+        corpus = rag.build_search_corpus(pdf_files)
+    stages['build_search_corpus']['files_per_s'] = \
+        len(pdf_files) / stages['build_search_corpus']['seconds']
+
+    with timed(stages, 'encode'):
+        embeddings = np.ascontiguousarray(encode_texts(rag.model, corpus),
+                                          dtype='float32')
+    faiss.normalize_L2(embeddings)
+    n_words = sum(len(text.split()) for text in corpus)
+    stages['encode'].update(docs_per_s=len(corpus) / stages['encode']['seconds'],
+                            words_per_s=n_words / stages['encode']['seconds'])
+
+    index_type = resolve_index_type(args.index_type, len(embeddings))
+    with timed(stages, 'faiss_index', index_type=index_type):
+        index = create_faiss_index(embeddings.shape[1], len(embeddings), index_type)
+        train_faiss_index(index, embeddings)
+        index.add(embeddings)
+
+    with timed(stages, 'build_index'), quiet():
+        rag.build_index()
+
+    index_path = os.path.join(zotero_dir, 'index.zrag')
+    with timed(stages, 'save_index'), quiet():
+        rag.save_index(index_path)
+    with timed(stages, 'load_index'), quiet():
+        rag.load_index(index_path)
+
+    queries = make_queries(args.queries, args.items)
+    search = {}
+    for mode in SEARCH_MODES:
+        with quiet():
+            # The first query maps the index files and warms up the encoder
+            rag.search(queries[0], top_k=args.top_k, mode=mode)
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                rag.search(query, top_k=args.top_k, mode=mode)
+                latencies.append(time.perf_counter() - start)
+        search[mode] = latency_summary(latencies)
+        print(f"{'search ' + mode:>24}: p50 {search[mode]['p50_ms']:.2f} ms, "
+              f"p99 {search[mode]['p99_ms']:.2f} ms")
+
+    return {'stages': stages, 'search': search}
+
+
+def compare(results: Dict, baseline: Dict):
+    """Print the relative change of every timing against a previous run."""
+    print()
+    print(f"{'stage':>24} {'baseline':>10} {'current':>10} {'change':>8}")
+    stages, searches = baseline.get('stages', {}), baseline.get('search', {})
+    rows = [(name, stages[name]['seconds'], stage['seconds'], 's')
+            for name, stage in results['stages'].items() if name in stages]
+    rows += [(f"search {mode} p50", searches[mode]['p50_ms'], summary['p50_ms'], 'ms')
+             for mode, summary in results['search'].items() if mode in searches]
+    for name, old, new, unit in rows:
+        change = (new - old) / old * 100 if old else float('nan')
+        print(f"{name:>24} {old:>8.3f}{unit:<2} {new:>8.3f}{unit:<2} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark suite")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--min-pages", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--index-type", default="auto")
+    parser.add_argument("--dim", type=int, default=384,
+                        help="Stand-in encoder dimension")
+    parser.add_argument("--model", action="store_true",
+                        help="Use the real sentence transformer instead of the "
+                             "stand-in encoder")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare",
+                        help="Previous results JSON file to compare against")
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in
+              ('items', 'min_pages', 'max_pages', 'queries', 'top_k', 'workers',
+               'index_type', 'dim', 'model', 'seed')}
+    environment = {'python': platform.python_version(), 'platform': platform.platform(),
+                   'cpu_count': os.cpu_count(), 'numpy': np.__version__,
+                   'faiss': getattr(faiss, '__version__', 'unknown')}
+
+    with tempfile.TemporaryDirectory() as zotero_dir:
+        print(f"Generating a synthetic library of {args.items} items...")
+        start = time.perf_counter()
+        create_library(zotero_dir, args.items, args.seed,
+                       (args.min_pages, args.max_pages))
+        print(f"Generated in {time.perf_counter() - start:.1f} s")
+        results = {'config': config, 'environment': environment, 'created': time.time(),
+                   **run_suite(zotero_dir, args)}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
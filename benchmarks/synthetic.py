@@ -0,0 +1,319 @@
+"""
+Synthetic Zotero data directories for benchmarks
+
+Creates a ``zotero.sqlite`` with the subset of Zotero's schema read by
+fast_pdf_opener (items, itemAttachments, itemData, fields, creators, tags,
+collections) and a
+``storage/<KEY>/`` folder per PDF attachment. ``create_library`` builds both
+at once, with PDFs of varying length whose text is about each paper's topic.
+``add_paper``, ``rename_paper`` and ``delete_paper`` change a library the way
+Zotero does, for benchmarks of keeping an index up to date.
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import time
+from typing import List, Tuple
+
+from .pdfgen import build_pdf
+
+KEY_ALPHABET = "23456789ABCDEFGHIJKLMNPQRSTUVWXYZ"
+
+FIELDS = ['title', 'date', 'publicationTitle', 'abstractNote', 'extra', 'url', 'DOI']
+
+# Words shared by every document, plus a few per topic so that queries about a
+# topic have relevant documents to find
+COMMON_WORDS = ("method results model data analysis approach evaluation training "
+                "performance baseline experiments proposed learning network").split()
+N_TOPICS = 97
+
+# Tags and (nested) collections items are spread over
+N_TAGS = 20
+N_COLLECTIONS = 8
+
+SCHEMA = """
+CREATE TABLE items (
+    itemID INTEGER PRIMARY KEY,
+    itemTypeID INT NOT NULL,
+    dateAdded TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    dateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT NOT NULL,
+    key TEXT NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0,
+    UNIQUE (libraryID, key)
+);
+CREATE TABLE itemAttachments (
+    itemID INTEGER PRIMARY KEY,
+    parentItemID INT,
+    linkMode INT,
+    contentType TEXT,
+    charsetID INT,
+    path TEXT,
+    syncState INT DEFAULT 0
+);
+CREATE INDEX itemAttachments_parentItemID ON itemAttachments(parentItemID);
+CREATE TABLE fields (
+    fieldID INTEGER PRIMARY KEY,
+    fieldName TEXT,
+    fieldFormatID INT
+);
+CREATE TABLE itemDataValues (
+    valueID INTEGER PRIMARY KEY,
+    value UNIQUE
+);
+CREATE TABLE itemData (
+    itemID INT,
+    fieldID INT,
+    valueID,
+    PRIMARY KEY (itemID, fieldID)
+);
+CREATE TABLE creators (
+    creatorID INTEGER PRIMARY KEY,
+    firstName TEXT,
+    lastName TEXT,
+    fieldMode INT,
+    UNIQUE (lastName, firstName, fieldMode)
+);
+CREATE TABLE itemCreators (
+    itemID INT NOT NULL,
+    creatorID INT NOT NULL,
+    creatorTypeID INT NOT NULL DEFAULT 1,
+    orderIndex INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (itemID, creatorID, creatorTypeID, orderIndex),
+    UNIQUE (itemID, orderIndex)
+);
+CREATE TABLE tags (
+    tagID INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE itemTags (
+    itemID INT NOT NULL,
+    tagID INT NOT NULL,
+    type INT NOT NULL,
+    PRIMARY KEY (itemID, tagID)
+);
+CREATE TABLE collections (
+    collectionID INTEGER PRIMARY KEY,
+    collectionName TEXT NOT NULL,
+    parentCollectionID INT DEFAULT NULL,
+    libraryID INT NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE TABLE collectionItems (
+    collectionID INT NOT NULL,
+    itemID INT NOT NULL,
+    orderIndex INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (collectionID, itemID)
+);
+"""
+
+
+def random_key(rng: random.Random) -> str:
+    """Return a Zotero-style 8 character item key."""
+    return "".join(rng.choice(KEY_ALPHABET) for _ in range(8))
+
+
+def create_zotero_database(db_path: str, n_items: int, seed: int = 0) -> List[str]:
+    """Create a Zotero database with ``n_items`` papers, each with one PDF attachment.
+    
+    Returns the attachment keys, i.e. the storage folder names.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO fields (fieldID, fieldName) VALUES (?, ?)",
+                     list(enumerate(FIELDS, 1)))
+    conn.executemany("INSERT INTO tags VALUES (?, ?)",
+                     [(tag + 1, f"tag{tag}") for tag in range(N_TAGS)])
+    # The second half of the collections are subcollections of the first half
+    conn.executemany("INSERT INTO collections VALUES (?, ?, ?, 1, ?)",
+                     [(c + 1, f"Collection {c}",
+                       c - N_COLLECTIONS // 2 + 1 if c >= N_COLLECTIONS // 2 else None,
+                       f"C{c:07d}")
+                      for c in range(N_COLLECTIONS)])
+    
+    keys = set()
+    while len(keys) < 2 * n_items:
+        keys.add(random_key(rng))
+    keys = list(keys)
+    
+    items, attachments, values, data, creators, item_creators = [], [], {}, [], [], []
+    item_tags, collection_items = [], []
+    for i in range(n_items):
+        parent_id, attachment_id = 2 * i + 1, 2 * i + 2
+        year = 1990 + i % 35
+        modified = f"{year}-01-01 00:00:00"
+        items.append((parent_id, 2, modified, modified, modified, 1, keys[2 * i]))
+        items.append((attachment_id, 3, modified, modified, modified, 1,
+                      keys[2 * i + 1]))
+        attachments.append((attachment_id, parent_id, 0, 'application/pdf', None,
+                            f"storage:paper_{i}.pdf"))
+        
+        item_fields = {
+            'title': f"Synthetic paper {i} on topic {i % N_TOPICS}",
+            'date': f"{year}-00-00 {year}",
+            'publicationTitle': f"Journal {i % 50}",
+            'abstractNote': f"Abstract of synthetic paper {i}.",
+            'url': f"https://example.org/paper/{i}",
+            'DOI': f"10.0000/synthetic.{i}",
+        }
+        for field, value in item_fields.items():
+            value_id = values.setdefault(value, len(values) + 1)
+            data.append((parent_id, FIELDS.index(field) + 1, value_id))
+            
+        creators.append((i + 1, f"First{i}", f"Author{i}", 0))
+        item_creators.append((parent_id, i + 1, 1, 0))
+        item_tags.append((parent_id, i % N_TAGS + 1, 0))
+        collection_items.append((i % N_COLLECTIONS + 1, parent_id, 0))
+        
+    conn.executemany("INSERT INTO items (itemID, itemTypeID, dateAdded, dateModified, "
+                     "clientDateModified, libraryID, key) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     items)
+    conn.executemany("INSERT INTO itemAttachments (itemID, parentItemID, linkMode, "
+                     "contentType, "
+                     "charsetID, path) VALUES (?, ?, ?, ?, ?, ?)", attachments)
+    conn.executemany("INSERT INTO itemDataValues (valueID, value) VALUES (?, ?)",
+                     ((value_id, value) for value, value_id in values.items()))
+    conn.executemany("INSERT INTO itemData VALUES (?, ?, ?)", data)
+    conn.executemany("INSERT INTO creators VALUES (?, ?, ?, ?)", creators)
+    conn.executemany("INSERT INTO itemCreators VALUES (?, ?, ?, ?)", item_creators)
+    conn.executemany("INSERT INTO itemTags VALUES (?, ?, ?)", item_tags)
+    conn.executemany("INSERT INTO collectionItems VALUES (?, ?, ?)", collection_items)
+    conn.commit()
+    conn.close()
+    return [keys[2 * i + 1] for i in range(n_items)]
+
+
+def create_storage(zotero_dir: str, keys: List[str], pdf_bytes: bytes = None) -> str:
+    """Create ``storage/<KEY>/paper_<i>.pdf`` for each attachment key."""
+    if pdf_bytes is None:
+        pdf_bytes = build_pdf([["Synthetic paper"]])
+    storage_dir = os.path.join(zotero_dir, "storage")
+    for i, key in enumerate(keys):
+        folder = os.path.join(storage_dir, key)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"paper_{i}.pdf"), 'wb') as f:
+            f.write(pdf_bytes)
+    return storage_dir
+
+
+def topic_words(topic: int) -> List[str]:
+    """Distinctive words for a synthetic topic (matching the titles' ``topic N``)."""
+    return [f"topic{topic}", f"concept{topic}a", f"concept{topic}b",
+            f"technique{topic}"]
+
+
+def synthetic_pdf(i: int, n_pages: int, rng: random.Random,
+                  lines_per_page: int = 40, words_per_line: int = 12) -> bytes:
+    """PDF of ``n_pages`` pages about paper ``i``'s topic."""
+    vocabulary = COMMON_WORDS + topic_words(i % N_TOPICS) * 2
+    pages = []
+    for page in range(n_pages):
+        lines = [f"Synthetic paper {i} on topic {i % N_TOPICS}"] if page == 0 else []
+        while len(lines) < lines_per_page:
+            words = [rng.choice(vocabulary) for _ in range(words_per_line)]
+            lines.append(" ".join(words))
+        pages.append(lines)
+    return build_pdf(pages)
+
+
+def create_library(zotero_dir: str, n_items: int, seed: int = 0,
+                   page_range: Tuple[int, int] = (1, 20)) -> List[str]:
+    """Create a complete synthetic Zotero data directory.
+    
+    Writes ``zotero.sqlite`` and one PDF per item under ``storage/<KEY>/``,
+    each with a page count drawn uniformly from ``page_range``. Returns the
+    attachment keys.
+    """
+    os.makedirs(zotero_dir, exist_ok=True)
+    keys = create_zotero_database(os.path.join(zotero_dir, "zotero.sqlite"), n_items,
+                                  seed)
+    rng = random.Random(seed)
+    storage_dir = os.path.join(zotero_dir, "storage")
+    for i, key in enumerate(keys):
+        folder = os.path.join(storage_dir, key)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"paper_{i}.pdf"), 'wb') as f:
+            f.write(synthetic_pdf(i, rng.randint(*page_range), rng))
+    return keys
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
+def add_paper(zotero_dir: str, title: str, pdf_bytes: bytes, seed: int = 0) -> str:
+    """Add a paper with a PDF attachment to a library, as Zotero would.
+
+    Returns the attachment key.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(os.path.join(zotero_dir, "zotero.sqlite"))
+    try:
+        parent_id = conn.execute(
+            "SELECT COALESCE(MAX(itemID), 0) + 1 FROM items").fetchone()[0]
+        parent_key, key = random_key(rng), random_key(rng)
+        # The file is in place before Zotero records the attachment
+        folder = os.path.join(zotero_dir, "storage", key)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"paper_{parent_id}.pdf"), 'wb') as f:
+            f.write(pdf_bytes)
+        modified = _now()
+        conn.executemany("INSERT INTO items (itemID, itemTypeID, dateAdded, "
+                         "dateModified, "
+                         "clientDateModified, libraryID, key) VALUES (?, ?, ?, ?, ?, "
+                         "1, ?)",
+                         [(parent_id, 2, modified, modified, modified, parent_key),
+                          (parent_id + 1, 3, modified, modified, modified, key)])
+        conn.execute("INSERT INTO itemAttachments (itemID, parentItemID, linkMode, "
+                     "contentType, "
+                     "path) VALUES (?, ?, 0, 'application/pdf', ?)",
+                     (parent_id + 1, parent_id, f"storage:paper_{parent_id}.pdf"))
+        set_title(conn, parent_id, title)
+        conn.commit()
+    finally:
+        conn.close()
+    return key
+
+
+def set_title(conn: sqlite3.Connection, item_id: int, title: str):
+    """Set an item's title and bump its modification date."""
+    conn.execute("INSERT OR IGNORE INTO itemDataValues (value) VALUES (?)", (title,))
+    value_id = conn.execute("SELECT valueID FROM itemDataValues WHERE value = ?",
+                            (title,)).fetchone()[0]
+    conn.execute("INSERT OR REPLACE INTO itemData VALUES (?, ?, ?)",
+                 (item_id, FIELDS.index('title') + 1, value_id))
+    conn.execute("UPDATE items SET dateModified = ?, clientDateModified = ? WHERE "
+                 "itemID = ?",
+                 (_now(), _now(), item_id))
+
+
+def rename_paper(zotero_dir: str, key: str, title: str):
+    """Change the title of the paper owning attachment ``key``."""
+    conn = sqlite3.connect(os.path.join(zotero_dir, "zotero.sqlite"))
+    try:
+        parent_id = conn.execute("SELECT parentItemID FROM itemAttachments JOIN items "
+                                 "USING (itemID) "
+                                 "WHERE key = ?", (key,)).fetchone()[0]
+        set_title(conn, parent_id, title)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def delete_paper(zotero_dir: str, key: str):
+    """Delete attachment ``key`` and its storage folder, as emptying the trash does."""
+    conn = sqlite3.connect(os.path.join(zotero_dir, "zotero.sqlite"))
+    try:
+        item_id = conn.execute("SELECT itemID FROM items WHERE key = ?",
+                               (key,)).fetchone()[0]
+        conn.execute("DELETE FROM itemAttachments WHERE itemID = ?", (item_id,))
+        conn.execute("DELETE FROM items WHERE itemID = ?", (item_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    shutil.rmtree(os.path.join(zotero_dir, "storage", key), ignore_errors=True)
@@ -44,7 +44,7 @@ def install_dependencies():
         "sentence-transformers",
         "faiss-cpu", 
         "PyPDF2",
-        "scikit-learn",
+        "scipy",
         "numpy"
     ]
     
@@ -5,50 +5,2596 @@ Searches PDF files and metadata in Zotero library based on user queries
 """
 
 import os
+import re
+import sys
 import json
+import time
+import heapq
+import copy
+import uuid
+import shutil
+import hashlib
+import zlib
+import tempfile
 import sqlite3
+import threading
 import webbrowser
+import importlib
+import contextlib
+import multiprocessing
+from collections import Counter, OrderedDict, deque
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 import argparse
 
 # Install required packages:
-# pip install sentence-transformers faiss-cpu PyPDF2 scikit-learn
+# pip install sentence-transformers faiss-cpu PyPDF2 scipy
+INSTALL_HINT = ("Please install with: "
+                "pip install sentence-transformers faiss-cpu PyPDF2 scipy")
 
 try:
-    from sentence_transformers import SentenceTransformer
-    import faiss
-    import PyPDF2
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
     import numpy as np
 except ImportError as e:
     print(f"Missing required package: {e}")
-    print("Please install with: pip install sentence-transformers faiss-cpu PyPDF2 scikit-learn")
+    print(INSTALL_HINT)
     exit(1)
 
 
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access.
+    
+    Heavy dependencies (torch via sentence-transformers, PyPDF2, scipy, faiss)
+    are only imported by the code paths that use them, which keeps one-shot
+    CLI queries and lexical searches fast to start.
+    """
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as e:
+                raise ImportError(
+                    f"Missing required package: {e}. {INSTALL_HINT}") from e
+        return getattr(self._module, attr)
+
+
+faiss = _LazyModule('faiss')
+PyPDF2 = _LazyModule('PyPDF2')
+sparse = _LazyModule('scipy.sparse')
+sentence_transformers = _LazyModule('sentence_transformers')
+
+# A ranked document: its position in the document list, its score and its
+# best passage (None unless the index is chunked)
+Hit = Tuple[int, float, Optional[Dict]]
+
+
+# Sentence transformer used for document and query embeddings
+MODEL_NAME = 'intfloat/e5-large-v2'
+
+# Number of corpus entries encoded at a time while PDFs are still being parsed
+ENCODE_CHUNK_SIZE = 256
+
+# Padded tokens per encoder forward pass, and the most texts in one. Texts are
+# batched by length, so titles go many to a batch and full passages few,
+# which bounds the memory of a forward pass.
+ENCODE_TOKEN_BUDGET = 8192
+ENCODE_MAX_BATCH = 128
+
+# How the sentence transformer runs: 'torch' (fp32), 'int8' (linear layers
+# dynamically quantized to int8, CPU only) or 'onnx' (ONNX Runtime)
+ENCODER_BACKENDS = ['torch', 'int8', 'onnx']
+
+# With --encode-workers, document batches smaller than this are encoded in
+# the main process rather than split across the pool
+ENCODE_POOL_MIN_TEXTS = 64
+
+# Cross-encoder that reranks first-stage candidates with --rerank, the
+# candidates it scores per query, query-document pairs per forward pass, and
+# the default seconds reranking may take per query before the rest of the
+# candidates keep their first-stage order
+RERANKER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+RERANK_CANDIDATES = 50
+RERANK_BATCH_SIZE = 16
+RERANK_TIME_BUDGET = 0.25
+
+# Near-duplicate PDFs (e.g. the arXiv versions and the published version of a
+# paper) are indexed once: texts whose word SHINGLE_WORDS-gram sets have an
+# estimated Jaccard similarity of at least NEAR_DUPLICATE_THRESHOLD are grouped.
+# MinHash signatures have MINHASH_PERMUTATIONS values, split into MINHASH_BANDS
+# bands for locality-sensitive hashing (a band of 4 values finds pairs at the
+# threshold with near certainty while rarely comparing unrelated texts).
+# Texts of fewer than NEAR_DUPLICATE_MIN_SHINGLES shingles (a scanner's
+# watermark, a cover page) say too little about a paper to be matched.
+NEAR_DUPLICATE_THRESHOLD = 0.8
+NEAR_DUPLICATE_MIN_SHINGLES = 50
+SHINGLE_WORDS = 3
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+
+# Documents per build checkpoint; bounds the texts and vectors held in memory
+# while building and the work lost when a build is interrupted
+BUILD_CHUNK_DOCUMENTS = 512
+
+# Queries encoded per model forward pass, and queries per FAISS search call in
+# search_many() (which also bounds memory for very long query lists)
+QUERY_BATCH_SIZE = 64
+SEARCH_MANY_CHUNK_SIZE = 1024
+
+# Characters of PDF text included in each document's search text
+PDF_TEXT_CHARS = 2000
+
+# Passage size for chunked indexing, within e5's 512-token input limit once the
+# document title is prepended (metadata such as the abstract is embedded as a
+# passage of its own), and the overlap between consecutive passages
+PASSAGE_TOKENS = 448
+PASSAGE_OVERLAP = 64
+
+# Rough number of whitespace-separated words per model token, used when no
+# tokenizer is available to measure passages
+WORDS_PER_TOKEN = 0.75
+
+# Passages retrieved per requested document before aggregating to documents
+PASSAGE_CANDIDATES_PER_DOC = 20
+
+# FAISS index types selectable with --index-type; 'auto' picks by vector count
+INDEX_TYPES = ['auto', 'flat', 'hnsw', 'ivf-flat', 'ivf-pq']
+AUTO_FLAT_MAX_VECTORS = 100_000
+AUTO_HNSW_MAX_VECTORS = 2_000_000
+
+# Search modes: embeddings only, BM25 only (no model needed) or both fused
+SEARCH_MODES = ['hybrid', 'dense', 'lexical']
+
+# Candidates fetched from each ranking per requested result before fusion,
+# and the rank offset of reciprocal rank fusion
+HYBRID_CANDIDATES_PER_RESULT = 4
+RRF_K = 60
+
+# Metadata fields search results can be filtered by, besides the year range.
+# Author and journal filters match words, tag and collection filters whole names.
+FILTER_FIELDS = ['author', 'journal', 'tag', 'collection']
+WORD_FILTER_FIELDS = ['author', 'journal']
+
+# Filtered dense searches selecting at most this many vectors score them
+# exactly instead of searching the FAISS index
+FILTER_EXACT_MAX_VECTORS = 8192
+
+# Vectors removed from IVF and HNSW indexes stay in them as tombstones, skipped
+# by every search, until they make up this fraction of the index; it is then
+# rebuilt, copying COPY_BATCH_VECTORS vectors at a time
+TOMBSTONE_MAX_FRACTION = 0.2
+COPY_BATCH_VECTORS = 65_536
+
+# Bump when extract_pdf_text changes its output so cached texts are not reused
+EXTRACTOR_VERSION = 1
+
+# Entries kept by the query embedding and search result caches
+QUERY_CACHE_SIZE = 4096
+
+# How long AsyncZoteroRAG holds a query to batch it with concurrent ones, and
+# the most queries it encodes together
+COALESCE_MAX_WAIT = 0.002
+COALESCE_MAX_BATCH = 64
+
+# Address of the local search server started with `zotero-rag serve`
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+
+# --watch: seconds between checks of zotero.sqlite, how long changes must
+# settle before they are indexed, and the longest a burst of changes can
+# postpone indexing
+WATCH_POLL_INTERVAL = 2.0
+WATCH_DEBOUNCE = 2.0
+WATCH_MAX_DELAY = 30.0
+
+# Keys per SQL query when loading metadata for selected attachments, below
+# SQLite's limit on query parameters
+SQL_BATCH_SIZE = 500
+
+# Seconds a read of zotero.sqlite waits while Zotero is writing to it
+ZOTERO_DB_TIMEOUT = 5.0
+
+# Slowest PDFs listed in a --profile report
+PROFILE_SLOWEST_FILES = 20
+
+# On-disk index layout, bumped whenever a reader of the old layout would
+# misread the new one
+INDEX_FORMAT = 'zotero-rag-index'
+INDEX_FORMAT_VERSION = 1
+
+
+def _sidecar_path(index_path: str, suffix: str) -> str:
+    """Path of a file stored next to an index, e.g. zotero_index.textcache.sqlite."""
+    return os.path.splitext(index_path)[0] + suffix
+
+
+def resolve_index_path(index_path: str) -> str:
+    """Path an index given as ``index_path`` is loaded from.
+    
+    Indexes saved to a legacy ``.json`` path are written as a ``.zrag``
+    directory next to it (see ZoteroRAG.save_index), so that directory is
+    used once it exists, or when there is no JSON file to load either.
+    """
+    if index_path.endswith('.json'):
+        directory = _sidecar_path(index_path, '.zrag')
+        if os.path.isdir(directory) or not os.path.isfile(index_path):
+            return directory
+    return index_path
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdf_text(pdf_path: str, max_chars: Optional[int] = None) -> str:
+    """Extract text from PDF file.
+    
+    Pages are parsed in order and extraction stops as soon as ``max_chars``
+    characters have been collected.
+    """
+    try:
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            pages = []
+            n_chars = 0
+            for page in reader.pages:
+                page_text = page.extract_text()
+                pages.append(page_text)
+                n_chars += len(page_text) + 1
+                if max_chars is not None and n_chars >= max_chars:
+                    break
+            text = "\n".join(pages).strip()
+            return text[:max_chars] if max_chars is not None else text
+    except Exception as e:
+        print(f"Error extracting text from {pdf_path}: {e}")
+        return ""
+
+
+def open_pdf(pdf_path: str):
+    """Open PDF file in default browser/viewer."""
+    try:
+        # Convert to file URL for browser
+        file_url = f"file://{os.path.abspath(pdf_path)}"
+        webbrowser.open(file_url)
+        print(f"Opened: {pdf_path}")
+    except Exception as e:
+        print(f"Error opening file: {e}")
+
+
+def model_text_prefixes(model_name: str) -> Dict[str, str]:
+    """Prefixes a model expects on its inputs ("query: ", "passage: " for e5)."""
+    if re.search(r'(?:^|[-_/])e5(?:[-_]|$)', model_name.lower()):
+        return {'query': 'query: ', 'passage': 'passage: '}
+    return {'query': '', 'passage': ''}
+
+
+def token_lengths(model, texts: List[str]) -> np.ndarray:
+    """Number of tokens the model sees for each text, after truncation.
+    
+    Uses the model's tokenizer if it has one; otherwise words are counted
+    and scaled by WORDS_PER_TOKEN.
+    """
+    tokenizer = getattr(model, 'tokenizer', None)
+    max_length = getattr(model, 'max_seq_length', None)
+    if tokenizer is None:
+        lengths = np.array([len(text.split()) / WORDS_PER_TOKEN + 2 for text in texts],
+                           dtype='int64')
+    else:
+        encoding = tokenizer(texts, truncation=max_length is not None,
+                             max_length=max_length, verbose=False)
+        lengths = np.array([len(ids) for ids in encoding['input_ids']], dtype='int64')
+    return np.minimum(lengths, max_length) if max_length else lengths
+
+
+def load_encoder(model_name: str = MODEL_NAME, backend: str = 'torch',
+                 device: str = 'cpu', dimension: Optional[int] = None
+                 ) -> 'sentence_transformers.SentenceTransformer':
+    """Load a sentence transformer for one of ENCODER_BACKENDS.
+    
+    ``dimension`` truncates the embeddings (for models trained to support
+    it); None keeps the model's own dimension.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"encoder backend must be one of {ENCODER_BACKENDS}")
+    options = {'truncate_dim': dimension} if dimension else {}
+    if backend == 'onnx':
+        return sentence_transformers.SentenceTransformer(model_name, device=device,
+                                                         backend='onnx', **options)
+    if backend == 'int8':
+        model = sentence_transformers.SentenceTransformer(model_name, device='cpu',
+                                                          **options)
+        return _quantize_int8(model)
+    return sentence_transformers.SentenceTransformer(model_name, device=device,
+                                                     **options)
+
+
+def load_cross_encoder(model_name: str = RERANKER_MODEL, backend: str = 'torch',
+                       device: str = 'cpu') -> 'sentence_transformers.CrossEncoder':
+    """Load a cross-encoder for reranking, for one of ENCODER_BACKENDS."""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"encoder backend must be one of {ENCODER_BACKENDS}")
+    if backend == 'onnx':
+        return sentence_transformers.CrossEncoder(model_name, device=device,
+                                                  backend='onnx')
+    if backend == 'int8':
+        model = sentence_transformers.CrossEncoder(model_name, device='cpu')
+        return _quantize_int8(model)
+    return sentence_transformers.CrossEncoder(model_name, device=device)
+
+
+def _quantize_int8(model):
+    """Dynamically quantize a model's linear layers to int8, in place."""
+    import warnings
+    import torch
+    
+    with warnings.catch_warnings():
+        # Eager-mode quantization is deprecated in favour of torchao, but works
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear},
+                                                      dtype=torch.qint8, inplace=True)
+
+
+def encode_texts(model, texts: List[str], token_budget: int = ENCODE_TOKEN_BUDGET,
+                 max_batch: int = ENCODE_MAX_BATCH) -> np.ndarray:
+    """Encode texts in length-sorted batches sized by a token budget.
+    
+    Texts are ordered by token count so each batch pads to about the same
+    length, and each batch holds as many texts as fit in ``token_budget``
+    padded tokens (at most ``max_batch``). The embeddings are returned in
+    the original order. An EncodePool splits the texts between its workers,
+    which batch their share the same way.
+    """
+    if isinstance(model, EncodePool):
+        return model.encode_texts(texts, token_budget, max_batch)
+    if not texts:
+        return np.asarray(model.encode(texts))
+    lengths = token_lengths(model, texts)
+    # Longest first, so a batch that does not fit in memory fails right away
+    order = np.argsort(-lengths, kind='stable')
+    embeddings = None
+    start = 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, min(max_batch, token_budget // longest))
+        batch = order[start:start + size]
+        encoded = np.asarray(model.encode([texts[i] for i in batch],
+                                          batch_size=len(batch)))
+        if embeddings is None:
+            embeddings = np.empty((len(texts), encoded.shape[1]), dtype=encoded.dtype)
+        embeddings[batch] = encoded
+        start += size
+    return embeddings
+
+
+# The encoder of an EncodePool worker process
+_worker_encoder = None
+
+
+def _init_encode_worker(model_name: str, backend: str, dimension: Optional[int],
+                        threads: int):
+    global _worker_encoder
+    import torch
+    
+    torch.set_num_threads(threads)
+    _worker_encoder = load_encoder(model_name, backend, 'cpu', dimension)
+
+
+def _encode_in_worker(texts: List[str], token_budget: int,
+                      max_batch: int) -> np.ndarray:
+    return encode_texts(_worker_encoder, texts, token_budget, max_batch)
+
+
+class EncodePool:
+    """Encode texts in worker processes spread across the CPU cores.
+    
+    Each worker loads its own copy of the encoder and runs ``threads`` torch
+    threads (by default the cores divided between the workers), so the
+    workers do not compete for cores. Texts are sorted by length and dealt
+    out round-robin, giving every worker a similar mix of long and short
+    texts. Workers are spawned rather than forked, as forking a process
+    that has used torch's thread pool can hang.
+    """
+    
+    # Token counts are left to the workers; see token_lengths()
+    tokenizer = None
+    
+    def __init__(self, model_name: str = MODEL_NAME, workers: int = 2,
+                 backend: str = 'torch',
+                 dimension: Optional[int] = None, threads: Optional[int] = None):
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(workers, initializer=_init_encode_worker,
+                                  initargs=(model_name, backend, dimension,
+                                            self.threads))
+
+    def encode_texts(self, texts: List[str], token_budget: int = ENCODE_TOKEN_BUDGET,
+                     max_batch: int = ENCODE_MAX_BATCH) -> np.ndarray:
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        shares = [order[i::self.workers] for i in range(self.workers)]
+        shares = [share for share in shares if len(share)]
+        if not shares:
+            return np.asarray(self._pool.apply(_encode_in_worker,
+                                               ([], token_budget, max_batch)))
+        parts = self._pool.starmap(_encode_in_worker,
+                                   [([texts[i] for i in share], token_budget, max_batch)
+                                    for share in shares])
+        embeddings = np.empty((len(texts), parts[0].shape[1]), dtype=parts[0].dtype)
+        for share, part in zip(shares, parts):
+            embeddings[share] = part
+        return embeddings
+
+    def encode(self, sentences: List[str], **kwargs) -> np.ndarray:
+        return self.encode_texts(sentences)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+def split_passages(text: str, max_tokens: int = PASSAGE_TOKENS,
+                   overlap: int = PASSAGE_OVERLAP,
+                   tokenizer=None) -> List[Tuple[int, int]]:
+    """Split text into overlapping passages of at most ``max_tokens`` tokens.
+    
+    Returns (start, end) character offsets into ``text``. With a Hugging Face
+    fast tokenizer the budget is exact; otherwise words are counted and
+    scaled by WORDS_PER_TOKEN.
+    """
+    if tokenizer is not None:
+        encoding = tokenizer(text, add_special_tokens=False,
+                             return_offsets_mapping=True, verbose=False)
+        offsets = encoding['offset_mapping']
+    else:
+        offsets = [match.span() for match in re.finditer(r'\S+', text)]
+        max_tokens = max(1, int(max_tokens * WORDS_PER_TOKEN))
+        overlap = int(overlap * WORDS_PER_TOKEN)
+        
+    spans = []
+    step = max(1, max_tokens - overlap)
+    for start in range(0, len(offsets), step):
+        end = min(start + max_tokens, len(offsets))
+        spans.append((offsets[start][0], offsets[end - 1][1]))
+        if end == len(offsets):
+            break
+    return spans
+
+
+def resolve_index_type(index_type: str, n_vectors: int) -> str:
+    """Pick a concrete index type; 'auto' chooses by the number of vectors."""
+    if index_type != 'auto':
+        return index_type
+    if n_vectors <= AUTO_FLAT_MAX_VECTORS:
+        return 'flat'
+    if n_vectors <= AUTO_HNSW_MAX_VECTORS:
+        return 'hnsw'
+    return 'ivf-pq'
+
+
+def create_faiss_index(dimension: int, n_vectors: int, index_type: str = 'flat',
+                       compact: bool = False):
+    """Create an empty inner-product (cosine similarity) FAISS index.
+    
+    ``compact`` stores full vectors as float16 instead of float32. IVF indexes
+    must be trained before vectors are added (see train_faiss_index).
+    """
+    storage = 'SQfp16' if compact else 'Flat'
+    # Aim for ~4*sqrt(n) lists while keeping enough training points per list
+    nlist = max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+    if index_type == 'flat':
+        description = storage
+    elif index_type == 'hnsw':
+        description = f"HNSW32,{storage}"
+    elif index_type == 'ivf-flat':
+        description = f"IVF{nlist},{storage}"
+    elif index_type == 'ivf-pq':
+        # ~16 dimensions per sub-quantizer, which must divide the dimension;
+        # small corpora get 4-bit codes so the codebooks can still be trained
+        m = max(d for d in range(1, max(1, dimension // 16) + 1) if dimension % d == 0)
+        nbits = 8 if n_vectors >= 256 * 39 else 4
+        description = f"IVF{nlist},PQ{m}x{nbits}"
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+        
+    index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'hnsw':
+        index.hnsw.efConstruction = 80
+        index.hnsw.efSearch = 64
+    elif index_type.startswith('ivf'):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = max(1, nlist // 16)
+        # Needed to reconstruct vectors when rebuilding after an update
+        ivf.make_direct_map()
+    return index
+
+
+def train_faiss_index(index, embeddings: np.ndarray,
+                      max_training_points: int = 256_000):
+    """Train an index on (a sample of) the embeddings if it requires training."""
+    if index.is_trained:
+        return
+    if len(embeddings) > max_training_points:
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(embeddings), max_training_points, replace=False)
+        embeddings = embeddings[np.sort(sample)]
+    index.train(np.ascontiguousarray(embeddings, dtype='float32'))
+
+
+def faiss_search_params(index, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None,
+                        selector=None, selected_fraction: float = 1.0):
+    """Per-query search parameters for IVF (nprobe) or HNSW (efSearch) indexes.
+    
+    A ``selector`` (faiss.IDSelector) restricts the search to the ids it
+    selects. Only ``selected_fraction`` of the vectors an IVF or HNSW search
+    visits then count, so it visits correspondingly more to still find
+    enough results (for HNSW at most 16 times more, beyond which a graph
+    search gets slower than scoring the selected vectors directly). The
+    index's own nprobe or efSearch are used unless overridden.
+    """
+    scale = 1 / max(selected_fraction, 1e-6)
+    if nprobe is not None or selector is not None:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+            nprobe = nprobe if nprobe is not None else ivf.nprobe
+            nprobe = min(ivf.nlist, int(np.ceil(nprobe * scale)))
+            return faiss.SearchParametersIVF(nprobe=nprobe, sel=selector)
+        except RuntimeError:
+            pass
+    if (ef_search is not None or selector is not None) and \
+            isinstance(index, faiss.IndexHNSW):
+        ef_search = ef_search if ef_search is not None else index.hnsw.efSearch
+        return faiss.SearchParametersHNSW(
+            efSearch=min(max(index.ntotal, 1),
+                         int(np.ceil(ef_search * min(scale, 16)))), sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+def _timed_extract_pdf_text(pdf_path: str,
+                            max_chars: Optional[int] = None) -> Tuple[str, float]:
+    """extract_pdf_text() that also returns the seconds it took, for profiling."""
+    start = time.perf_counter()
+    text = extract_pdf_text(pdf_path, max_chars)
+    return text, time.perf_counter() - start
+
+
+def iter_extracted_texts(pdf_paths: List[str], workers: int = 1,
+                         timeout: Optional[float] = 120.0,
+                         prefetch: int = 512,
+                         max_chars: Optional[int] = None,
+                         profiler: Optional['Profiler'] = None) -> Iterator[str]:
+    """Yield the text of each PDF in input order, extracting in a process pool.
+    
+    Each text is limited to ``max_chars`` characters (see extract_pdf_text).
+    A file that crashes its worker or takes longer than ``timeout`` seconds
+    yields an empty string; the pool is then restarted so the rest of the
+    build carries on. At most ``prefetch`` files are in flight at once.
+    With a ``profiler``, each file's extraction time (measured in the
+    worker) is recorded.
+    """
+    if workers <= 1:
+        for path in pdf_paths:
+            if profiler is None:
+                yield extract_pdf_text(path, max_chars)
+            else:
+                text, seconds = _timed_extract_pdf_text(path, max_chars)
+                profiler.file_extracted(path, seconds, len(text))
+                yield text
+        return
+        
+    extract = extract_pdf_text if profiler is None else _timed_extract_pdf_text
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+    next_index = 0
+    window = max(prefetch, workers)
+    try:
+        while next_index < len(pdf_paths) or pending:
+            while next_index < len(pdf_paths) and len(pending) < window:
+                result = pool.apply_async(extract, (pdf_paths[next_index], max_chars))
+                pending.append((next_index, result))
+                next_index += 1
+                
+            index, result = pending.popleft()
+            try:
+                text = result.get(timeout)
+                if profiler is not None:
+                    text, seconds = text
+                    profiler.file_extracted(pdf_paths[index], seconds, len(text))
+                yield text
+            except multiprocessing.TimeoutError:
+                print(f"Timed out extracting text from {pdf_paths[index]}")
+                if profiler is not None:
+                    profiler.file_extracted(pdf_paths[index], timeout, 0,
+                                            status='timeout')
+                # A hung or crashed worker never returns, so replace the pool
+                # and resubmit everything that has not finished yet.
+                pool.terminate()
+                pool = multiprocessing.Pool(workers)
+                pending = deque(
+                    (i, r) if r.ready()
+                    else (i, pool.apply_async(extract, (pdf_paths[i], max_chars)))
+                    for i, r in pending
+                )
+                yield ""
+            except Exception as e:
+                print(f"Error extracting text from {pdf_paths[index]}: {e}")
+                if profiler is not None:
+                    profiler.file_extracted(pdf_paths[index], 0.0, 0, status='error')
+                yield ""
+    finally:
+        pool.terminate()
+
+
+# Zotero fields read for each attachment's parent item
+METADATA_FIELDS = ['title', 'date', 'publicationTitle', 'abstractNote', 'extra', 'url',
+                   'DOI']
+
+
+def connect_zotero_db(db_path: str, immutable: bool = False) -> sqlite3.Connection:
+    """Open zotero.sqlite read-only.
+    
+    The connection takes SQLite's shared lock and reads the write-ahead log,
+    so it sees what Zotero last committed, waiting up to ZOTERO_DB_TIMEOUT
+    seconds for a write in progress. ``immutable`` skips locking and the log
+    instead: it never waits on a running Zotero, but rows written meanwhile
+    can be missing or inconsistent, so it suits one-off reads only.
+    """
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return sqlite3.connect(uri, uri=True, timeout=ZOTERO_DB_TIMEOUT)
+
+
+def _in_batches(values: List) -> Iterator[Tuple[str, List]]:
+    """``IN (?, ...)`` clauses with their parameters, batched below SQLite's limit."""
+    for start in range(0, len(values), SQL_BATCH_SIZE):
+        batch = values[start:start + SQL_BATCH_SIZE]
+        yield f"IN ({', '.join('?' * len(batch))})", batch
+
+
+def load_zotero_metadata(db_path: str, keys: Optional[List[str]] = None,
+                         immutable: bool = False) -> Dict[str, Dict]:
+    """Extract metadata for every PDF attachment, keyed by its storage folder key.
+    
+    Zotero stores an attachment's files in ``storage/<attachment key>/`` while
+    the bibliographic fields belong to the parent item, so fields are pivoted
+    into one row per attachment in a single query. ``keys`` restricts the
+    query to those attachments.
+    
+    With ``immutable`` (see connect_zotero_db) a database that cannot be
+    read gives no metadata. Otherwise the sqlite3.Error is raised, so an
+    update never mistakes a locked database for a library without metadata.
+    """
+    if not os.path.exists(db_path):
+        print("Warning: Zotero database not found. Proceeding without metadata.")
+        return {}
+        
+    field_columns = ",\n".join(
+        f"                MAX(CASE WHEN fields.fieldName = '{field}'\n"
+        f"                    THEN itemDataValues.value END)"
+        for field in METADATA_FIELDS
+    )
+    query = f"""
+            SELECT
+                attachment.key,
+                COALESCE(itemAttachments.parentItemID, itemAttachments.itemID),
+                itemAttachments.path,
+                MAX(attachment.dateModified, COALESCE(parent.dateModified, '')),
+                (SELECT creators.lastName FROM itemCreators
+                 JOIN creators ON creators.creatorID = itemCreators.creatorID
+                 WHERE itemCreators.itemID = COALESCE(itemAttachments.parentItemID,
+                                                      itemAttachments.itemID)
+                 ORDER BY itemCreators.orderIndex LIMIT 1),
+{field_columns}
+            FROM itemAttachments
+            JOIN items AS attachment ON attachment.itemID = itemAttachments.itemID
+            LEFT JOIN items AS parent ON parent.itemID = itemAttachments.parentItemID
+            LEFT JOIN itemData
+                ON itemData.itemID = COALESCE(itemAttachments.parentItemID,
+                                              itemAttachments.itemID)
+            LEFT JOIN fields ON itemData.fieldID = fields.fieldID
+            LEFT JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
+            WHERE (itemAttachments.contentType = 'application/pdf'
+                   OR itemAttachments.path LIKE '%.pdf'){{key_condition}}
+            GROUP BY itemAttachments.itemID
+            """
+    batches = [("", [])]
+    if keys is not None:
+        batches = [(f" AND attachment.key {clause}", batch)
+                   for clause, batch in _in_batches(list(keys))]
+    
+    metadata = {}
+    try:
+        conn = connect_zotero_db(db_path, immutable)
+        try:
+            rows = [row for key_condition, params in batches
+                    for row in conn.execute(query.format(key_condition=key_condition),
+                                            params)]
+            item_ids = None if keys is None else [row[1] for row in rows]
+            item_lists = _load_item_lists(conn, item_ids)
+            for key, item_id, path, date_modified, first_creator, *values in rows:
+                fields = {field: value for field, value in zip(METADATA_FIELDS, values)
+                          if value}
+                if first_creator:
+                    fields['firstCreator'] = first_creator
+                metadata[key] = {'path': path, 'date_modified': date_modified or '',
+                                 'fields': fields,
+                                 **{name: lists.get(item_id, [])
+                                    for name, lists in item_lists.items()}}
+        finally:
+            conn.close()
+        print(f"Extracted metadata for {len(metadata)} items")
+        
+    except Exception as e:
+        if not immutable and isinstance(e, sqlite3.Error):
+            raise
+        print(f"Error extracting metadata: {e}")
+        
+    return metadata
+
+
+def _load_item_lists(conn: sqlite3.Connection, item_ids: Optional[List[int]] = None
+                     ) -> Dict[str, Dict[int, List[str]]]:
+    """All creators, tags and collections of every item (or of ``item_ids``) by item id.
+    
+    Creators are "First Last" in author order. An item's collections include
+    the collections those are nested in, so filtering by a collection also
+    finds items in its subcollections. Tables missing from the database are
+    skipped.
+    """
+    queries = {
+        'creators': ("""
+            SELECT itemCreators.itemID,
+                   TRIM(COALESCE(creators.firstName, '') || ' ' || creators.lastName)
+            FROM itemCreators
+            JOIN creators ON creators.creatorID = itemCreators.creatorID {where}
+            ORDER BY itemCreators.itemID, itemCreators.orderIndex""",
+                     'itemCreators.itemID'),
+        'tags': ("""
+            SELECT itemTags.itemID, tags.name
+            FROM itemTags JOIN tags ON tags.tagID = itemTags.tagID {where}
+            ORDER BY tags.name""", 'itemTags.itemID'),
+        'collections': ("SELECT itemID, collectionID FROM collectionItems {where}",
+                        'itemID'),
+    }
+    item_lists = {}
+    for name, (query, column) in queries.items():
+        batches = [("", [])]
+        if item_ids is not None:
+            batches = [(f"WHERE {column} {clause}", batch)
+                       for clause, batch in _in_batches(item_ids)]
+        lists = {}
+        try:
+            for where, params in batches:
+                for item_id, value in conn.execute(query.format(where=where), params):
+                    lists.setdefault(item_id, []).append(value)
+        except sqlite3.Error:
+            pass
+        item_lists[name] = lists
+        
+    try:
+        rows = conn.execute(
+            "SELECT collectionID, collectionName, parentCollectionID FROM collections")
+        collections = {collection_id: (collection_name, parent_id)
+                       for collection_id, collection_name, parent_id in rows}
+    except sqlite3.Error:
+        collections = {}
+    for item_id, collection_ids in item_lists['collections'].items():
+        names = []
+        for collection_id in collection_ids:
+            # Walk up to the top-level collection; the seen set guards against cycles
+            seen = set()
+            while collection_id in collections and collection_id not in seen:
+                seen.add(collection_id)
+                name, collection_id = collections[collection_id]
+                if name not in names:
+                    names.append(name)
+        item_lists['collections'][item_id] = names
+    return item_lists
+
+
+def load_attachment_stamps(db_path: str) -> Dict[str, Tuple[str, str]]:
+    """The modification date and path of every PDF attachment, by storage folder key.
+    
+    A cheap subset of load_zotero_metadata() for telling which attachments
+    were added, changed or deleted since an earlier call. Raises
+    sqlite3.Error, e.g. when the database is caught mid-write.
+    """
+    query = """
+            SELECT attachment.key,
+                   MAX(attachment.dateModified, COALESCE(parent.dateModified, '')),
+                   itemAttachments.path
+            FROM itemAttachments
+            JOIN items AS attachment ON attachment.itemID = itemAttachments.itemID
+            LEFT JOIN items AS parent ON parent.itemID = itemAttachments.parentItemID
+            WHERE itemAttachments.contentType = 'application/pdf'
+               OR itemAttachments.path LIKE '%.pdf'
+            """
+    conn = connect_zotero_db(db_path)
+    try:
+        return {key: (date_modified or '', path or '')
+                for key, date_modified, path in conn.execute(query)}
+    finally:
+        conn.close()
+
+
+def scan_storage(storage_dir: str, metadata: Dict[str, Dict],
+                 folders: Optional[List[str]] = None) -> List[Dict]:
+    """Find all PDF files under a Zotero storage directory and attach their metadata.
+    
+    ``folders`` limits the scan to those ``storage/<KEY>`` folders.
+    """
+    pdf_files = []
+    
+    if not os.path.exists(storage_dir):
+        print(f"Storage directory not found: {storage_dir}")
+        return pdf_files
+        
+    print("Scanning for PDF files...")
+    roots = [storage_dir] if folders is None else [os.path.join(storage_dir, folder)
+                                                   for folder in folders]
+    walk = (entry for root in roots for entry in os.walk(root))
+    for root, dirs, files in walk:
+        for file in files:
+            if file.lower().endswith('.pdf'):
+                file_path = os.path.join(root, file)
+                folder_name = os.path.basename(root)
+                
+                # Storage folders are named after the attachment key
+                meta = metadata.get(folder_name, {})
+                doc_metadata = meta.get('fields', {})
+                
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                
+                pdf_info = {
+                    'path': file_path,
+                    'filename': file,
+                    'folder': folder_name,
+                    'key': folder_name,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'date_modified': meta.get('date_modified', ''),
+                    'title': doc_metadata.get('title', file),
+                    'author': doc_metadata.get('firstCreator', ''),
+                    'year': doc_metadata.get('date', ''),
+                    'journal': doc_metadata.get('publicationTitle', ''),
+                    'abstract': doc_metadata.get('abstractNote', ''),
+                    'tags': doc_metadata.get('extra', ''),
+                    'url': doc_metadata.get('url', ''),
+                    'doi': doc_metadata.get('DOI', ''),
+                    'authors': meta.get('creators', []),
+                    'item_tags': meta.get('tags', []),
+                    'collections': meta.get('collections', []),
+                }
+                
+                pdf_files.append(pdf_info)
+    
+    print(f"Found {len(pdf_files)} PDF files")
+    return pdf_files
+
+
+class LexicalIndex:
+    """BM25 keyword index over document texts.
+    
+    Term counts are kept in a sparse document-term matrix whose rows are
+    aligned with the document list. The vocabulary grows as documents are
+    added, so incremental updates never need the old texts again. A saved
+    index is memory-mapped in its column-major (CSC) search layout and the
+    vocabulary is only decoded on first use.
+    
+    Term statistics (document frequencies and the average document length)
+    come from this index alone, or from every index in ``corpus`` once
+    share_statistics() has been called, so separate indexes score their
+    rows as a single index over all of them would.
+    """
+    
+    TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._vocabulary = {}
+        self._terms = None
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._pending = []
+        self._csc = None
+        self._doc_lengths = None
+        self.corpus = None
+        self.corpus_key = None
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+    @property
+    def vocabulary(self) -> Dict[str, int]:
+        """Term to column mapping."""
+        if self._terms is not None:
+            terms = self._terms.tobytes().decode('utf-8')
+            self._vocabulary = ({term: i for i, term in enumerate(terms.split("\n"))}
+                                if terms else {})
+            self._terms = None
+        return self._vocabulary
+
+    def __len__(self) -> int:
+        rows = self._matrix.shape[0] if self._matrix is not None else self._csc.shape[0]
+        return rows + len(self._pending)
+
+    def add(self, texts: List[str]):
+        """Append one row per text."""
+        if self._matrix is None:
+            self._matrix = self._csc.tocsr()
+        vocabulary = self.vocabulary
+        for text in texts:
+            counts = {}
+            for token in self.tokenize(text):
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            self._pending.append(counts)
+        self._csc = None
+
+    @property
+    def matrix(self) -> 'sparse.csr_matrix':
+        """Document-term count matrix including any pending rows."""
+        if self._matrix is None:
+            self._matrix = self._csc.tocsr()
+        if self._pending or self._matrix.shape[1] != len(self.vocabulary):
+            indptr = [0]
+            indices = []
+            data = []
+            for counts in self._pending:
+                indices.extend(counts.keys())
+                data.extend(counts.values())
+                indptr.append(len(indices))
+            shape = (len(self._pending), len(self.vocabulary))
+            pending = sparse.csr_matrix(
+                (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32),
+                 indptr),
+                shape=shape)
+            existing = self._matrix.copy()
+            existing.resize((existing.shape[0], len(self.vocabulary)))
+            self._matrix = sparse.vstack([existing, pending], format='csr')
+            self._pending = []
+        return self._matrix
+
+    def remove(self, rows: List[int]):
+        """Drop rows, keeping the remaining ones in order."""
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(rows, dtype='int64')] = False
+        self._matrix = self.matrix[keep]
+        self._csc = None
+
+    def _prepare(self):
+        if self._csc is None:
+            matrix = self.matrix
+            self._csc = matrix.tocsc()
+            self._doc_lengths = np.asarray(matrix.sum(axis=1)).ravel()
+
+    @staticmethod
+    def share_statistics(indexes: List['LexicalIndex'], key=None):
+        """Score each of ``indexes`` with term statistics over all of them.
+        
+        ``key`` identifies the collection, so cached results scored against
+        a different one are not reused.
+        """
+        for index in indexes:
+            # Done here, as other indexes' searches read these from their threads
+            index._prepare()
+            index.vocabulary
+        for index in indexes:
+            index.corpus = list(indexes)
+            index.corpus_key = key
+
+    def _document_frequency(self, token: str) -> int:
+        term_id = self.vocabulary.get(token)
+        if term_id is None:
+            return 0
+        return int(self._csc.indptr[term_id + 1] - self._csc.indptr[term_id])
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for the query."""
+        self._prepare()
+        n_docs = self._csc.shape[0]
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if n_docs == 0:
+            return scores
+        if self.corpus is None:
+            n_total = n_docs
+            avg_length = max(self._doc_lengths.mean(), 1e-9)
+        else:
+            n_total = sum(index._csc.shape[0] for index in self.corpus)
+            total_length = sum(float(index._doc_lengths.sum()) for index in self.corpus)
+            avg_length = max(total_length / n_total, 1e-9)
+        norm = self.k1 * (1 - self.b + self.b * self._doc_lengths / avg_length)
+        for token in set(self.tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self._csc.indptr[term_id], self._csc.indptr[term_id + 1]
+            rows = self._csc.indices[start:end]
+            tf = self._csc.data[start:end]
+            df = (len(rows) if self.corpus is None
+                  else sum(index._document_frequency(token) for index in self.corpus))
+            idf = np.log(1 + (n_total - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm[rows])
+        return scores
+
+    def search(self, query: str, top_k: int,
+               mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return up to ``top_k`` (row, score) pairs with a positive score, best first.
+        
+        With a boolean ``mask``, only rows where it is True are returned.
+        Rows with equal scores come in row order, so results merged from
+        several indexes match those of one index over all their rows.
+        """
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k == 0:
+            return []
+        lowest = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+        above = np.flatnonzero(scores > lowest)
+        tied = np.flatnonzero(scores == lowest)[:top_k - len(above)]
+        rows = np.concatenate([above, tied])
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def save(self, directory: str):
+        """Write the index as .npy files into ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        self._prepare()
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        arrays = {
+            'data': self._csc.data,
+            'indices': self._csc.indices,
+            'indptr': self._csc.indptr,
+            'doc_lengths': self._doc_lengths,
+            'terms': np.frombuffer("\n".join(terms).encode('utf-8'), dtype=np.uint8),
+            'params': np.array([self.k1, self.b, *self._csc.shape]),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    @classmethod
+    def load(cls, directory: str) -> 'LexicalIndex':
+        """Memory-map an index written by save()."""
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+        
+        k1, b, n_rows, n_terms = array('params').tolist()
+        index = cls(k1, b)
+        index._csc = sparse.csc_matrix(
+            (array('data'), array('indices'), array('indptr')),
+            shape=(int(n_rows), int(n_terms)), copy=False)
+        index._doc_lengths = array('doc_lengths')
+        index._terms = array('terms')
+        index._matrix = None
+        return index
+
+    @classmethod
+    def concatenate(cls, indexes: List['LexicalIndex']) -> 'LexicalIndex':
+        """Stack the rows of several indexes into one, merging their vocabularies."""
+        merged = cls(indexes[0].k1, indexes[0].b) if indexes else cls()
+        vocabulary = merged._vocabulary
+        blocks = []
+        for index in indexes:
+            terms = sorted(index.vocabulary, key=index.vocabulary.get)
+            mapping = np.array([vocabulary.setdefault(term, len(vocabulary))
+                                for term in terms], dtype=np.int32)
+            blocks.append((index.matrix, mapping))
+        if blocks:
+            merged._matrix = sparse.vstack(
+                [sparse.csr_matrix((rows.data, mapping[rows.indices], rows.indptr),
+                                   shape=(rows.shape[0], len(vocabulary)))
+                 for rows, mapping in blocks], format='csr')
+        return merged
+
+    @classmethod
+    def load_npz(cls, path: str) -> 'LexicalIndex':
+        """Load the single-file .lexical.npz written next to legacy JSON indexes."""
+        with np.load(path) as data:
+            index = cls(*data['params'].tolist())
+            index._terms = data['terms']
+            index._matrix = sparse.csr_matrix(
+                (data['data'], data['indices'], data['indptr']),
+                shape=tuple(data['shape']))
+        return index
+
+
+def parse_year(date: str) -> int:
+    """The year of a Zotero date string ("2023-00-00 2023", "March 2021"), or 0."""
+    match = re.search(r'\b(\d{4})\b', date or '')
+    return int(match.group(1)) if match else 0
+
+
+def _year_range(value) -> Tuple[Optional[int], Optional[int]]:
+    """Parse a year filter: 2021, "2019-2023", "2019-", "-2015" or a (first, last)."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return (value, value)
+    if isinstance(value, str):
+        match = re.fullmatch(r'\s*(\d{4})?\s*(-)?\s*(\d{4})?\s*', value)
+        if not match or not (match.group(1) or match.group(3)):
+            raise ValueError(f"Invalid year filter {value!r}; "
+                             "use e.g. 2021, 2019-2023 or 2019-")
+        low = int(match.group(1)) if match.group(1) else None
+        if match.group(3):
+            high = int(match.group(3))
+        else:
+            high = None if match.group(2) else low
+        return (low, high)
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        low, high = (None if year is None else int(year) for year in value)
+        return (low, high)
+    raise ValueError(f"Invalid year filter {value!r}")
+
+
+def normalize_filters(filters: Optional[Dict]) -> Tuple:
+    """Canonical, hashable form of search filters, as used in cache keys.
+    
+    ``filters`` maps 'year' to a year, a "2019-2023" style range or a
+    (first, last) pair, and any of FILTER_FIELDS to a string or a list of
+    alternatives. Raises ValueError for unknown fields or invalid values.
+    """
+    normalized = []
+    for field, value in (filters or {}).items():
+        if value is None or value == '' or value == []:
+            continue
+        if field == 'year':
+            normalized.append((field, _year_range(value)))
+        elif field in FILTER_FIELDS:
+            values = [value] if isinstance(value, str) else list(value)
+            if not all(isinstance(item, str) for item in values):
+                raise ValueError(
+                    f"{field} filter must be a string or a list of strings")
+            values = sorted({item.strip().lower() for item in values if item.strip()})
+            if values:
+                normalized.append((field, tuple(values)))
+        else:
+            raise ValueError(f"Unknown filter {field!r}; "
+                             f"filters are year, {', '.join(FILTER_FIELDS)}")
+    return tuple(sorted(normalized))
+
+
+class MetadataIndex:
+    """Inverted indexes over document metadata for filtered search.
+    
+    For each of FILTER_FIELDS the distinct lower-cased values (the words of
+    authors and journals, whole tags and collections) are kept sorted, each
+    with the sorted ids of the documents carrying it as a slice of one
+    postings array. Years are one array, 0 where unknown. mask() combines
+    postings into a boolean mask over the documents, so a filter costs the
+    same however it was written. A saved index is memory-mapped.
+    """
+    
+    WORD_PATTERN = re.compile(r"(?u)\w+")
+    
+    def __init__(self, years: np.ndarray,
+                 postings: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        self.years = years
+        self.postings = postings
+
+    def __len__(self) -> int:
+        return len(self.years)
+
+    @classmethod
+    def terms(cls, field: str, values: List[str]) -> List[str]:
+        """Lookup terms of a field's values: lower-cased words or whole names."""
+        if field in WORD_FILTER_FIELDS:
+            return [word for value in values
+                    for word in cls.WORD_PATTERN.findall(value.lower())]
+        return [value.strip().lower() for value in values if value.strip()]
+
+    @classmethod
+    def build(cls, documents) -> 'MetadataIndex':
+        """Index the filter fields of ``documents``, whose positions are their ids."""
+        years = []
+        by_term = {field: {} for field in FILTER_FIELDS}
+        for doc_id, doc in enumerate(documents):
+            years.append(parse_year(doc.get('year', '')))
+            values = {
+                # Indexes built before all creators were stored only have the first one
+                'author': doc.get('authors') or [doc.get('author', '')],
+                'journal': [doc.get('journal', '')],
+                'tag': doc.get('item_tags', []),
+                'collection': doc.get('collections', []),
+            }
+            for field, field_values in values.items():
+                for term in set(cls.terms(field, field_values)):
+                    by_term[field].setdefault(term, []).append(doc_id)
+                    
+        postings = {}
+        for field, doc_ids in by_term.items():
+            terms = sorted(doc_ids)
+            offsets = np.zeros(len(terms) + 1, dtype='int64')
+            np.cumsum([len(doc_ids[term]) for term in terms], out=offsets[1:])
+            ids = np.fromiter((doc_id for term in terms for doc_id in doc_ids[term]),
+                              dtype='int64', count=int(offsets[-1]))
+            postings[field] = (np.array(terms, dtype=str), offsets, ids)
+        return cls(np.array(years, dtype='int32'), postings)
+
+    def _lookup(self, field: str, term: str) -> np.ndarray:
+        """Sorted ids of the documents with ``term`` in ``field``."""
+        terms, offsets, ids = self.postings[field]
+        row = int(np.searchsorted(terms, term))
+        if row == len(terms) or terms[row] != term:
+            return np.empty(0, dtype='int64')
+        return ids[offsets[row]:offsets[row + 1]]
+
+    def mask(self, filters: Tuple) -> np.ndarray:
+        """Boolean mask of the documents matching all normalized ``filters``.
+        
+        Alternative values of one field match if any of them does; a word
+        filter value matches documents having all of its words.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for field, value in filters:
+            if field == 'year':
+                low, high = value
+                mask &= self.years > 0
+                if low is not None:
+                    mask &= self.years >= low
+                if high is not None:
+                    mask &= self.years <= high
+                continue
+            field_mask = np.zeros(len(self), dtype=bool)
+            for alternative in value:
+                terms = self.terms(field, [alternative])
+                if not terms:
+                    continue
+                ids = self._lookup(field, terms[0])
+                for term in terms[1:]:
+                    ids = np.intersect1d(ids, self._lookup(field, term),
+                                         assume_unique=True)
+                field_mask[ids] = True
+            mask &= field_mask
+        return mask
+
+    def save(self, directory: str):
+        """Write the index as .npy files into ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'years.npy'), self.years)
+        for field, arrays in self.postings.items():
+            for name, array in zip(('terms', 'offsets', 'ids'), arrays):
+                np.save(os.path.join(directory, f"{field}.{name}.npy"), array)
+
+    @classmethod
+    def load(cls, directory: str) -> 'MetadataIndex':
+        """Memory-map an index written by save()."""
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+        
+        columns = ('terms', 'offsets', 'ids')
+        return cls(array('years'), {field: tuple(array(f"{field}.{name}")
+                                                 for name in columns)
+                                    for field in FILTER_FIELDS})
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]],
+                           k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse several best-first rankings of ids into one, best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def apply_rerank_scores(hits: List[Tuple], scores: List[float]) -> List[Tuple]:
+    """Reorder hits (tuples whose second item is the score) by rerank scores.
+    
+    ``scores`` belong to the first hits; those are returned best first with
+    these scores. Hits the rerank budget left unscored follow in their order,
+    with scores below every rescored hit's, so scores never rise down the list.
+    """
+    if not scores:
+        return list(hits)
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])
+    rescored = [(hits[i][0], scores[i], *hits[i][2:]) for i in order]
+    unscored = hits[len(scores):]
+    below = min(scores) - 1.0
+    return rescored + [(hit[0], below - j / len(unscored), *hit[2:])
+                       for j, hit in enumerate(unscored)]
+
+
+class TextCache:
+    """On-disk cache of extracted PDF text keyed by file content.
+    
+    Files are looked up by a cheap (path, size, mtime) fingerprint; when the
+    fingerprint changes the file is re-hashed, so a touched or moved file with
+    the same content is still a cache hit. Texts are evicted least recently
+    used first once the cache grows beyond ``max_bytes``.
+    """
+    
+    COMMIT_EVERY = 100
+    
+    def __init__(self, db_path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                sha256 TEXT
+            );
+            CREATE TABLE IF NOT EXISTS texts (
+                sha256 TEXT,
+                settings TEXT,
+                text TEXT,
+                nbytes INTEGER,
+                last_used REAL,
+                PRIMARY KEY (sha256, settings)
+            );
+        """)
+        self._pending_writes = 0
+
+    def file_hash(self, path: str) -> str:
+        """Return the content hash of a file, re-hashing only if it changed on disk."""
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime, sha256 FROM files WHERE path = ?",
+                                (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+            
+        sha256 = file_sha256(path)
+        self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                          (path, stat.st_size, stat.st_mtime, sha256))
+        self._wrote()
+        return sha256
+
+    def get(self, path: str, settings: str) -> Optional[str]:
+        """Return the cached text of a PDF, or None on a miss."""
+        try:
+            sha256 = self.file_hash(path)
+        except OSError:
+            return None
+        row = self.conn.execute(
+            "SELECT text FROM texts WHERE sha256 = ? AND settings = ?",
+            (sha256, settings)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            "UPDATE texts SET last_used = ? WHERE sha256 = ? AND settings = ?",
+            (time.time(), sha256, settings))
+        self._wrote()
+        return row[0]
+
+    def put(self, path: str, settings: str, text: str):
+        """Store the extracted text of a PDF."""
+        try:
+            sha256 = self.file_hash(path)
+        except OSError:
+            return
+        self.conn.execute("INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?, ?)",
+                          (sha256, settings, text, len(text.encode('utf-8')),
+                           time.time()))
+        self._wrote()
+
+    def _wrote(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.COMMIT_EVERY:
+            self.flush()
+
+    def flush(self):
+        """Commit pending writes and evict old entries if over the size limit."""
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(nbytes), 0) FROM texts").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used texts until 90% of the limit
+            excess = total - int(self.max_bytes * 0.9)
+            rows = self.conn.execute(
+                "SELECT sha256, settings, nbytes FROM texts ORDER BY last_used")
+            doomed = []
+            for sha256, settings, nbytes in rows:
+                if excess <= 0:
+                    break
+                doomed.append((sha256, settings))
+                excess -= nbytes
+            self.conn.executemany("DELETE FROM texts WHERE sha256 = ? AND settings = ?",
+                                  doomed)
+        self.conn.commit()
+        self._pending_writes = 0
+
+    def prune(self) -> int:
+        """Remove entries for files that no longer exist. Returns the number removed."""
+        paths = [row[0] for row in self.conn.execute("SELECT path FROM files")]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", missing)
+        self.conn.execute(
+            "DELETE FROM texts WHERE sha256 NOT IN (SELECT sha256 FROM files)")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        return len(missing)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class EmbeddingCache:
+    """On-disk cache of raw embeddings keyed by model name and text hash.
+    
+    Vectors are stored as float32 blobs, so rebuilding an index only encodes
+    corpus strings that were not embedded by the same model before. Every
+    vector records when it was last read or written, so a full build can
+    prune() the vectors its corpus no longer contains.
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT,
+                text_hash TEXT,
+                vector BLOB,
+                last_used REAL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(embeddings)")]
+        if 'last_used' not in columns:
+            # Caches written before vectors were pruned
+            self.conn.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL")
+            self.conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached vector of each text, or None where it is missing."""
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+        now = time.time()
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                "SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                [model] + chunk)
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype='float32')
+            self.conn.execute(
+                "UPDATE embeddings SET last_used = ? "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                [now, model] + chunk)
+        self.conn.commit()
+        return [found.get(text_hash) for text_hash in hashes]
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        """Store the vectors of the given texts."""
+        vectors = np.asarray(vectors, dtype='float32')
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+            ((model, self.text_hash(text), vector.tobytes(), now)
+             for text, vector in zip(texts, vectors)))
+        self.conn.commit()
+
+    def prune(self, model: str, used_since: float) -> int:
+        """Remove vectors not read or written for ``model`` since ``used_since``.
+        
+        Called after a full build with its start time, this keeps exactly the
+        vectors of the live corpus for that model; vectors of other models
+        (e.g. of another index sharing the cache) are left alone. Returns the
+        number of vectors removed.
+        """
+        removed = self.conn.execute(
+            "DELETE FROM embeddings "
+            "WHERE model = ? AND (last_used IS NULL OR last_used < ?)",
+            (model, used_since)).rowcount
+        self.conn.commit()
+        if removed:
+            self.conn.execute("VACUUM")
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+class QueryCache:
+    """Bounded LRU caches of query embeddings and search results.
+    
+    Query embeddings are keyed by model name and whitespace-normalized query,
+    so they stay valid across index rebuilds. Search results are keyed by the
+    query and every option that affects ranking, and belong to one index
+    version: looking up results for a different version drops them all, so a
+    rebuilt or updated index never serves stale hits.
+    
+    With ``db_path`` the caches are loaded from a SQLite file on creation and
+    written back by close(), so repeated queries are answered across CLI runs
+    without loading the model.
+    """
+    
+    def __init__(self, max_embeddings: int = QUERY_CACHE_SIZE,
+                 max_results: int = QUERY_CACHE_SIZE, db_path: Optional[str] = None):
+        self.max_embeddings = max_embeddings
+        self.max_results = max_results
+        self.db_path = db_path
+        self.index_version = None
+        self._embeddings = OrderedDict()
+        self._results = OrderedDict()
+        self.embedding_hits = self.embedding_misses = 0
+        self.result_hits = self.result_misses = 0
+        if db_path and os.path.exists(db_path):
+            self._load()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.split())
+
+    def get_embedding(self, model: str, query: str) -> Optional[np.ndarray]:
+        key = (model, self.normalize(query))
+        vector = self._embeddings.get(key)
+        if vector is None:
+            self.embedding_misses += 1
+            return None
+        self._embeddings.move_to_end(key)
+        self.embedding_hits += 1
+        return vector
+
+    def put_embedding(self, model: str, query: str, vector: np.ndarray):
+        self._embeddings[(model, self.normalize(query))] = vector
+        if len(self._embeddings) > self.max_embeddings:
+            self._embeddings.popitem(last=False)
+
+    def get_results(self, index_version: str, query: str,
+                    options: Tuple) -> Optional[List]:
+        """Cached hits of a query against ``index_version``, or None on a miss."""
+        if index_version != self.index_version:
+            self._results.clear()
+            self.index_version = index_version
+        key = json.dumps([self.normalize(query), *options])
+        hits = self._results.get(key)
+        if hits is None:
+            self.result_misses += 1
+            return None
+        self._results.move_to_end(key)
+        self.result_hits += 1
+        return hits
+
+    def put_results(self, index_version: str, query: str, options: Tuple, hits: List):
+        if index_version != self.index_version:
+            return
+        self._results[json.dumps([self.normalize(query), *options])] = hits
+        if len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and sizes, for sizing the caches."""
+        return {
+            'embedding_hits': self.embedding_hits,
+            'embedding_misses': self.embedding_misses,
+            'embeddings': len(self._embeddings), 'max_embeddings': self.max_embeddings,
+            'result_hits': self.result_hits, 'result_misses': self.result_misses,
+            'results': len(self._results), 'max_results': self.max_results,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT,
+                query TEXT,
+                vector BLOB,
+                PRIMARY KEY (model, query)
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                index_version TEXT,
+                hits TEXT
+            );
+        """)
+        return conn
+
+    def _load(self):
+        conn = self._connect()
+        try:
+            # Rows are stored least recently used first
+            rows = conn.execute(
+                "SELECT model, query, vector FROM embeddings ORDER BY rowid")
+            for model, query, vector in rows:
+                self.put_embedding(model, query, np.frombuffer(vector, dtype='float32'))
+            for key, index_version, hits in conn.execute(
+                    "SELECT key, index_version, hits FROM results ORDER BY rowid"):
+                self.index_version = index_version
+                self._results[key] = [tuple(hit) for hit in json.loads(hits)]
+        finally:
+            conn.close()
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def close(self):
+        """Write the caches to ``db_path``, if set."""
+        if not self.db_path:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM embeddings")
+                conn.execute("DELETE FROM results")
+                embeddings = ((model, query, np.asarray(vector, 'float32').tobytes())
+                              for (model, query), vector in self._embeddings.items())
+                conn.executemany("INSERT INTO embeddings VALUES (?, ?, ?)", embeddings)
+                conn.executemany("INSERT INTO results VALUES (?, ?, ?)",
+                                 ((key, self.index_version, json.dumps(hits))
+                                  for key, hits in self._results.items()))
+        finally:
+            conn.close()
+
+
+def _memory_usage_mb() -> Tuple[Optional[float], Optional[float]]:
+    """Current and peak resident memory of this process in MB (Linux only)."""
+    try:
+        with open('/proc/self/status') as f:
+            values = dict(line.split(':', 1) for line in f
+                          if line.startswith(('VmRSS', 'VmHWM')))
+    except OSError:
+        return None, None
+    rss, peak = (values.get(name) for name in ('VmRSS', 'VmHWM'))
+    return (int(rss.split()[0]) / 1024 if rss else None,
+            int(peak.split()[0]) / 1024 if peak else None)
+
+
+class Profiler:
+    """Timing and memory instrumentation for index builds and searches.
+    
+    Assign one to ``ZoteroRAG.profiler`` (as --profile does) to record the
+    time and resident memory of every build and search stage, each PDF's
+    extraction time, encoding throughput and FAISS search time; report()
+    summarizes them. Every measurement is also passed to the hooks as
+    ``hook(event, data)`` with event 'stage', 'file', 'encode' or
+    'faiss_search', so callers can forward them to their own metrics.
+    
+    The profiler is off by default (``profiler = None``), which costs the
+    instrumented code one attribute check per stage. It is safe to share
+    between the threads of the search server.
+    """
+    
+    def __init__(self, hooks: Optional[List] = None,
+                 slowest: int = PROFILE_SLOWEST_FILES):
+        self.hooks = list(hooks or [])
+        self.slowest = slowest
+        self.started = time.time()
+        self.stages = {}
+        self.counters = Counter()
+        self.encoding = {}
+        self._slowest_files = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Call ``hook(event, data)`` for every measurement from now on."""
+        self.hooks.append(hook)
+
+    def _emit(self, event: str, data: Dict):
+        for hook in self.hooks:
+            hook(event, data)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, memory: bool = True, **data):
+        """Time the enclosed block as one call of stage ``name``.
+        
+        With ``memory`` the resident memory before and after is sampled as
+        well; fine-grained search stages skip it.
+        """
+        rss_before = _memory_usage_mb()[0] if memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if memory:
+                rss, peak = _memory_usage_mb()
+                if rss is not None and rss_before is not None:
+                    data.update(rss_mb=rss, rss_delta_mb=rss - rss_before,
+                                peak_rss_mb=peak)
+            self.record(name, seconds, **data)
+
+    def record(self, name: str, seconds: float, calls: int = 1, **data):
+        """Add ``calls`` calls taking ``seconds`` in total to stage ``name``."""
+        with self._lock:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += calls
+            stage['seconds'] += seconds
+            if 'rss_mb' in data:
+                stage['rss_mb'] = data['rss_mb']
+                stage['max_rss_delta_mb'] = max(stage.get('max_rss_delta_mb', 0.0),
+                                                data['rss_delta_mb'])
+        if self.hooks:
+            self._emit('stage', dict(data, name=name, seconds=seconds, calls=calls))
+
+    def count(self, name: str, n: int = 1):
+        """Add ``n`` to counter ``name``, e.g. cache hits."""
+        with self._lock:
+            self.counters[name] += n
+
+    def file_extracted(self, path: str, seconds: float, n_chars: int,
+                       status: str = 'ok'):
+        """Record the text extraction of one PDF; ``status`` is ok, timeout or error."""
+        with self._lock:
+            self.counters['files_extracted'] += 1
+            if status != 'ok':
+                self.counters[f"files_{status}"] += 1
+            self.counters['extracted_chars'] += n_chars
+            stage = self.stages.setdefault('extract_pdf_text',
+                                           {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            entry = (seconds, path, n_chars, status)
+            if len(self._slowest_files) < self.slowest:
+                heapq.heappush(self._slowest_files, entry)
+            elif self.slowest:
+                heapq.heappushpop(self._slowest_files, entry)
+        if self.hooks:
+            self._emit('file', {'path': path, 'seconds': seconds, 'chars': n_chars,
+                                'status': status})
+
+    def encoded(self, kind: str, n_texts: int, n_tokens: int, seconds: float):
+        """Record one encoder call over ``n_texts`` 'documents' or 'queries'."""
+        with self._lock:
+            totals = self.encoding.setdefault(
+                kind, {'calls': 0, 'texts': 0, 'tokens': 0, 'seconds': 0.0})
+            totals['calls'] += 1
+            totals['texts'] += n_texts
+            totals['tokens'] += n_tokens
+            totals['seconds'] += seconds
+        if self.hooks:
+            self._emit('encode', {'kind': kind, 'texts': n_texts, 'tokens': n_tokens,
+                                  'seconds': seconds})
+
+    def faiss_searched(self, n_queries: int, n_results: int, seconds: float):
+        """Record one FAISS search over ``n_queries`` query vectors."""
+        with self._lock:
+            stage = self.stages.setdefault('faiss_search', {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            self.counters['faiss_queries'] += n_queries
+        if self.hooks:
+            self._emit('faiss_search',
+                       {'queries': n_queries, 'k': n_results, 'seconds': seconds})
+
+    def report(self) -> Dict:
+        """Summary of everything recorded so far, as JSON-serializable data."""
+        with self._lock:
+            stages = {name: dict(stage,
+                                 mean_ms=stage['seconds'] / stage['calls'] * 1000)
+                      for name, stage in self.stages.items()}
+            encoding = {}
+            for kind, totals in self.encoding.items():
+                seconds = totals['seconds']
+                encoding[kind] = dict(
+                    totals, texts_per_s=totals['texts'] / seconds if seconds else None,
+                    tokens_per_s=totals['tokens'] / seconds if seconds else None)
+            counters = dict(self.counters)
+            slowest = [{'path': path, 'seconds': seconds, 'chars': n_chars,
+                        'status': status}
+                       for seconds, path, n_chars, status
+                       in sorted(self._slowest_files, reverse=True)]
+        extraction = stages.get('extract_pdf_text')
+        faiss_stage = stages.get('faiss_search')
+        rss, peak = _memory_usage_mb()
+        return {
+            'created': self.started,
+            'wall_seconds': time.time() - self.started,
+            'stages': stages,
+            'extraction': {
+                'files': counters.get('files_extracted', 0),
+                'seconds': extraction['seconds'] if extraction else 0.0,
+                'files_per_s': (extraction['calls'] / extraction['seconds']
+                                if extraction and extraction['seconds'] else None),
+                'chars': counters.get('extracted_chars', 0),
+                'timeouts': counters.get('files_timeout', 0),
+                'errors': counters.get('files_error', 0),
+                'slowest': slowest,
+            },
+            'encoding': encoding,
+            'faiss_search': {
+                'calls': faiss_stage['calls'] if faiss_stage else 0,
+                'queries': counters.get('faiss_queries', 0),
+                'seconds': faiss_stage['seconds'] if faiss_stage else 0.0,
+                'ms_per_query': (
+                    faiss_stage['seconds'] / counters['faiss_queries'] * 1000
+                    if faiss_stage and counters.get('faiss_queries') else None),
+            },
+            'counters': counters,
+            'memory': {'rss_mb': rss, 'peak_rss_mb': peak},
+        }
+
+    def write(self, path: str):
+        """Write report() to ``path`` as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class NearDuplicateIndex:
+    """MinHash signatures with LSH banding, to find near-duplicate texts.
+    
+    A text's word SHINGLE_WORDS-grams are hashed by MINHASH_PERMUTATIONS hash
+    functions and the minimum of each is kept; the share of equal values in
+    two signatures estimates the Jaccard similarity of their shingle sets.
+    Only texts agreeing on a whole band of their signatures are compared, so
+    a lookup costs about the same however many texts were added. The hash
+    functions are fixed, so signatures saved with an index stay comparable.
+    Texts are only matched when their documents' identities (see identity())
+    agree, so papers sharing boilerplate text are never grouped.
+    
+    ``duplicates`` collects (path, path of the matching text, similarity)
+    for the texts the corpus iterators skipped as near-duplicates.
+    """
+    
+    EMPTY = np.iinfo(np.uint32).max
+    # Smallest prime above 2**32, the modulus of the permutation hashes
+    PRIME = 4294967311
+    
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                 permutations: int = MINHASH_PERMUTATIONS, bands: int = MINHASH_BANDS):
+        if permutations % bands:
+            raise ValueError("MinHash permutations must split evenly into bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        rng = np.random.default_rng(0)
+        self._a = rng.integers(1, 1 << 32, permutations, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, 1 << 32, permutations, dtype=np.uint64)[:, None]
+        self._keys = []
+        self._signatures = []
+        self._identities = []
+        self._rows_by_key = {}
+        self._buckets = {}
+        self.duplicates = []
+
+    @staticmethod
+    def identity(doc: Dict) -> Tuple[str, str]:
+        """The normalised title and DOI of a document, empty where unknown."""
+        title = ' '.join(re.findall(r'\w+', (doc.get('title') or '').lower()))
+        return title, (doc.get('doi') or '').strip().lower()
+
+    @staticmethod
+    def conflicts(identity: Optional[Tuple[str, str]],
+                  other: Optional[Tuple[str, str]]) -> bool:
+        """Whether two identities name different papers: a title or DOI differs."""
+        if identity is None or other is None:
+            return False
+        return any(a and b and a != b for a, b in zip(identity, other))
+
+    def signature(self, text: Optional[str]) -> np.ndarray:
+        """MinHash signature of ``text``; all EMPTY if it has too few words."""
+        words = re.findall(r'\w+', (text or '').lower())
+        shingles = {' '.join(words[i:i + SHINGLE_WORDS])
+                    for i in range(len(words) - SHINGLE_WORDS + 1)}
+        if len(shingles) < NEAR_DUPLICATE_MIN_SHINGLES:
+            return np.full(len(self._a), self.EMPTY, dtype=np.uint32)
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8'))
+                              for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # (a * x + b) stays below 2**64 for 32-bit a, b and x
+        return ((self._a * hashes + self._b) % self.PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        rows = self.rows
+        return [hash((band, signature[band * rows:(band + 1) * rows].tobytes()))
+                for band in range(self.bands)]
+
+    def match(self, signature: np.ndarray, identity: Optional[Tuple[str, str]] = None
+              ) -> Optional[Tuple[str, float]]:
+        """(key, estimated similarity) of the most similar text added, if any.
+        
+        Texts whose identity conflicts with ``identity`` are passed over.
+        """
+        if (signature == self.EMPTY).all():
+            return None
+        candidates = {row for band_key in self._band_keys(signature)
+                      for row in self._buckets.get(band_key, ())}
+        best = None
+        for row in sorted(candidates):
+            if self.conflicts(identity, self._identities[row]):
+                continue
+            similarity = float(np.mean(self._signatures[row] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self._keys[row], similarity)
+        return best
+
+    def add(self, key: str, signature: np.ndarray,
+            identity: Optional[Tuple[str, str]] = None):
+        """Make a text findable under ``key``; texts without words are not added."""
+        if (signature == self.EMPTY).all():
+            return
+        row = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        self._identities.append(identity)
+        self._rows_by_key[key] = row
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(row)
+
+    def add_many(self, keys: List[str], signatures: np.ndarray,
+                 identities: Optional[List[Tuple[str, str]]] = None):
+        identities = identities or [None] * len(keys)
+        for key, signature, identity in zip(keys, signatures, identities):
+            self.add(key, np.asarray(signature), identity)
+
+    def signatures(self, keys: List[str]) -> np.ndarray:
+        """Stacked signatures of ``keys``, all EMPTY for texts that were not added."""
+        result = np.full((len(keys), len(self._a)), self.EMPTY, dtype=np.uint32)
+        for i, key in enumerate(keys):
+            row = self._rows_by_key.get(key)
+            if row is not None:
+                result[i] = self._signatures[row]
+        return result
+
+    def take_duplicates(self) -> List[Tuple[str, str, float]]:
+        """The near-duplicates found since the last call."""
+        duplicates, self.duplicates = self.duplicates, []
+        return duplicates
+
+
+class BuildCheckpoint:
+    """Completed chunks of an index build, kept on disk so it can resume.
+    
+    Every chunk holds the embeddings, passage table and keyword index of a
+    group of documents, together with the path and fingerprint of each
+    document, and the near-duplicates of earlier documents found (and not
+    indexed) while building it. A chunk is written to a temporary directory
+    and renamed into place, so an interrupted build leaves only complete
+    chunks behind.
+    Chunks built with different settings are discarded, and so are chunks
+    containing a document that has since changed or disappeared.
+    """
+    
+    def __init__(self, directory: str, settings: Dict):
+        self.directory = directory
+        self.chunks_dir = os.path.join(directory, 'chunks')
+        settings_path = os.path.join(directory, 'checkpoint.json')
+        if os.path.exists(settings_path):
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                if json.load(f) != settings:
+                    print("Build settings changed; discarding the previous checkpoint")
+                    shutil.rmtree(self.chunks_dir, ignore_errors=True)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        with open(settings_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+
+    def _chunk_path(self, chunk_id: int) -> str:
+        return os.path.join(self.chunks_dir, f"{chunk_id:06d}")
+
+    def valid_chunks(self,
+                     fingerprints: Dict[str, List]) -> List[Tuple[int, List[str]]]:
+        """(chunk id, document paths) of the chunks still matching the library.
+        
+        ``fingerprints`` maps the path of every current document to its
+        fingerprint. Stale and partially written chunks are deleted, and so
+        are chunks with a near-duplicate whose matching document is gone.
+        """
+        chunks = []
+        for name in sorted(os.listdir(self.chunks_dir)):
+            path = os.path.join(self.chunks_dir, name)
+            if not name.isdigit():
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            with open(os.path.join(path, 'documents.json'), 'r', encoding='utf-8') as f:
+                documents = json.load(f)
+            duplicates = self._read_duplicates(path)
+            unchanged = all(fingerprints.get(doc_path) == fingerprint
+                            for doc_path, fingerprint in documents)
+            if unchanged and all(fingerprints.get(doc_path) == fingerprint
+                                 and canonical in fingerprints
+                                 for doc_path, fingerprint, canonical, _ in duplicates):
+                chunks.append((int(name), [doc_path for doc_path, _ in documents]))
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+        return chunks
+
+    @staticmethod
+    def _read_duplicates(path: str) -> List:
+        duplicates_path = os.path.join(path, 'duplicates.json')
+        if not os.path.exists(duplicates_path):
+            return []
+        with open(duplicates_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_chunk(self, chunk_id: int, documents: List[Tuple[str, List]],
+                    embeddings: np.ndarray,
+                    owners: np.ndarray, spans: np.ndarray, lexical_index: LexicalIndex,
+                    duplicates: List[Tuple[str, List, str, float]] = (),
+                    minhashes: Optional[np.ndarray] = None):
+        """Store one chunk; ``documents`` are (path, fingerprint) pairs.
+        
+        ``duplicates`` are (path, fingerprint, path of the matching document,
+        similarity) for the near-duplicates skipped, and ``minhashes`` the
+        MinHash signatures of ``documents``.
+        """
+        path = self._chunk_path(chunk_id)
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        with open(os.path.join(tmp_path, 'documents.json'), 'w', encoding='utf-8') as f:
+            json.dump(documents, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_path, 'embeddings.npy'), embeddings)
+        np.save(os.path.join(tmp_path, 'owners.npy'), owners)
+        np.save(os.path.join(tmp_path, 'spans.npy'), spans)
+        lexical_index.save(os.path.join(tmp_path, 'lexical'))
+        if duplicates:
+            with open(os.path.join(tmp_path, 'duplicates.json'), 'w',
+                      encoding='utf-8') as f:
+                json.dump(list(duplicates), f, ensure_ascii=False)
+        if minhashes is not None:
+            np.save(os.path.join(tmp_path, 'minhash.npy'), minhashes)
+        os.rename(tmp_path, path)
+
+    def read_chunk(self, chunk_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Memory-mapped (embeddings, owners, spans) of a chunk."""
+        path = self._chunk_path(chunk_id)
+        return tuple(np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                     for name in ('embeddings', 'owners', 'spans'))
+
+    def read_lexical(self, chunk_id: int) -> LexicalIndex:
+        return LexicalIndex.load(os.path.join(self._chunk_path(chunk_id), 'lexical'))
+
+    def read_duplicates(self, chunk_id: int) -> List[Tuple[str, str, float]]:
+        """(path, matching document path, similarity) of a chunk's near-duplicates."""
+        return [(doc_path, canonical, similarity) for doc_path, _, canonical, similarity
+                in self._read_duplicates(self._chunk_path(chunk_id))]
+
+    def read_minhashes(self, chunk_id: int) -> Optional[np.ndarray]:
+        """MinHash signatures of a chunk's documents, if it was built with them."""
+        path = os.path.join(self._chunk_path(chunk_id), 'minhash.npy')
+        return np.load(path) if os.path.exists(path) else None
+
+    def create_embeddings(self, shape: Tuple[int, int], dtype: str) -> np.ndarray:
+        """A writable, memory-mapped embedding matrix for the assembled index."""
+        return np.lib.format.open_memmap(os.path.join(self.directory, 'embeddings.npy'),
+                                         mode='w+', dtype=dtype, shape=shape)
+
+    def read_embeddings(self) -> np.ndarray:
+        """The assembled index's embedding matrix, memory-mapped read-only."""
+        return np.load(os.path.join(self.directory, 'embeddings.npy'), mmap_mode='r')
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class DocumentStore:
+    """Read-only, memory-mapped columnar store of document metadata.
+    
+    Each field is a column of .npy files in one directory: numbers are stored
+    as plain arrays, strings (and any other JSON values) as an offsets array
+    into one UTF-8 byte array. Opening the store maps the files without
+    reading them, and a document is only decoded when it is accessed, so
+    loading a large index costs the same as loading a small one.
+    """
+    
+    def __init__(self, directory: str, columns: Dict[str, str]):
+        self.directory = directory
+        self.columns = columns
+        self._arrays = {}
+        self._length = 0
+        for field, kind in columns.items():
+            if kind in ('str', 'json'):
+                offsets = self._open(f"{field}.offsets")
+                self._arrays[field] = (offsets, self._open(f"{field}.bytes"))
+                self._length = len(offsets) - 1
+            else:
+                self._arrays[field] = self._open(field)
+                self._length = len(self._arrays[field])
+
+    def _open(self, name: str) -> np.ndarray:
+        # A plain ndarray view of the mapping: indexing an np.memmap builds a
+        # new memmap object on every slice, which dominates document lookups
+        return np.asarray(np.load(os.path.join(self.directory, f"{name}.npy"),
+                                  mmap_mode='r'))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, i: int) -> Dict:
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        doc = {}
+        for field, kind in self.columns.items():
+            if kind in ('str', 'json'):
+                offsets, data = self._arrays[field]
+                start, end = offsets[i:i + 2].tolist()
+                raw = data[start:end].tobytes()
+                if kind == 'str':
+                    doc[field] = raw.decode('utf-8')
+                elif raw:
+                    # Documents without the field have no bytes at all
+                    doc[field] = json.loads(raw)
+            else:
+                doc[field] = self._arrays[field][i].item()
+        return doc
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(self._length):
+            yield self[i]
+
+    @staticmethod
+    def _column_kind(values: List) -> str:
+        if all(isinstance(value, str) for value in values):
+            return 'str'
+        if all(isinstance(value, int) and not isinstance(value, bool)
+               for value in values):
+            return 'int64'
+        if all(isinstance(value, (int, float)) and not isinstance(value, bool)
+               for value in values):
+            return 'float64'
+        return 'json'
+
+    @classmethod
+    def write(cls, directory: str, documents: List[Dict]) -> Dict[str, str]:
+        """Write ``documents`` into ``directory`` and return the column kinds."""
+        os.makedirs(directory, exist_ok=True)
+        fields = []
+        for doc in documents:
+            for field in doc:
+                if field not in fields:
+                    fields.append(field)
+                    
+        columns = {}
+        missing = object()
+        for field in fields:
+            values = [doc.get(field, missing) for doc in documents]
+            kind = cls._column_kind(values)
+            columns[field] = kind
+            if kind in ('str', 'json'):
+                if kind == 'str':
+                    encoded = [value.encode('utf-8') for value in values]
+                else:
+                    encoded = [b'' if value is missing else
+                               json.dumps(value, ensure_ascii=False).encode('utf-8')
+                               for value in values]
+                offsets = np.zeros(len(encoded) + 1, dtype='int64')
+                np.cumsum([len(raw) for raw in encoded], out=offsets[1:])
+                np.save(os.path.join(directory, f"{field}.offsets.npy"), offsets)
+                np.save(os.path.join(directory, f"{field}.bytes.npy"),
+                        np.frombuffer(b''.join(encoded), dtype=np.uint8))
+            else:
+                np.save(os.path.join(directory, f"{field}.npy"),
+                        np.array(values, dtype=kind))
+        return columns
+
+
+def read_faiss_index(path: str):
+    """Read a FAISS index, memory-mapping its vector data where FAISS supports it.
+    
+    Flat codes are mapped in place. IVF inverted lists can only be mapped when
+    they were written on disk, so for those the lists are read into memory.
+    """
+    mmap_flags = faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+    try:
+        return faiss.read_index(path, mmap_flags)
+    except RuntimeError:
+        return faiss.read_index(path, getattr(faiss, 'IO_FLAG_MMAP_IFC', 0))
+
+
+def _file_manifest(root: str) -> Dict[str, Dict]:
+    """Size and SHA-256 of every file below ``root``, keyed by relative path."""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root).replace(os.sep, '/')
+            if relpath == 'manifest.json':
+                continue
+            files[relpath] = {'size': os.path.getsize(path),
+                              'sha256': file_sha256(path)}
+    return files
+
+
+def write_index(index_path: str, documents: List[Dict], faiss_index,
+                embeddings: Optional[np.ndarray] = None,
+                passage_doc: Optional[np.ndarray] = None,
+                passage_spans: Optional[np.ndarray] = None,
+                lexical_index: Optional[LexicalIndex] = None,
+                zotero_dir: Optional[str] = None, chunked: bool = False,
+                model_name: str = MODEL_NAME, build_id: Optional[str] = None,
+                metadata_index: Optional[MetadataIndex] = None,
+                text_prefixes: Optional[Dict[str, str]] = None,
+                embedding_dim: Optional[int] = None, encoder_backend: str = 'torch',
+                minhashes: Optional[np.ndarray] = None,
+                vector_rows: Optional[np.ndarray] = None) -> Dict:
+    """Write an index directory and return its manifest.
+    
+    The directory holds manifest.json, the columnar document store, the
+    embeddings, the FAISS index, the passage table of chunked indexes, the
+    keyword index and the metadata filter index (built from ``documents``
+    unless given). ``model_name``, ``embedding_dim`` (the truncation, None
+    for the model's own dimension) and ``text_prefixes`` record how the
+    embeddings were made, so queries are encoded the same way;
+    ``encoder_backend`` is recorded for reference. ``minhashes`` are the
+    documents' MinHash signatures, kept so updates can group new files
+    with indexed near-duplicates. ``vector_rows`` maps FAISS ids to rows of
+    an index holding removed vectors (see ZoteroRAG._remove_vectors). It is
+    written next to
+    its final location and moved into place once complete, so readers never
+    see a half-written index.
+    """
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    
+    columns = DocumentStore.write(os.path.join(tmp_path, 'documents'), documents)
+    n_vectors = faiss_index.ntotal if faiss_index is not None else 0
+    if vector_rows is not None:
+        n_vectors = int(np.count_nonzero(vector_rows >= 0))
+        np.save(os.path.join(tmp_path, 'vector_rows.npy'),
+                np.ascontiguousarray(vector_rows))
+    if faiss_index is not None:
+        faiss.write_index(faiss_index, os.path.join(tmp_path, 'index.faiss'))
+    if embeddings is not None:
+        np.save(os.path.join(tmp_path, 'embeddings.npy'),
+                np.ascontiguousarray(embeddings))
+    if passage_doc is not None:
+        passages = np.column_stack([passage_doc, passage_spans]).astype('int64')
+        np.save(os.path.join(tmp_path, 'passages.npy'), passages)
+    if lexical_index is not None:
+        lexical_index.save(os.path.join(tmp_path, 'lexical'))
+    if minhashes is not None:
+        np.save(os.path.join(tmp_path, 'minhash.npy'), np.ascontiguousarray(minhashes))
+    if metadata_index is None:
+        metadata_index = MetadataIndex.build(documents)
+    metadata_index.save(os.path.join(tmp_path, 'metadata'))
+        
+    manifest = {
+        'format': INDEX_FORMAT,
+        'version': INDEX_FORMAT_VERSION,
+        'build_id': build_id or uuid.uuid4().hex,
+        'created': time.time(),
+        'zotero_dir': zotero_dir,
+        'n_documents': len(documents),
+        'n_vectors': n_vectors,
+        'dimension': faiss_index.d if faiss_index is not None else None,
+        'chunked': chunked,
+        'index_type': type(faiss_index).__name__ if faiss_index is not None else None,
+        'model_name': model_name,
+        'embedding_dim': embedding_dim,
+        'encoder_backend': encoder_backend,
+        'text_prefixes': text_prefixes or {'query': '', 'passage': ''},
+        'columns': columns,
+        'files': _file_manifest(tmp_path),
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+        
+    # Swap the new directory in, keeping the old one until the rename succeeded
+    old_path = index_path + '.old'
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(index_path):
+        os.rename(index_path, old_path)
+    os.rename(tmp_path, index_path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def read_manifest(index_path: str, verify: bool = False) -> Dict:
+    """Read and check the manifest of an index directory.
+    
+    File sizes and row counts are always checked; ``verify`` also compares
+    every file against its recorded SHA-256, which reads the whole index.
+    Raises ValueError if the index is not readable by this version.
+    """
+    with open(os.path.join(index_path, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != INDEX_FORMAT:
+        raise ValueError(f"{index_path} is not a Zotero RAG index")
+    if manifest.get('version') != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {manifest.get('version')} "
+                         f"(this version reads {INDEX_FORMAT_VERSION}); "
+                         "rebuild the index")
+                         
+    for relpath, info in manifest['files'].items():
+        path = os.path.join(index_path, *relpath.split('/'))
+        if not os.path.exists(path):
+            raise ValueError(f"Index file missing: {relpath}")
+        if os.path.getsize(path) != info['size']:
+            raise ValueError(f"Index file truncated or modified: {relpath}")
+        if verify and file_sha256(path) != info['sha256']:
+            raise ValueError(f"Index file checksum mismatch: {relpath}")
+            
+    files = manifest['files']
+    if manifest['chunked'] and 'passages.npy' not in files:
+        raise ValueError("Chunked index has no passage table")
+    if not manifest['chunked'] and \
+            manifest['n_vectors'] not in (0, manifest['n_documents']):
+        raise ValueError("Index has a different number of vectors and documents")
+    return manifest
+
+
+def convert_legacy_index(json_path: str, index_path: str) -> Dict:
+    """Convert a JSON index with .faiss/.npz sidecar files to the directory format.
+    
+    Embeddings are reconstructed from the FAISS index (approximately for
+    product-quantized indexes), so the Zotero library is not needed.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+        
+    faiss_path = _sidecar_path(json_path, '.faiss')
+    faiss_index = faiss.read_index(faiss_path) if os.path.exists(faiss_path) else None
+    embeddings = None
+    if faiss_index is not None and faiss_index.ntotal:
+        try:
+            embeddings = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+        except RuntimeError:
+            print("Warning: this FAISS index cannot reconstruct its vectors; "
+                  "embeddings are not included")
+                  
+    chunked = data.get('chunked', False)
+    passage_doc = passage_spans = None
+    if chunked:
+        with np.load(_sidecar_path(json_path, '.passages.npz')) as passages:
+            passage_doc, passage_spans = passages['doc'], passages['spans']
+        if embeddings is not None:
+            embeddings = embeddings.astype('float16')
+            
+    lexical_path = _sidecar_path(json_path, '.lexical.npz')
+    lexical_index = None
+    if os.path.exists(lexical_path):
+        lexical_index = LexicalIndex.load_npz(lexical_path)
+    
+    return write_index(index_path, data['documents'], faiss_index, embeddings,
+                       passage_doc, passage_spans, lexical_index,
+                       zotero_dir=data.get('zotero_dir'), chunked=chunked)
+
+
 class ZoteroRAG:
-    def __init__(self, zotero_dir: str = None, use_gpu: bool = False):
-        """Initialize the Zotero RAG system."""
+    def __init__(self, zotero_dir: str = None, use_gpu: bool = False,
+                 workers: int = 1, extract_timeout: Optional[float] = 120.0,
+                 text_cache_path: Optional[str] = None,
+                 embedding_cache_path: Optional[str] = None,
+                 chunked: bool = False, passage_aggregation: str = 'max',
+                 index_type: str = 'auto', search_mode: str = 'hybrid',
+                 query_cache_path: Optional[str] = None,
+                 model_name: Optional[str] = None,
+                 embedding_dim: Optional[int] = None, encoder_backend: str = 'torch',
+                 encode_workers: int = 1, reranker: Optional[str] = None,
+                 rerank_candidates: int = RERANK_CANDIDATES,
+                 rerank_budget: Optional[float] = RERANK_TIME_BUDGET,
+                 deduplicate: bool = True,
+                 near_duplicate_threshold: Optional[float] = NEAR_DUPLICATE_THRESHOLD):
+        """Initialize the Zotero RAG system.
+        
+        ``model_name`` and ``embedding_dim`` choose the sentence transformer
+        and truncate its embeddings; a loaded index must have been built with
+        the same ones. Left unset, they default to MODEL_NAME at full
+        dimension and a loaded index brings its own. ``encoder_backend`` is
+        one of ENCODER_BACKENDS, and ``encode_workers`` > 1 encodes documents
+        in that many processes (see EncodePool).
+        
+        ``reranker`` names a cross-encoder that reorders the best
+        ``rerank_candidates`` documents of every search, spending at most
+        ``rerank_budget`` seconds per query (None for no limit).
+        
+        With ``deduplicate``, byte-identical PDFs are indexed once, as are
+        PDFs whose texts are at least ``near_duplicate_threshold`` similar
+        (None to group identical files only); the other copies are listed
+        under the indexed document's 'duplicates'.
+        """
+        if encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError(f"encoder backend must be one of {ENCODER_BACKENDS}")
         self.zotero_dir = self._find_zotero_directory(zotero_dir)
         self.storage_dir = os.path.join(self.zotero_dir, "storage")
         self.db_path = os.path.join(self.zotero_dir, "zotero.sqlite")
         self.use_gpu = use_gpu
+        self.workers = workers
+        self.extract_timeout = extract_timeout
+        self.chunked = chunked
+        self.passage_aggregation = passage_aggregation
+        self.index_type = index_type
+        self.search_mode = search_mode
+        # Default per-query search parameters for IVF and HNSW indexes
+        self.nprobe = None
+        self.ef_search = None
+        # Chunked indexes embed the full text of every PDF
+        self.max_text_chars = None if chunked else PDF_TEXT_CHARS
+        self.text_cache = TextCache(text_cache_path) if text_cache_path else None
+        self.embedding_cache = (EmbeddingCache(embedding_cache_path)
+                                if embedding_cache_path else None)
+        # Vectors the last _embed_documents() call read from the embedding cache
+        self._embedding_cache_hits = 0
+        # Set to None to disable query caching
+        self.query_cache = QueryCache(db_path=query_cache_path)
+        # Set to a Profiler to record stage timings (see --profile)
+        self.profiler = None
         
-        # Initialize embedding model
-        print("Loading sentence transformer model...")
-        device = 'cuda' if hasattr(self, 'use_gpu') and self.use_gpu else 'cpu'
-        self.model = SentenceTransformer('intfloat/e5-large-v2', device=device)
+        # The embedding model is loaded on first use, so lexical searches never load it
+        self.device = 'cuda' if self.use_gpu else 'cpu'
+        self._encoder_chosen = model_name is not None or embedding_dim is not None
+        self.model_name = model_name or MODEL_NAME
+        self.embedding_dim = embedding_dim
+        self.encoder_backend = encoder_backend
+        self.encode_workers = encode_workers
+        self._model = None
+        self._encode_pool = None
+        # Vector dimension of the built or loaded index, checked against the model
+        self._index_dimension = None
+        # Cross-encoder reranking of the first-stage candidates, loaded on first use
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget = rerank_budget
+        self._cross_encoder = None
+        # Measured seconds per reranked pair, to stop before a batch overruns the budget
+        self._rerank_pair_seconds = None
+        self.deduplicate = deduplicate
+        self.near_duplicate_threshold = near_duplicate_threshold
+        # Near-duplicate detection while a build or update extracts texts
+        self._near_duplicates = None
+        # Prefixes added to queries and corpus texts; a loaded index brings its own
+        self.text_prefixes = model_text_prefixes(self.model_name)
         
-        # Storage for documents and embeddings
+        # Storage for documents and embeddings. A loaded index keeps these
+        # memory-mapped and reads the FAISS index on first use.
         self.documents = []
         self.embeddings = None
-        self.faiss_index = None
+        self._faiss_index = None
+        self._faiss_path = None
+        self.lexical_index = None
+        # Inverted indexes for search filters, built on first use if not saved
+        self.metadata_index = None
+        # MinHash signature of every document, for grouping near-duplicates on update
+        self.minhashes = None
+        # Identifies the index contents; changes on every build or update
+        self.build_id = None
+        # Checkpoint of the last build, removed once the index is saved
+        self._build_checkpoint = None
+        
+        # In chunked mode, the document and character span of each FAISS vector
+        self.passage_doc = None
+        self.passage_spans = None
+        # Row of each FAISS id (-1 once removed) while an IVF or HNSW index holds
+        # removed vectors; None when ids and rows are the same
+        self.vector_rows = None
         
         print(f"Zotero directory: {self.zotero_dir}")
         print(f"Storage directory: {self.storage_dir}")
 
+    @property
+    def model(self) -> 'sentence_transformers.SentenceTransformer':
+        """The sentence transformer, loaded on first access."""
+        if self._model is None:
+            print("Loading sentence transformer model...")
+            model = load_encoder(self.model_name, self.encoder_backend, self.device,
+                                 self.embedding_dim)
+            dimension = model.get_sentence_embedding_dimension()
+            if self._index_dimension is not None and dimension != self._index_dimension:
+                raise ValueError(f"{self.model_name} makes {dimension}-dimensional "
+                                 "embeddings, but the index has "
+                                 f"{self._index_dimension}")
+            self._model = model
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        """Use an already constructed encoder (anything with a compatible encode())."""
+        self._model = model
+
+    @property
+    def cross_encoder(self) -> 'sentence_transformers.CrossEncoder':
+        """The reranking cross-encoder, loaded and warmed up on first access."""
+        if self._cross_encoder is None:
+            if self.reranker is None:
+                raise ValueError("No reranker configured")
+            print("Loading cross-encoder...")
+            model = load_cross_encoder(self.reranker, self.encoder_backend, self.device)
+            # The first call is slow; keep it out of the first query's budget
+            model.predict([("query", "document")], show_progress_bar=False)
+            self._cross_encoder = model
+        return self._cross_encoder
+
+    @cross_encoder.setter
+    def cross_encoder(self, model):
+        """Use an already constructed cross-encoder (anything with a predict())."""
+        self._cross_encoder = model
+
+    @property
+    def faiss_index(self):
+        """The FAISS index, memory-mapped from a loaded index on first access."""
+        if self._faiss_index is None and self._faiss_path is not None:
+            self._faiss_index = read_faiss_index(self._faiss_path)
+        return self._faiss_index
+
+    @faiss_index.setter
+    def faiss_index(self, index):
+        self._faiss_index = index
+        self._faiss_path = None
+
+    @property
+    def encoder_id(self) -> str:
+        """What embeddings are made with (model, dimension, backend), keying caches."""
+        encoder_id = self.model_name
+        if self.embedding_dim:
+            encoder_id += f":{self.embedding_dim}d"
+        if self.encoder_backend != 'torch':
+            encoder_id += f":{self.encoder_backend}"
+        return encoder_id
+
+    def _use_index_encoder(self, model_name: str, embedding_dim: Optional[int],
+                           dimension: Optional[int]):
+        """Encode queries with the model a loaded index was built with.
+        
+        Raises ValueError if a different model or dimension was chosen for
+        this ZoteroRAG.
+        """
+        if (model_name, embedding_dim) != (self.model_name, self.embedding_dim):
+            if self._encoder_chosen:
+                def describe(name, dim):
+                    return f"{name} at {dim} dimensions" if dim else name
+                raise ValueError(
+                    f"Index was built with {describe(model_name, embedding_dim)}, "
+                    f"not {describe(self.model_name, self.embedding_dim)}")
+            self.model_name, self.embedding_dim = model_name, embedding_dim
+            self._model = None
+        self._index_dimension = dimension
+
+    def _corpus_encoder(self, n_texts: int):
+        """The encode pool for large batches if encode_workers > 1, else the model."""
+        if self.encode_workers <= 1 or n_texts < ENCODE_POOL_MIN_TEXTS:
+            return self.model
+        if self._encode_pool is None:
+            print(f"Starting {self.encode_workers} encoder processes...")
+            self._encode_pool = EncodePool(self.model_name, self.encode_workers,
+                                           self.encoder_backend, self.embedding_dim)
+        return self._encode_pool
+
+    def _close_encode_pool(self):
+        if self._encode_pool is not None:
+            self._encode_pool.close()
+            self._encode_pool = None
+
+    def _own_faiss_index(self):
+        """Replace a memory-mapped FAISS index by a modifiable in-memory copy."""
+        if self._faiss_path is not None:
+            self.faiss_index = faiss.read_index(self._faiss_path)
+
+    def _stage(self, name: str, **data):
+        """Context manager timing a stage when profiling, doing nothing otherwise."""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name, **data)
+
+    def _timed_encode(self, kind: str, texts: List[str],
+                      max_batch: int = ENCODE_MAX_BATCH, encoder=None) -> np.ndarray:
+        """encode_texts() with ``encoder`` (the model by default).
+
+        Records the throughput when profiling.
+        """
+        encoder = encoder or self.model
+        if self.profiler is None:
+            return encode_texts(encoder, texts, max_batch=max_batch)
+        start = time.perf_counter()
+        vectors = encode_texts(encoder, texts, max_batch=max_batch)
+        seconds = time.perf_counter() - start
+        self.profiler.encoded(kind, len(texts),
+                              int(token_lengths(encoder, texts).sum()), seconds)
+        return vectors
+
     def _find_zotero_directory(self, custom_dir: str = None) -> str:
         """Find Zotero data directory."""
         if custom_dir and os.path.exists(custom_dir):
@@ -67,347 +2613,2638 @@ class ZoteroRAG:
             os.path.expanduser("~/.zotero/zotero/"),
         ]
         
-        for path in possible_paths:
-            if os.path.exists(path):
-                # For profile directories, find the actual profile
-                if "Profiles" in path:
-                    try:
-                        profiles = [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
-                        if profiles:
-                            return os.path.join(path, profiles[0])
-                    except:
-                        continue
-                else:
-                    return path
+        for path in possible_paths:
+            if os.path.exists(path):
+                # For profile directories, find the actual profile
+                if "Profiles" in path:
+                    try:
+                        profiles = [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
+                        if profiles:
+                            return os.path.join(path, profiles[0])
+                    except:
+                        continue
+                else:
+                    return path
+        
+        raise FileNotFoundError("Could not find Zotero directory. Please specify it manually.")
+
+    def extract_zotero_metadata(self, keys: Optional[List[str]] = None,
+                                immutable: bool = False) -> Dict[str, Dict]:
+        """Extract metadata from Zotero database; see load_zotero_metadata()."""
+        return load_zotero_metadata(self.db_path, keys, immutable)
+
+    def extract_pdf_text(self, pdf_path: str, max_chars: Optional[int] = None) -> str:
+        """Extract text from PDF file."""
+        return extract_pdf_text(pdf_path, max_chars)
+
+    def find_pdf_files(self, keys: Optional[List[str]] = None,
+                       immutable: bool = False) -> List[Dict]:
+        """Find all PDF files in Zotero storage, or in its ``keys`` folders only.
+        
+        ``immutable`` reads the database without waiting on a running Zotero
+        (see connect_zotero_db), for full builds.
+        """
+        with self._stage('zotero_metadata'):
+            metadata = self.extract_zotero_metadata(keys, immutable)
+        with self._stage('scan_storage'):
+            return scan_storage(self.storage_dir, metadata, keys)
+
+    def _iter_pdf_texts(self, pdf_paths: List[str],
+                        report: bool = True) -> Iterator[str]:
+        """Yield the text of each PDF in order, extracting only cache misses."""
+        if self.text_cache is None:
+            yield from iter_extracted_texts(pdf_paths, workers=self.workers,
+                                            timeout=self.extract_timeout,
+                                            max_chars=self.max_text_chars,
+                                            profiler=self.profiler)
+            return
+            
+        settings = f"v{EXTRACTOR_VERSION}:chars={self.max_text_chars}"
+        cached = [self.text_cache.get(path, settings) for path in pdf_paths]
+        missing = [path for path, text in zip(pdf_paths, cached) if text is None]
+        if report:
+            print(f"Text cache: {len(pdf_paths) - len(missing)} hits, "
+                  f"{len(missing)} misses")
+        if self.profiler is not None:
+            self.profiler.count('text_cache_hits', len(pdf_paths) - len(missing))
+        
+        extracted = iter_extracted_texts(missing, workers=self.workers,
+                                         timeout=self.extract_timeout,
+                                         max_chars=self.max_text_chars,
+                                         profiler=self.profiler)
+        try:
+            for path, text in zip(pdf_paths, cached):
+                if text is None:
+                    text = next(extracted)
+                    # Empty results may be timeouts or crashes, so retry them next time
+                    if text:
+                        self.text_cache.put(path, settings, text)
+                yield text
+        finally:
+            extracted.close()
+            self.text_cache.flush()
+
+    @staticmethod
+    def _metadata_text(pdf_info: Dict) -> str:
+        """Combine a document's metadata into searchable text."""
+        search_text_parts = [
+            pdf_info.get('title', ''),
+            pdf_info.get('author', ''),
+            pdf_info.get('journal', ''),
+            pdf_info.get('abstract', ''),
+            pdf_info.get('tags', ''),
+            pdf_info.get('filename', ''),
+        ]
+        return ' '.join(filter(None, search_text_parts))
+
+    def _iter_document_texts(self,
+                             pdf_files: List[Dict]) -> Iterator[Tuple[int, Dict, str]]:
+        """Yield (offset, pdf_info, PDF text) for each PDF in order as it is extracted.
+        
+        While a build or update detects near-duplicates, PDFs whose text
+        matches one already yielded are recorded there and skipped.
+        """
+        near_duplicates = self._near_duplicates
+        pdf_texts = self._iter_pdf_texts([pdf_info['path'] for pdf_info in pdf_files])
+        for i, (pdf_info, pdf_text) in enumerate(zip(pdf_files, pdf_texts)):
+            if i % 10 == 0:
+                print(f"Processing {i+1}/{len(pdf_files)} files...")
+            if near_duplicates is not None:
+                signature = near_duplicates.signature(pdf_text)
+                identity = NearDuplicateIndex.identity(pdf_info)
+                match = near_duplicates.match(signature, identity)
+                if match is not None:
+                    near_duplicates.duplicates.append((pdf_info['path'], *match))
+                    continue
+                near_duplicates.add(pdf_info['path'], signature, identity)
+            yield i, pdf_info, pdf_text
+
+    def _iter_corpus_entries(self, pdf_files: List[Dict]) -> Iterator[Tuple[int, str]]:
+        """Yield (offset, searchable text) for each PDF in order as it is extracted."""
+        for i, pdf_info, pdf_text in self._iter_document_texts(pdf_files):
+            search_text = self._metadata_text(pdf_info)
+            
+            # Only the first pages are parsed, up to the character budget
+            if pdf_text:
+                search_text = ' '.join(filter(None, [search_text,
+                                                     pdf_text[:self.max_text_chars]]))
+            
+            yield i, search_text
+
+    def iter_search_corpus(self, pdf_files: List[Dict]) -> Iterator[str]:
+        """Yield the searchable text of each PDF in order as it is extracted."""
+        for _, search_text in self._iter_corpus_entries(pdf_files):
+            yield search_text
+
+    def iter_passages(self, pdf_files: List[Dict]
+                      ) -> Iterator[Tuple[int, int, int, str, Optional[str]]]:
+        """Yield (document offset, start, end, text, document text) for every passage.
+        
+        Each document's metadata (title, authors, abstract, ...) is embedded as
+        a passage of its own with an empty span, so a long abstract never
+        pushes body text past the model's input limit; body passages are
+        prefixed with the title only. The whole document's text, for keyword
+        indexing, comes with the metadata passage and is None otherwise.
+        """
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        for i, pdf_info, pdf_text in self._iter_document_texts(pdf_files):
+            metadata_text = self._metadata_text(pdf_info)
+            document_text = f"{metadata_text} {pdf_text}" if pdf_text else metadata_text
+            yield i, 0, 0, metadata_text, document_text
+            if not pdf_text:
+                continue
+            title = pdf_info.get('title', '')
+            for start, end in split_passages(pdf_text, tokenizer=tokenizer):
+                yield i, start, end, f"{title} {pdf_text[start:end]}".strip(), None
+
+    def build_search_corpus(self, pdf_files: List[Dict]) -> List[str]:
+        """Build searchable text corpus from PDF metadata and content."""
+        print("Building search corpus...")
+        return list(self.iter_search_corpus(pdf_files))
+
+    def _encode_corpus(self, texts: List[str]) -> np.ndarray:
+        """Encode corpus strings, reusing cached embeddings where possible."""
+        prefix = self.text_prefixes['passage']
+        texts = [prefix + text for text in texts]
+        if self.embedding_cache is None:
+            return self._timed_encode('documents', texts,
+                                      encoder=self._corpus_encoder(len(texts)))
+            
+        vectors = self.embedding_cache.get_many(self.encoder_id, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if self.profiler is not None:
+            self.profiler.count('embedding_cache_hits', len(texts) - len(missing))
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            encoder = self._corpus_encoder(len(missing_texts))
+            encoded = self._timed_encode('documents', missing_texts, encoder=encoder)
+            self.embedding_cache.put_many(self.encoder_id, missing_texts, encoded)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        self._embedding_cache_hits += len(texts) - len(missing)
+        return np.vstack(vectors)
+
+    def _embed_documents(self, documents: List[Dict],
+                         lexical_index: Optional[LexicalIndex] = None
+                         ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Build the corpus for the given documents and return normalized embeddings.
+        
+        Returns the embeddings together with the offset into ``documents`` and
+        the (start, end) text span of each vector. Without chunking there is
+        one vector per document and the spans are empty. If ``lexical_index``
+        is given, one row per document is appended to it. Near-duplicates
+        skipped while detecting them get no vectors and no row.
+        
+        Corpus entries are encoded in chunks as they arrive, so embedding starts
+        while the remaining PDFs are still being parsed.
+        """
+        print("Building search corpus and generating embeddings...")
+        if self.chunked:
+            entries = self.iter_passages(documents)
+        else:
+            entries = ((i, 0, 0, text, text)
+                       for i, text in self._iter_corpus_entries(documents))
+        if self.profiler is not None:
+            entries = self._timed_entries(entries)
+            
+        chunks = []
+        batch = []
+        owners = []
+        spans = []
+        self._embedding_cache_hits = 0
+        for doc_offset, start, end, text, document_text in entries:
+            owners.append(doc_offset)
+            spans.append((start, end))
+            batch.append(text)
+            if document_text is not None and lexical_index is not None:
+                with self._stage('lexical_add', memory=False):
+                    lexical_index.add([document_text])
+            if len(batch) == ENCODE_CHUNK_SIZE:
+                with self._stage('encode'):
+                    chunks.append(self._encode_corpus(batch))
+                batch = []
+        if batch:
+            with self._stage('encode'):
+                chunks.append(self._encode_corpus(batch))
+        if self.embedding_cache is not None:
+            print(f"Embedding cache: {self._embedding_cache_hits} of {len(owners)} "
+                  "reused")
+        
+        if not chunks:
+            # Every document was a near-duplicate of one already indexed
+            return (np.empty((0, self._index_dimension or 0), dtype='float32'),
+                    np.empty(0, dtype='int64'), np.empty((0, 2), dtype='int64'))
+        
+        # Normalize embeddings for cosine similarity
+        embeddings = np.ascontiguousarray(np.vstack(chunks), dtype='float32')
+        faiss.normalize_L2(embeddings)
+        return (embeddings, np.array(owners, dtype='int64'),
+                np.array(spans, dtype='int64').reshape(-1, 2))
+
+    def _timed_entries(self, entries: Iterator) -> Iterator:
+        """Pass corpus entries through, recording the time spent waiting for them.
+        
+        This is the extraction and text assembly time the build actually
+        waited on; with several workers it is less than the extraction time.
+        """
+        waited = 0.0
+        n_entries = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    entry = next(entries)
+                except StopIteration:
+                    return
+                finally:
+                    waited += time.perf_counter() - start
+                n_entries += 1
+                yield entry
+        finally:
+            self.profiler.record('corpus_wait', waited, calls=max(n_entries, 1))
+
+    def build_index(self, checkpoint_dir: Optional[str] = None):
+        """Build FAISS index for similarity search; see _build_index()."""
+        try:
+            with self._stage('build_index'):
+                self._build_index(checkpoint_dir)
+        finally:
+            self._close_encode_pool()
+
+    def _build_index(self, checkpoint_dir: Optional[str] = None):
+        """Build FAISS index for similarity search.
+        
+        Documents are extracted, encoded and written to disk in chunks of
+        BUILD_CHUNK_DOCUMENTS, so only one chunk's texts and vectors are in
+        memory at a time; the index is then assembled from the chunks. With
+        ``checkpoint_dir`` the chunks are kept there until save_index()
+        succeeds, and a build that was interrupted resumes from the chunks
+        it completed. A build that encodes every document prunes the
+        embedding cache down to the vectors it used.
+        """
+        started = time.time()
+        print("Finding PDF files...")
+        documents = self.find_pdf_files(immutable=True)
+        
+        if not documents:
+            print("No PDF files found!")
+            return
+        if self.deduplicate:
+            documents = self._group_identical(documents)
+            
+        temporary = checkpoint_dir is None
+        if temporary:
+            checkpoint_dir = tempfile.mkdtemp(prefix='zotero-rag-build-')
+        checkpoint = BuildCheckpoint(checkpoint_dir, self._build_settings())
+        fingerprints = {doc['path']: self._group_fingerprint(doc) for doc in documents}
+        documents_by_path = {doc['path']: doc for doc in documents}
+        chunks = checkpoint.valid_chunks(fingerprints)
+        near_duplicates = self._near_duplicate_index()
+        duplicates = []
+        for chunk_id, paths in chunks:
+            duplicates.extend(checkpoint.read_duplicates(chunk_id))
+            minhashes = checkpoint.read_minhashes(chunk_id)
+            if near_duplicates is not None and minhashes is not None:
+                identities = [NearDuplicateIndex.identity(documents_by_path[path])
+                              for path in paths]
+                near_duplicates.add_many(paths, minhashes, identities)
+        done = {path for _, paths in chunks for path in paths}
+        done.update(path for path, _, _ in duplicates)
+        if done:
+            print(f"Resuming build: {len(done)} of {len(documents)} documents "
+                  "already indexed")
+            
+        remaining = [doc for doc in documents if doc['path'] not in done]
+        next_id = max((chunk_id for chunk_id, _ in chunks), default=-1) + 1
+        self._near_duplicates = near_duplicates
+        try:
+            for start in range(0, len(remaining), BUILD_CHUNK_DOCUMENTS):
+                chunk = remaining[start:start + BUILD_CHUNK_DOCUMENTS]
+                lexical_index = LexicalIndex()
+                embeddings, owners, spans = self._embed_documents(chunk, lexical_index)
+                chunk, owners = self._drop_unindexed(chunk, owners)
+                paths = [doc['path'] for doc in chunk]
+                chunk_duplicates = []
+                if near_duplicates is not None:
+                    chunk_duplicates = near_duplicates.take_duplicates()
+                with self._stage('checkpoint_write'):
+                    checkpoint.write_chunk(
+                        next_id, [(path, fingerprints[path]) for path in paths],
+                        embeddings, owners, spans, lexical_index,
+                        [(path, fingerprints[path], canonical, similarity)
+                         for path, canonical, similarity in chunk_duplicates],
+                        near_duplicates.signatures(paths) if near_duplicates else None)
+                chunks.append((next_id, paths))
+                duplicates.extend(chunk_duplicates)
+                next_id += 1
+                indexed = len(done) + min(start + BUILD_CHUNK_DOCUMENTS, len(remaining))
+                print(f"Checkpoint: {indexed} of {len(documents)} documents indexed")
+        finally:
+            self._near_duplicates = None
+            
+        with self._stage('assemble_index'):
+            self._assemble_index(checkpoint, chunks, documents_by_path)
+        self._attach_duplicates(duplicates, documents_by_path)
+        # Resumed chunks did not read their vectors from the cache
+        if self.embedding_cache is not None and not done:
+            pruned = self.embedding_cache.prune(self.encoder_id, started)
+            if pruned:
+                print(f"Embedding cache: pruned {pruned} vectors no longer in the "
+                      "corpus")
+        if temporary:
+            # The embeddings are mapped from the checkpoint; read them in first
+            if self.embeddings is not None:
+                self.embeddings = np.array(self.embeddings)
+            checkpoint.remove()
+        else:
+            self._build_checkpoint = checkpoint
+
+    def _build_settings(self) -> Dict:
+        """Everything that changes the vectors built for a document."""
+        return {'model': self.encoder_id, 'text_prefixes': self.text_prefixes,
+                'chunked': self.chunked,
+                'max_text_chars': self.max_text_chars,
+                'extractor_version': EXTRACTOR_VERSION,
+                'passage_tokens': PASSAGE_TOKENS, 'passage_overlap': PASSAGE_OVERLAP,
+                'deduplicate': self.deduplicate,
+                'near_duplicates': self._near_duplicate_settings()}
+
+    def _near_duplicate_settings(self) -> Optional[List]:
+        if not self.deduplicate or self.near_duplicate_threshold is None:
+            return None
+        return [self.near_duplicate_threshold, SHINGLE_WORDS, MINHASH_PERMUTATIONS,
+                MINHASH_BANDS, NEAR_DUPLICATE_MIN_SHINGLES]
+
+    def _near_duplicate_index(self) -> Optional[NearDuplicateIndex]:
+        """A fresh NearDuplicateIndex for a build or update, or None if disabled."""
+        if self._near_duplicate_settings() is None:
+            return None
+        return NearDuplicateIndex(self.near_duplicate_threshold)
+
+    def _assemble_index(self, checkpoint: BuildCheckpoint,
+                        chunks: List[Tuple[int, List[str]]],
+                        documents_by_path: Dict[str, Dict]):
+        """Build the FAISS and keyword indexes from a build's chunks, one at a time.
+        
+        Embeddings are copied chunk by chunk into a file in the checkpoint
+        directory and mapped back, so the only full copy in memory is FAISS's
+        (until a build without ``checkpoint_dir`` reads them in to remove its
+        temporary directory).
+        """
+        parts = [checkpoint.read_chunk(chunk_id) for chunk_id, _ in chunks]
+        n_vectors = sum(len(embeddings) for embeddings, _, _ in parts)
+        # Chunks of near-duplicates only have no vectors (and may not know the
+        # dimension)
+        dimension = max(embeddings.shape[1] for embeddings, _, _ in parts)
+        self._index_dimension = dimension
+        
+        # Build FAISS index
+        index_type = resolve_index_type(self.index_type, n_vectors)
+        print(f"Building FAISS index ({index_type})...")
+        # Passage indexes hold many more vectors, so store them as float16
+        self.faiss_index = create_faiss_index(dimension, n_vectors, index_type,
+                                              compact=self.chunked)
+        if not self.faiss_index.is_trained:
+            # Train on an evenly spread sample rather than reading every chunk
+            rng = np.random.default_rng(0)
+            fraction = min(1.0, 256_000 / n_vectors)
+            sample = [embeddings[np.sort(rng.choice(
+                len(embeddings), max(1, round(len(embeddings) * fraction)),
+                replace=False))]
+                for embeddings, _, _ in parts if len(embeddings)]
+            with self._stage('faiss_train'):
+                train_faiss_index(self.faiss_index, np.vstack(sample))
+            
+        all_embeddings = checkpoint.create_embeddings(
+            (n_vectors, dimension), 'float16' if self.chunked else 'float32')
+        passage_doc = np.empty(n_vectors, dtype='int64')
+        passage_spans = np.empty((n_vectors, 2), dtype='int64')
+        self.documents = []
+        offset = 0
+        for (_, paths), (embeddings, owners, spans) in zip(chunks, parts):
+            if not len(embeddings):
+                continue
+            vectors = np.ascontiguousarray(embeddings, dtype='float32')
+            with self._stage('faiss_add'):
+                self.faiss_index.add(vectors)
+            all_embeddings[offset:offset + len(vectors)] = vectors
+            passage_doc[offset:offset + len(vectors)] = owners + len(self.documents)
+            passage_spans[offset:offset + len(vectors)] = spans
+            self.documents.extend(documents_by_path[path] for path in paths)
+            offset += len(vectors)
+        all_embeddings.flush()
+        del all_embeddings
+        self.embeddings = checkpoint.read_embeddings()
+        with self._stage('lexical_merge'):
+            self.lexical_index = LexicalIndex.concatenate(
+                [checkpoint.read_lexical(chunk_id) for chunk_id, _ in chunks])
+        minhashes = [checkpoint.read_minhashes(chunk_id) for chunk_id, _ in chunks]
+        complete = minhashes and all(m is not None for m in minhashes)
+        self.minhashes = np.vstack(minhashes) if complete else None
+        with self._stage('metadata_index'):
+            self.metadata_index = MetadataIndex.build(self.documents)
+        self.build_id = uuid.uuid4().hex
+        self.vector_rows = None
+        
+        if self.chunked:
+            self.passage_doc = passage_doc
+            self.passage_spans = passage_spans
+            print(f"Index built with {len(self.documents)} documents "
+                  f"({n_vectors} passages)")
+        else:
+            self.passage_doc = self.passage_spans = None
+            print(f"Index built with {len(self.documents)} documents")
+
+    @staticmethod
+    def _document_fingerprint(doc: Dict) -> Tuple:
+        """Identify the indexed state of an attachment file."""
+        return (doc.get('key'), doc.get('size'), doc.get('mtime'),
+                doc.get('date_modified'))
+
+    @classmethod
+    def _group_fingerprint(cls, doc: Dict) -> List:
+        """Fingerprint of a document and of the identical copies grouped into it."""
+        return [*cls._document_fingerprint(doc),
+                [list(cls._document_fingerprint(alternate))
+                 for alternate in doc.get('duplicates', [])]]
+
+    @staticmethod
+    def _metadata_rank(doc: Dict) -> Tuple:
+        """Sort key preferring the copy of a paper with the most complete metadata."""
+        filled = sum(bool(doc.get(field)) for field in
+                     ('title', 'author', 'year', 'journal', 'abstract', 'doi', 'url',
+                      'tags'))
+        return (not doc.get('journal'), -filled, doc['path'])
+
+    @staticmethod
+    def _alternate(doc: Dict, similarity: float) -> Dict:
+        """A copy of ``doc`` to list under the document it duplicates."""
+        alternate = {field: value for field, value in doc.items()
+                     if field != 'duplicates'}
+        alternate['similarity'] = similarity
+        return alternate
+
+    def _group_identical(self, documents: List[Dict]) -> List[Dict]:
+        """Fold byte-identical PDFs into one document before any text is extracted.
+        
+        Only files sharing a size are hashed (through the text cache, which
+        remembers hashes, if there is one). The copy with the most complete
+        metadata is kept, with the others listed under its 'duplicates';
+        copies whose title or DOI differs from it are indexed on their own.
+        """
+        by_size = {}
+        for doc in documents:
+            by_size.setdefault(doc['size'], []).append(doc)
+        file_hash = file_sha256
+        if self.text_cache is not None:
+            file_hash = self.text_cache.file_hash
+        grouped = {}
+        with self._stage('hash_duplicates'):
+            for same_size in by_size.values():
+                if len(same_size) < 2:
+                    continue
+                by_hash = {}
+                for doc in same_size:
+                    try:
+                        by_hash.setdefault(file_hash(doc['path']), []).append(doc)
+                    except OSError:
+                        continue
+                for copies in by_hash.values():
+                    copies = sorted(copies, key=self._metadata_rank)
+                    # Copies of other papers are left for a group of their own
+                    while len(copies) > 1:
+                        kept, *others = copies
+                        identity = NearDuplicateIndex.identity(kept)
+                        same, copies = [], []
+                        for doc in others:
+                            other = NearDuplicateIndex.identity(doc)
+                            conflict = NearDuplicateIndex.conflicts(identity, other)
+                            (copies if conflict else same).append(doc)
+                        if same:
+                            grouped[kept['path']] = same
+                        
+        if not grouped:
+            return documents
+        skipped = {doc['path'] for others in grouped.values() for doc in others}
+        n_copies = len(skipped)
+        print(f"Found {n_copies} identical copies of {len(grouped)} PDFs; "
+              "indexing each once")
+        if self.profiler is not None:
+            self.profiler.count('identical_duplicates', n_copies)
+        result = []
+        for doc in documents:
+            if doc['path'] in skipped:
+                continue
+            if doc['path'] in grouped:
+                alternates = list(doc.get('duplicates', []))
+                alternates.extend(self._alternate(other, 1.0)
+                                  for other in grouped[doc['path']])
+                doc = dict(doc, duplicates=alternates)
+            result.append(doc)
+        return result
+
+    @staticmethod
+    def _drop_unindexed(documents: List[Dict],
+                        owners: np.ndarray) -> Tuple[List[Dict], np.ndarray]:
+        """Documents that got vectors, with ``owners`` renumbered to match.
+        
+        Every document gets at least one vector unless it was skipped as a
+        near-duplicate.
+        """
+        indexed = np.unique(owners)
+        if len(indexed) == len(documents):
+            return documents, owners
+        return [documents[i] for i in indexed], np.searchsorted(indexed, owners)
+
+    def _attach_duplicates(self, duplicates: List[Tuple[str, str, float]],
+                           documents_by_path: Dict[str, Dict]):
+        """List near-duplicates and their identical copies under their matches."""
+        if not duplicates:
+            return
+        if self.profiler is not None:
+            self.profiler.count('near_duplicates', len(duplicates))
+        print(f"Grouped {len(duplicates)} near-duplicate PDFs with the documents they "
+              "match")
+        indexed = {doc['path']: doc for doc in self.documents}
+        matches = {path: (canonical, similarity)
+                   for path, canonical, similarity in duplicates}
+        for path, canonical, similarity in duplicates:
+            # A resumed build can re-index a matched document as a near-duplicate
+            # itself
+            seen = {path}
+            while (canonical not in indexed and canonical in matches
+                   and canonical not in seen):
+                seen.add(canonical)
+                canonical, next_similarity = matches[canonical]
+                similarity = min(similarity, next_similarity)
+            target = indexed.get(canonical)
+            doc = documents_by_path.get(path)
+            if target is None or doc is None:
+                continue
+            alternates = target.setdefault('duplicates', [])
+            alternates.append(self._alternate(doc, similarity))
+            alternates.extend(self._alternate(alternate, similarity)
+                              for alternate in doc.get('duplicates', []))
+
+    def update_index(self, keys: Optional[List[str]] = None):
+        """Update a loaded index with only the new, changed or deleted attachments.
+        
+        ``keys`` limits the update to the attachments in those storage
+        folders (e.g. the ones Zotero reports as changed), so neither the
+        whole database nor the whole storage directory is read.
+        """
+        try:
+            with self._stage('update_index'):
+                self._update_index(keys)
+        finally:
+            self._close_encode_pool()
+
+    def _update_index(self, keys: Optional[List[str]] = None):
+        if self.faiss_index is None:
+            print("No index loaded. Building a new one...")
+            self.build_index()
+            return
+            
+        print("Finding PDF files...")
+        current = self.find_pdf_files(keys)
+        current_by_path = {doc['path']: doc for doc in current}
+        indexed_paths = set()
+        # Indexed files outside the scanned folders are left as they are
+        scanned = None
+        if keys is not None:
+            scanned = tuple(os.path.join(self.storage_dir, key) + os.sep
+                            for key in keys)
+        
+        # Positions in the saved document list (and FAISS ids) to drop. A document
+        # goes when any file grouped into it changed, and the group's other files
+        # are indexed (and grouped) again.
+        removed = []
+        removed_paths = set()
+        changed_paths = set()
+        regrouped = []
+        for i, doc in enumerate(self.documents):
+            members = [doc, *doc.get('duplicates', [])]
+            indexed_paths.update(member['path'] for member in members)
+            changed = False
+            for member in members:
+                if scanned is not None and not member['path'].startswith(scanned):
+                    continue
+                new_doc = current_by_path.get(member['path'])
+                if (new_doc is None or self._document_fingerprint(member)
+                        != self._document_fingerprint(new_doc)):
+                    changed_paths.add(member['path'])
+                    changed = True
+            if changed:
+                removed.append(i)
+                removed_paths.update(member['path'] for member in members)
+                # Files outside the scanned folders are not in ``current``
+                regrouped.extend({field: value for field, value in member.items()
+                                  if field not in ('duplicates', 'similarity')}
+                                 for member in members if scanned is not None
+                                 and not member['path'].startswith(scanned))
+        
+        added = [doc for doc in current
+                 if doc['path'] not in indexed_paths or doc['path'] in removed_paths]
+        added += regrouped
+        
+        n_new = sum(doc['path'] not in indexed_paths for doc in current)
+        n_changed = len(changed_paths & set(current_by_path))
+        print(f"Index update: {n_new} new, {n_changed} changed, "
+              f"{len(changed_paths) - n_changed} deleted")
+        
+        if not removed and not added:
+            print("Index is up to date.")
+            return
+            
+        self.documents = list(self.documents)
+        self._own_faiss_index()
+        self.build_id = uuid.uuid4().hex
+        if removed:
+            removed = np.array(removed, dtype='int64')
+            if self.passage_doc is None:
+                vector_ids = removed
+            else:
+                dropped = np.isin(self.passage_doc, removed)
+                vector_ids = np.flatnonzero(dropped)
+                # Renumber the remaining passages' documents after the removal
+                kept_doc = self.passage_doc[~dropped]
+                self.passage_doc = kept_doc - np.searchsorted(removed, kept_doc)
+                self.passage_spans = self.passage_spans[~dropped]
+                
+            with self._stage('remove_vectors'):
+                self._remove_vectors(vector_ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(removed)
+            removed_set = set(removed.tolist())
+            self.documents = [doc for i, doc in enumerate(self.documents)
+                              if i not in removed_set]
+            if self.embeddings is not None:
+                self.embeddings = np.delete(self.embeddings, vector_ids, axis=0)
+            if self.minhashes is not None:
+                self.minhashes = np.delete(self.minhashes, removed, axis=0)
+                
+        if added:
+            if self.deduplicate:
+                added = self._group_identical(added)
+            near_duplicates = self._near_duplicate_index()
+            if near_duplicates is not None and self.minhashes is not None:
+                # New files can be near-duplicates of indexed documents too
+                near_duplicates.add_many([doc['path'] for doc in self.documents],
+                                         self.minhashes,
+                                         [NearDuplicateIndex.identity(doc)
+                                          for doc in self.documents])
+            self._near_duplicates = near_duplicates
+            try:
+                embeddings, owners, spans = self._embed_documents(added,
+                                                                  self.lexical_index)
+            finally:
+                self._near_duplicates = None
+            indexed, owners = self._drop_unindexed(added, owners)
+            if len(embeddings):
+                if self.vector_rows is not None:
+                    n_rows = np.count_nonzero(self.vector_rows >= 0)
+                    self.vector_rows = np.concatenate(
+                        [self.vector_rows, np.arange(n_rows, n_rows + len(embeddings))])
+                with self._stage('faiss_add'):
+                    self.faiss_index.add(embeddings)
+            if self.passage_doc is not None:
+                self.passage_doc = np.concatenate([self.passage_doc,
+                                                   owners + len(self.documents)])
+                self.passage_spans = np.vstack([self.passage_spans, spans])
+            self._append_minhashes(indexed, near_duplicates)
+            self.documents.extend(indexed)
+            if self.embeddings is not None and len(embeddings):
+                self.embeddings = np.vstack(
+                    [self.embeddings, embeddings.astype(self.embeddings.dtype)])
+            if near_duplicates is not None:
+                self._attach_duplicates(near_duplicates.take_duplicates(),
+                                        {doc['path']: doc for doc in added})
+        if (self.vector_rows is not None
+                and np.mean(self.vector_rows < 0) > TOMBSTONE_MAX_FRACTION):
+            with self._stage('compact_vectors'):
+                self._compact_vectors()
+        self.metadata_index = MetadataIndex.build(self.documents)
+                
+        print(f"Index updated with {len(self.documents)} documents")
+
+    def _append_minhashes(self, documents: List[Dict],
+                          near_duplicates: Optional[NearDuplicateIndex]):
+        """Extend the signatures with those of newly indexed ``documents``.
+        
+        Documents indexed without detection (or before signatures were
+        kept) get empty signatures, which never match.
+        """
+        if near_duplicates is None and self.minhashes is None:
+            return
+        if self.minhashes is None:
+            self.minhashes = np.full((len(self.documents), MINHASH_PERMUTATIONS),
+                                     NearDuplicateIndex.EMPTY, dtype=np.uint32)
+        paths = [doc['path'] for doc in documents]
+        if near_duplicates is not None:
+            new = near_duplicates.signatures(paths)
+        else:
+            new = np.full((len(paths), self.minhashes.shape[1]),
+                          NearDuplicateIndex.EMPTY, dtype=np.uint32)
+        self.minhashes = np.vstack([self.minhashes, new])
+
+    def _remove_vectors(self, vector_ids: np.ndarray):
+        """Remove the vectors of rows ``vector_ids``, renumbering the rest in order."""
+        if isinstance(self.faiss_index, faiss.IndexFlatCodes):
+            # Flat indexes compact the remaining vectors in order, so dropping the
+            # same positions from the document list keeps both aligned.
+            self.faiss_index.remove_ids(vector_ids)
+            return
+            
+        # IVF ids are not renumbered on removal and HNSW cannot remove at all, so
+        # the vectors stay in the index as tombstones and ids are mapped to rows
+        vector_ids = np.sort(vector_ids)
+        rows = self.vector_rows
+        if rows is None:
+            rows = np.arange(self.faiss_index.ntotal, dtype='int64')
+        removed = (rows < 0) | np.isin(rows, vector_ids)
+        self.vector_rows = np.where(removed, -1,
+                                    rows - np.searchsorted(vector_ids, rows))
+
+    def _compact_vectors(self):
+        """Rebuild an index holding removed vectors from the live ones, in row order.
+        
+        The (still trained) index is refilled from the stored embeddings, or
+        from its own vectors, COPY_BATCH_VECTORS at a time.
+        """
+        rows = self.vector_rows
+        live = np.flatnonzero(rows >= 0)
+        ids_by_row = np.empty(len(live), dtype='int64')
+        ids_by_row[rows[live]] = live
+        index = faiss.clone_index(self.faiss_index)
+        index.reset()
+        for start in range(0, len(ids_by_row), COPY_BATCH_VECTORS):
+            if self.embeddings is not None:
+                vectors = self.embeddings[start:start + COPY_BATCH_VECTORS]
+            else:
+                vectors = self.faiss_index.reconstruct_batch(
+                    ids_by_row[start:start + COPY_BATCH_VECTORS])
+            index.add(np.ascontiguousarray(vectors, dtype='float32'))
+        self.faiss_index = index
+        self.vector_rows = None
+
+    def search(self, query: str, top_k: int = 5, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, mode: Optional[str] = None,
+               filters: Optional[Dict] = None,
+               rerank: Optional[bool] = None) -> List[Tuple[Dict, float]]:
+        """Search for relevant documents.
+        
+        ``mode`` is 'dense' (embeddings), 'lexical' (BM25 keywords, without
+        loading the model) or 'hybrid' (both, merged by reciprocal rank fusion,
+        so scores are fusion scores). It defaults to ``self.search_mode`` and
+        falls back to dense search for indexes without a keyword index.
+        ``nprobe`` (IVF indexes) and ``ef_search`` (HNSW indexes) trade speed
+        for recall for this query only.
+        
+        ``filters`` restricts results to matching documents, e.g.
+        ``{'year': '2020-2023', 'journal': 'ICLR', 'tag': ['nlp', 'vision']}``
+        (see normalize_filters). Filters are applied inside the vector and
+        keyword searches, so up to ``top_k`` matching documents are returned.
+        
+        With a ``reranker`` (and unless ``rerank`` is False) the search
+        above is a first stage: its best ``rerank_candidates`` documents are
+        scored against the query by the cross-encoder, in batches, and
+        returned by that score. Documents found by a passage of their text
+        (chunked indexes) are scored by that passage, the others by their
+        metadata. If ``rerank_budget`` runs out first, the candidates not yet
+        scored follow the reranked ones in their first-stage order, with
+        scores below the reranked ones (see apply_rerank_scores).
+        """
+        filters = normalize_filters(filters)
+        mode = self._search_mode(mode)
+        rerank = self._use_reranker(rerank)
+        if mode is None:
+            return []
+        print(f"Searching for: '{query}'")
+        return self._search_batch([query], top_k, nprobe, ef_search, mode, filters,
+                                  rerank)[0]
+
+    def search_many(self, queries: List[str], top_k: int = 5,
+                    nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None, mode: Optional[str] = None,
+                    filters: Optional[Dict] = None,
+                    rerank: Optional[bool] = None) -> List[List[Tuple[Dict, float]]]:
+        """Search for many queries at once; returns one result list per query.
+        
+        Results are the same as calling search() for each query, but queries
+        are encoded in batches and each chunk of them is looked up with a
+        single FAISS search over the query matrix. Reranking budgets apply
+        to each query separately.
+        """
+        filters = normalize_filters(filters)
+        mode = self._search_mode(mode)
+        rerank = self._use_reranker(rerank)
+        if mode is None:
+            return [[] for _ in queries]
+        print(f"Searching for {len(queries)} queries")
+        results = []
+        for start in range(0, len(queries), SEARCH_MANY_CHUNK_SIZE):
+            chunk = queries[start:start + SEARCH_MANY_CHUNK_SIZE]
+            results.extend(self._search_batch(chunk, top_k, nprobe, ef_search, mode,
+                                              filters, rerank))
+        return results
+
+    def _search_mode(self, mode: Optional[str]) -> Optional[str]:
+        """Resolve the search mode, or return None if the index cannot serve it."""
+        mode = mode or self.search_mode
+        if self.lexical_index is None:
+            mode = 'dense'
+        if mode != 'lexical' and self.faiss_index is None:
+            print("Index not built. Please run build_index() first.")
+            return None
+        return mode
+
+    def _use_reranker(self, rerank: Optional[bool]) -> bool:
+        """Resolve the rerank option: on by default when a reranker is configured."""
+        if rerank is None:
+            return self.reranker is not None
+        if rerank and self.reranker is None:
+            raise ValueError("No reranker configured")
+        return rerank
+
+    def _search_batch(self, queries: List[str], top_k: int, nprobe: Optional[int],
+                      ef_search: Optional[int], mode: str, filters: Tuple = (),
+                      rerank: bool = False) -> List[List[Tuple[Dict, float]]]:
+        """Search queries with one mode, answering repeats from the result cache."""
+        with self._stage('search', memory=False):
+            return self._search_cached(queries, top_k, nprobe, ef_search, mode, filters,
+                                       rerank)
+
+    def _search_cached(self, queries: List[str], top_k: int, nprobe: Optional[int],
+                       ef_search: Optional[int], mode: str, filters: Tuple,
+                       rerank: bool = False) -> List[List[Tuple[Dict, float]]]:
+        cache = self.query_cache
+        if cache is None or self.build_id is None:
+            ranked, _ = self._cascade_batch(queries, top_k, nprobe, ef_search, mode,
+                                            filters, rerank)
+            return [self._to_results(hits) for hits in ranked]
+            
+        options = (top_k, mode, nprobe if nprobe is not None else self.nprobe,
+                   ef_search if ef_search is not None else self.ef_search,
+                   self.passage_aggregation, filters)
+        if rerank:
+            options += (self.reranker, self.rerank_candidates)
+        lexical_index = self.lexical_index
+        if mode != 'dense' and lexical_index is not None and lexical_index.corpus_key:
+            options += (lexical_index.corpus_key,)
+        batch_hits = [cache.get_results(self.build_id, query, options)
+                      for query in queries]
+        missing = [i for i, hits in enumerate(batch_hits) if hits is None]
+        if self.profiler is not None:
+            self.profiler.count('result_cache_hits', len(queries) - len(missing))
+        if missing:
+            ranked, complete = self._cascade_batch([queries[i] for i in missing], top_k,
+                                                   nprobe,
+                                                   ef_search, mode, filters, rerank)
+            for i, hits, final in zip(missing, ranked, complete):
+                # Rankings cut short by the rerank budget are not kept
+                if final:
+                    cache.put_results(self.build_id, queries[i], options, hits)
+                batch_hits[i] = hits
+        return [self._to_results(hits) for hits in batch_hits]
+
+    def _cascade_batch(self, queries: List[str], top_k: int, nprobe: Optional[int],
+                       ef_search: Optional[int], mode: str, filters: Tuple,
+                       rerank: bool) -> Tuple[List[List[Hit]], List[bool]]:
+        """Rank queries, reranking the first-stage candidates if ``rerank``.
+        
+        Also returns, per query, whether reranking finished within its budget.
+        """
+        if not rerank:
+            ranked = self._rank_batch(queries, top_k, nprobe, ef_search, mode, filters)
+            return ranked, [True] * len(ranked)
+        candidates = self._rank_batch(queries, max(top_k, self.rerank_candidates),
+                                      nprobe, ef_search, mode, filters)
+        # Loaded before the first query's budget starts
+        self.cross_encoder
+        with self._stage('rerank', memory=False):
+            reranked = [self._rerank(query, hits, top_k)
+                        for query, hits in zip(queries, candidates)]
+        return [hits for hits, _ in reranked], [complete for _, complete in reranked]
+
+    def _rerank(self, query: str, hits: List[Hit],
+                top_k: int) -> Tuple[List[Hit], bool]:
+        """Reorder first-stage hits by cross-encoder score within the time budget.
+        
+        Returns the top ``top_k`` hits and whether every candidate was scored.
+        """
+        texts = self._rerank_texts([doc for doc, _ in self._to_results(hits)])
+        scores = self._cross_encoder_scores(query, texts)
+        complete = len(scores) == len(hits)
+        return apply_rerank_scores(hits, scores)[:top_k], complete
+
+    def _rerank_texts(self, docs: List[Dict]) -> List[str]:
+        """The text the cross-encoder reads for each document of a search's results.
+        
+        A document whose best passage lies in its PDF's text is read as that
+        passage was embedded, after the title; the others as their metadata.
+        Passage texts come from the text cache if there is one.
+        """
+        texts = [self._metadata_text(doc) for doc in docs]
+        in_text = [i for i, doc in enumerate(docs)
+                   if doc.get('passage') and doc['passage']['end']]
+        if not in_text:
+            return texts
+        pdf_texts = self._iter_pdf_texts([docs[i]['path'] for i in in_text],
+                                         report=False)
+        for i, pdf_text in zip(in_text, pdf_texts):
+            passage = docs[i]['passage']
+            body = pdf_text[passage['start']:passage['end']]
+            texts[i] = f"{docs[i].get('title', '')} {body}".strip()
+        return texts
+
+    def _cross_encoder_scores(self, query: str, texts: List[str]) -> List[float]:
+        """Cross-encoder scores of the query and the first texts the budget allows.
+        
+        Texts are scored in order in batches of RERANK_BATCH_SIZE pairs; a
+        batch that would overrun ``rerank_budget`` at the measured speed is
+        shrunk, or skipped if not even one pair fits.
+        """
+        start = time.perf_counter()
+        scores = []
+        while len(scores) < len(texts):
+            size = min(RERANK_BATCH_SIZE, len(texts) - len(scores))
+            if self.rerank_budget is not None and self._rerank_pair_seconds:
+                remaining = self.rerank_budget - (time.perf_counter() - start)
+                size = min(size, int(remaining / self._rerank_pair_seconds))
+                if size < 1:
+                    break
+            batch_start = time.perf_counter()
+            pairs = [(query, text) for text in texts[len(scores):len(scores) + size]]
+            predicted = self.cross_encoder.predict(pairs, batch_size=size,
+                                                   show_progress_bar=False)
+            scores.extend(np.asarray(predicted, dtype='float32').reshape(-1).tolist())
+            pair_seconds = (time.perf_counter() - batch_start) / size
+            # Smoothed, so one slow batch does not stop reranking for good
+            if self._rerank_pair_seconds is not None:
+                pair_seconds = 0.7 * self._rerank_pair_seconds + 0.3 * pair_seconds
+            self._rerank_pair_seconds = pair_seconds
+        if self.profiler is not None:
+            self.profiler.count('reranked_pairs', len(scores))
+            if len(scores) < len(texts):
+                self.profiler.count('rerank_budget_exceeded')
+        return scores
+
+    def _rank_batch(self, queries: List[str], top_k: int, nprobe: Optional[int],
+                    ef_search: Optional[int], mode: str,
+                    filters: Tuple = ()) -> List[List[Hit]]:
+        doc_mask = None
+        if filters:
+            with self._stage('filter_mask', memory=False):
+                doc_mask = self._filter_mask(filters)
+            if not doc_mask.any():
+                return [[] for _ in queries]
+                
+        if mode == 'lexical':
+            with self._stage('lexical_search', memory=False):
+                return [self._lexical_hits(query, top_k, doc_mask) for query in queries]
+            
+        n_candidates = top_k
+        if mode != 'dense':
+            n_candidates = top_k * HYBRID_CANDIDATES_PER_RESULT
+        dense_batch = self._dense_hits(queries, n_candidates, nprobe, ef_search,
+                                       doc_mask)
+        if mode == 'dense':
+            return dense_batch
+            
+        ranked = []
+        for query, dense in zip(queries, dense_batch):
+            with self._stage('lexical_search', memory=False):
+                lexical = self._lexical_hits(query, n_candidates, doc_mask)
+            passages = {doc_idx: passage for doc_idx, _, passage in dense}
+            fused = reciprocal_rank_fusion([[doc_idx for doc_idx, _, _ in dense],
+                                            [doc_idx for doc_idx, _, _ in lexical]])
+            ranked.append([(doc_idx, score, passages.get(doc_idx))
+                           for doc_idx, score in fused[:top_k]])
+        return ranked
+
+    def _to_results(self, hits: List[Hit]) -> List[Tuple[Dict, float]]:
+        """Turn (document index, score, best passage) hits into search results.
+        
+        Documents with a best passage are returned as copies carrying its
+        character span under 'passage'.
+        """
+        results = []
+        for doc_idx, score, passage in hits:
+            doc = self.documents[doc_idx]
+            if passage is not None:
+                doc = dict(doc, passage=passage)
+            results.append((doc, score))
+        return results
+
+    def _filter_mask(self, filters: Tuple) -> np.ndarray:
+        """Boolean mask of the documents matching normalized ``filters``."""
+        if self.metadata_index is None or \
+                len(self.metadata_index) != len(self.documents):
+            print("Indexing metadata for filtering...")
+            self.metadata_index = MetadataIndex.build(self.documents)
+        return self.metadata_index.mask(filters)
+
+    def _lexical_hits(self, query: str, top_k: int,
+                      doc_mask: Optional[np.ndarray] = None) -> List[Hit]:
+        return [(row, score, None)
+                for row, score in self.lexical_index.search(query, top_k, doc_mask)]
+
+    def _dense_hits(self, queries: List[str], top_k: int, nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None,
+                    doc_mask: Optional[np.ndarray] = None) -> List[List[Hit]]:
+        """Rank documents by embedding similarity to each query, within ``doc_mask``."""
+        with self._stage('encode_queries', memory=False):
+            query_embeddings = self._encode_queries(queries)
+        
+        # Search
+        nprobe = nprobe if nprobe is not None else self.nprobe
+        ef_search = ef_search if ef_search is not None else self.ef_search
+        vector_mask = doc_mask
+        if doc_mask is not None and self.passage_doc is not None:
+            vector_mask = doc_mask[self.passage_doc]
+        if self.passage_doc is not None:
+            n_candidates = min(self.faiss_index.ntotal,
+                               top_k * PASSAGE_CANDIDATES_PER_DOC)
+            scores, indices = self._vector_search(query_embeddings, n_candidates,
+                                                  nprobe, ef_search, vector_mask)
+            return [self._aggregate_passages(row_scores, row_indices, top_k)
+                    for row_scores, row_indices in zip(scores, indices)]
+            
+        scores, indices = self._vector_search(query_embeddings, top_k, nprobe,
+                                              ef_search, vector_mask)
+        
+        hits = []
+        for row_scores, row_indices in zip(scores, indices):
+            valid = (row_indices >= 0) & (row_indices < len(self.documents))
+            hits.append(list(zip(row_indices[valid].tolist(),
+                                 row_scores[valid].tolist(),
+                                 [None] * int(valid.sum()))))
+        return hits
+
+    def _vector_search(self, query_embeddings: np.ndarray, k: int,
+                       nprobe: Optional[int], ef_search: Optional[int],
+                       vector_mask: Optional[np.ndarray] = None
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+        """FAISS-style (scores, ids) of the ``k`` best vectors per query.
+        
+        With a ``vector_mask`` only the selected vectors are searched: a
+        bitmap ID selector restricts the FAISS search itself, so a filtered
+        query still gets ``k`` hits in one pass. Selections of at most
+        FILTER_EXACT_MAX_VECTORS vectors are scored exactly from the stored
+        embeddings instead, which is faster and exact for selective filters.
+        
+        Removed vectors still in the index (see _remove_vectors) are left out
+        by the same selector, and the ids found are mapped back to rows.
+        """
+        rows = self.vector_rows
+        if vector_mask is None and rows is None:
+            return self._faiss_search(query_embeddings, k,
+                                      faiss_search_params(self.faiss_index, nprobe,
+                                                          ef_search))
+        if vector_mask is not None:
+            n_selected = np.count_nonzero(vector_mask)
+            if self.embeddings is not None and n_selected <= FILTER_EXACT_MAX_VECTORS:
+                with self._stage('exact_search', memory=False):
+                    return self._exact_search(query_embeddings,
+                                              np.flatnonzero(vector_mask), k)
+        id_mask = vector_mask
+        if rows is not None:
+            id_mask = rows >= 0
+            if vector_mask is not None:
+                id_mask &= vector_mask[np.maximum(rows, 0)]
+        bitmap = np.packbits(id_mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(id_mask), faiss.swig_ptr(bitmap))
+        params = faiss_search_params(self.faiss_index, nprobe, ef_search, selector,
+                                     np.count_nonzero(id_mask) / len(id_mask))
+        scores, ids = self._faiss_search(query_embeddings, k, params)
+        if rows is not None:
+            ids = np.where(ids >= 0, rows[np.maximum(ids, 0)], -1)
+        return scores, ids
+
+    def _exact_search(self, query_embeddings: np.ndarray, ids: np.ndarray,
+                      k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score the stored embeddings of ``ids``; FAISS-style top-k results."""
+        scores = query_embeddings @ np.asarray(self.embeddings[ids], dtype='float32').T
+        top_scores = np.full((len(query_embeddings), k), -np.inf, dtype='float32')
+        top_ids = np.full((len(query_embeddings), k), -1, dtype='int64')
+        n_found = min(k, len(ids))
+        if n_found:
+            top = np.argpartition(-scores, n_found - 1, axis=1)[:, :n_found]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1,
+                               kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores[:, :n_found] = np.take_along_axis(scores, top, axis=1)
+            top_ids[:, :n_found] = ids[top]
+        return top_scores, top_ids
+
+    def _faiss_search(self, query_embeddings: np.ndarray, k: int,
+                      params) -> Tuple[np.ndarray, np.ndarray]:
+        """faiss_index.search(), recording the time taken when profiling."""
+        if self.profiler is None:
+            return self.faiss_index.search(query_embeddings, k, params=params)
+        start = time.perf_counter()
+        scores, indices = self.faiss_index.search(query_embeddings, k, params=params)
+        self.profiler.faiss_searched(len(query_embeddings), k,
+                                     time.perf_counter() - start)
+        return scores, indices
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalized query embeddings, encoding only queries missing from the cache."""
+        prefix = self.text_prefixes['query']
+        queries = [prefix + query for query in queries]
+        cache = self.query_cache
+        vectors = [None] * len(queries)
+        if cache is not None:
+            vectors = [cache.get_embedding(self.encoder_id, query) for query in queries]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = np.ascontiguousarray(
+                self._timed_encode('queries', [queries[i] for i in missing],
+                                   max_batch=QUERY_BATCH_SIZE),
+                dtype='float32')
+            faiss.normalize_L2(encoded)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                if cache is not None:
+                    cache.put_embedding(self.encoder_id, queries[i], vector)
+        return np.ascontiguousarray(np.vstack(vectors), dtype='float32')
+
+    def _cache_query_embeddings(self, queries: List[str], vectors: np.ndarray):
+        """Store normalized query embeddings made elsewhere by the same encoder.
+
+        Federated search encodes each query once and hands the embeddings to
+        every shard this way.
+        """
+        if self.query_cache is None:
+            return
+        prefix = self.text_prefixes['query']
+        for query, vector in zip(queries, vectors):
+            self.query_cache.put_embedding(self.encoder_id, prefix + query, vector)
+
+    def _aggregate_passages(self, scores: np.ndarray, indices: np.ndarray,
+                            top_k: int) -> List[Tuple[int, float, Dict]]:
+        """Turn ranked passage hits into ranked documents.
+        
+        A document scores as its best passage ('max') or the sum of its three
+        best passages ('sum'), and is returned with the character span of its
+        best passage.
+        """
+        hits = {}
+        for score, idx in zip(scores, indices):
+            if idx < 0:
+                continue
+            # Hits arrive best first, so the first passage per document is its best
+            hits.setdefault(int(self.passage_doc[idx]),
+                            []).append((float(score), int(idx)))
+            
+        ranked = []
+        for doc_idx, doc_hits in hits.items():
+            if self.passage_aggregation == 'sum':
+                doc_score = sum(score for score, _ in doc_hits[:3])
+            else:
+                doc_score = doc_hits[0][0]
+            ranked.append((doc_score, doc_idx, doc_hits[0]))
+        ranked.sort(key=lambda item: -item[0])
         
-        raise FileNotFoundError("Could not find Zotero directory. Please specify it manually.")
+        results = []
+        for doc_score, doc_idx, (passage_score, passage_idx) in ranked[:top_k]:
+            start, end = self.passage_spans[passage_idx]
+            passage = {'start': int(start), 'end': int(end), 'score': passage_score}
+            results.append((doc_idx, doc_score, passage))
+        return results
 
-    def extract_zotero_metadata(self) -> Dict[str, Dict]:
-        """Extract metadata from Zotero database."""
-        if not os.path.exists(self.db_path):
-            print("Warning: Zotero database not found. Proceeding without metadata.")
-            return {}
+    def open_pdf(self, pdf_path: str):
+        """Open PDF file in default browser/viewer."""
+        open_pdf(pdf_path)
+
+    def interactive_search(self, filters: Optional[Dict] = None):
+        """Interactive search interface; ``filters`` apply to every query."""
+        interactive_search(self, filters)
+
+    def save_index(self, index_path: str = "zotero_index.zrag"):
+        """Save the built index to disk as an index directory."""
+        if not self.documents:
+            print("No index to save.")
+            return
             
-        metadata = {}
+        if index_path.endswith('.json'):
+            index_path = _sidecar_path(index_path, '.zrag')
+            print(f"Saving in the directory format as {index_path}")
+            
+        with self._stage('save_index'):
+            manifest = write_index(index_path, self.documents, self.faiss_index,
+                                   self.embeddings,
+                                   self.passage_doc, self.passage_spans,
+                                   self.lexical_index,
+                                   zotero_dir=self.zotero_dir, chunked=self.chunked,
+                                   model_name=self.model_name,
+                                   embedding_dim=self.embedding_dim,
+                                   encoder_backend=self.encoder_backend,
+                                   build_id=self.build_id,
+                                   metadata_index=self.metadata_index,
+                                   text_prefixes=self.text_prefixes,
+                                   minhashes=self.minhashes,
+                                   vector_rows=self.vector_rows)
+        # Continue from the written files, so memory is shared with the page cache
+        self._open_index_directory(index_path, manifest)
+        if self._build_checkpoint is not None:
+            self._build_checkpoint.remove()
+            self._build_checkpoint = None
+        print(f"Index saved to {index_path}")
+
+    def load_index(self, index_path: str = "zotero_index.zrag", verify: bool = False):
+        """Load a previously saved index.
+        
+        Index directories are memory-mapped, so loading reads little more than
+        the manifest; ``verify`` additionally checks every file's checksum.
+        Legacy JSON indexes are read in full.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            self.open_index(index_path, verify)
+            print(f"Index loaded from {index_path}")
+            print(f"Loaded {len(self.documents)} documents")
             
-            # Query to get item metadata with attachments
-            query = """
-            SELECT 
-                items.key,
-                itemAttachments.path,
-                itemData.valueID,
-                fields.fieldName,
-                itemDataValues.value
-            FROM items
-            LEFT JOIN itemAttachments ON items.itemID = itemAttachments.parentItemID
-            LEFT JOIN itemData ON items.itemID = itemData.itemID
-            LEFT JOIN fields ON itemData.fieldID = fields.fieldID
-            LEFT JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
-            WHERE itemAttachments.path IS NOT NULL
-            AND itemAttachments.path LIKE '%.pdf'
-            """
+        except Exception as e:
+            print(f"Error loading index: {e}")
+
+    def open_index(self, index_path: str, verify: bool = False):
+        """Load an index directory or legacy JSON index, raising on failure."""
+        index_path = resolve_index_path(index_path)
+        with self._stage('load_index'):
+            if os.path.isdir(index_path):
+                self._open_index_directory(index_path,
+                                           read_manifest(index_path, verify))
+            else:
+                self._load_legacy_index(index_path)
+
+    def _open_index_directory(self, index_path: str, manifest: Dict):
+        """Map the files of an index directory described by ``manifest``."""
+        files = manifest['files']
+        self.documents = DocumentStore(os.path.join(index_path, 'documents'),
+                                       manifest['columns'])
+        self.chunked = manifest['chunked']
+        self.max_text_chars = None if self.chunked else PDF_TEXT_CHARS
+        self.build_id = manifest['build_id']
+        # Indexes written before prefixes were recorded were built without them
+        self.text_prefixes = manifest.get('text_prefixes') or {'query': '',
+                                                               'passage': ''}
+        self._use_index_encoder(manifest.get('model_name') or MODEL_NAME,
+                                manifest.get('embedding_dim'),
+                                manifest.get('dimension'))
+        
+        self.embeddings = None
+        if 'embeddings.npy' in files:
+            self.embeddings = np.load(os.path.join(index_path, 'embeddings.npy'),
+                                      mmap_mode='r')
             
-            cursor.execute(query)
-            rows = cursor.fetchall()
+        self.faiss_index = None
+        if 'index.faiss' in files:
+            self._faiss_path = os.path.join(index_path, 'index.faiss')
+        self.vector_rows = None
+        if 'vector_rows.npy' in files:
+            self.vector_rows = np.load(os.path.join(index_path, 'vector_rows.npy'))
             
-            for row in rows:
-                key, path, value_id, field_name, value = row
-                if key and path:
-                    if key not in metadata:
-                        metadata[key] = {'path': path, 'fields': {}}
-                    if field_name and value:
-                        metadata[key]['fields'][field_name] = value
+        self.passage_doc = self.passage_spans = None
+        if 'passages.npy' in files:
+            passages = np.load(os.path.join(index_path, 'passages.npy'), mmap_mode='r')
+            self.passage_doc = passages[:, 0]
+            self.passage_spans = passages[:, 1:]
             
-            conn.close()
-            print(f"Extracted metadata for {len(metadata)} items")
+        self.lexical_index = None
+        if 'lexical/params.npy' in files:
+            self.lexical_index = LexicalIndex.load(os.path.join(index_path, 'lexical'))
             
-        except Exception as e:
-            print(f"Error extracting metadata: {e}")
+        self.metadata_index = None
+        if 'metadata/years.npy' in files:
+            self.metadata_index = MetadataIndex.load(os.path.join(index_path,
+                                                                  'metadata'))
             
-        return metadata
+        self.minhashes = None
+        if 'minhash.npy' in files:
+            minhashes = np.load(os.path.join(index_path, 'minhash.npy'), mmap_mode='r')
+            # Signatures of a different length were made with other settings
+            if minhashes.shape[1] == MINHASH_PERMUTATIONS:
+                self.minhashes = minhashes
 
-    def extract_pdf_text(self, pdf_path: str) -> str:
-        """Extract text from PDF file."""
-        try:
-            with open(pdf_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
-        except Exception as e:
-            print(f"Error extracting text from {pdf_path}: {e}")
-            return ""
-
-    def find_pdf_files(self) -> List[Dict]:
-        """Find all PDF files in Zotero storage directory."""
-        pdf_files = []
-        metadata = self.extract_zotero_metadata()
-        
-        if not os.path.exists(self.storage_dir):
-            print(f"Storage directory not found: {self.storage_dir}")
-            return pdf_files
-            
-        print("Scanning for PDF files...")
-        for root, dirs, files in os.walk(self.storage_dir):
-            for file in files:
-                if file.lower().endswith('.pdf'):
-                    file_path = os.path.join(root, file)
-                    folder_name = os.path.basename(root)
-                    
-                    # Try to match with metadata
-                    doc_metadata = {}
-                    for key, meta in metadata.items():
-                        if key in root or folder_name == key:
-                            doc_metadata = meta.get('fields', {})
-                            break
-                    
-                    pdf_info = {
-                        'path': file_path,
-                        'filename': file,
-                        'folder': folder_name,
-                        'title': doc_metadata.get('title', file),
-                        'author': doc_metadata.get('firstCreator', ''),
-                        'year': doc_metadata.get('date', ''),
-                        'journal': doc_metadata.get('publicationTitle', ''),
-                        'abstract': doc_metadata.get('abstractNote', ''),
-                        'tags': doc_metadata.get('extra', ''),
-                        'url': doc_metadata.get('url', ''),
-                        'doi': doc_metadata.get('DOI', ''),
-                    }
-                    
-                    pdf_files.append(pdf_info)
+    def _load_legacy_index(self, index_path: str):
+        """Load a JSON index with .faiss and .npz sidecar files."""
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            
+        self.documents = data['documents']
+        self.chunked = data.get('chunked', False)
+        self.max_text_chars = None if self.chunked else PDF_TEXT_CHARS
+        self.embeddings = None
+        self.build_id = f"legacy-{os.stat(index_path).st_mtime_ns}"
+        self.text_prefixes = {'query': '', 'passage': ''}
         
-        print(f"Found {len(pdf_files)} PDF files")
-        return pdf_files
+        # Load FAISS index
+        faiss_path = _sidecar_path(index_path, '.faiss')
+        self.faiss_index = None
+        if os.path.exists(faiss_path):
+            self.faiss_index = faiss.read_index(faiss_path)
+        # Legacy indexes were all built with the default model
+        self._use_index_encoder(MODEL_NAME, None,
+                                self.faiss_index.d if self.faiss_index is not None
+                                else None)
+        
+        self.passage_doc = self.passage_spans = None
+        if self.chunked:
+            passages = np.load(_sidecar_path(index_path, '.passages.npz'))
+            self.passage_doc = passages['doc']
+            self.passage_spans = passages['spans']
+            
+        lexical_path = _sidecar_path(index_path, '.lexical.npz')
+        self.lexical_index = None
+        if os.path.exists(lexical_path):
+            self.lexical_index = LexicalIndex.load_npz(lexical_path)
+        self.metadata_index = None
+        self.minhashes = None
+        self.vector_rows = None
+        print("Note: this is a legacy JSON index; convert it with --convert-index "
+              "for faster loading")
 
-    def build_search_corpus(self, pdf_files: List[Dict]) -> List[str]:
-        """Build searchable text corpus from PDF metadata and content."""
-        corpus = []
+
+class AsyncZoteroRAG:
+    """asyncio front end that batches concurrent searches.
+    
+    Queries awaited at the same time are collected for up to ``max_wait``
+    seconds or ``max_batch`` queries, then answered with one search_many()
+    call on a worker thread, so concurrent callers share model forward
+    passes and FAISS searches instead of queueing behind each other. While
+    a batch runs, new queries queue up and form the next batch without
+    waiting. The wrapped ZoteroRAG must not be searched directly at the
+    same time.
+    
+    ``stats()`` reports how many queries were waiting when each one arrived
+    and the sizes of the batches that were run.
+    """
+    
+    def __init__(self, rag: 'ZoteroRAG', max_wait: float = COALESCE_MAX_WAIT,
+                 max_batch: int = COALESCE_MAX_BATCH):
+        from concurrent.futures import ThreadPoolExecutor
         
-        print("Building search corpus...")
-        for i, pdf_info in enumerate(pdf_files):
-            if i % 10 == 0:
-                print(f"Processing {i+1}/{len(pdf_files)} files...")
-                
-            # Combine metadata for searching
-            search_text_parts = [
-                pdf_info.get('title', ''),
-                pdf_info.get('author', ''),
-                pdf_info.get('journal', ''),
-                pdf_info.get('abstract', ''),
-                pdf_info.get('tags', ''),
-                pdf_info.get('filename', ''),
-            ]
-            
-            # Extract some PDF text (first few pages for performance)
+        self.rag = rag
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix='zotero-rag-search')
+        self._queue = None
+        self._dispatcher = None
+        self.queue_depths = Counter()
+        self.batch_sizes = Counter()
+
+    async def search(self, query: str, top_k: int = 5, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, mode: Optional[str] = None,
+                     filters: Optional[Dict] = None,
+                     rerank: Optional[bool] = None) -> List[Tuple[Dict, float]]:
+        """Search like ZoteroRAG.search(), batched with concurrent calls."""
+        import asyncio
+        
+        if self._dispatcher is None:
+            self._queue = asyncio.Queue()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        self.queue_depths[self._queue.qsize()] += 1
+        options = (top_k, nprobe, ef_search, mode, normalize_filters(filters), rerank)
+        self._queue.put_nowait((query, options, future))
+        return await future
+
+    async def _dispatch(self):
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                    
+            self.batch_sizes[len(batch)] += 1
+            # Queries can only share a search_many() call if their options match
+            groups = {}
+            for query, options, future in batch:
+                groups.setdefault(options, []).append((query, future))
+            for options, items in groups.items():
+                queries = [query for query, _ in items]
+                try:
+                    results = await loop.run_in_executor(self._executor,
+                                                         self._search_many,
+                                                         queries, options)
+                except Exception as e:
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    def _search_many(self, queries: List[str],
+                     options: Tuple) -> List[List[Tuple[Dict, float]]]:
+        top_k, nprobe, ef_search, mode, filters, rerank = options
+        return self.rag.search_many(queries, top_k=top_k, nprobe=nprobe,
+                                    ef_search=ef_search,
+                                    mode=mode, filters=dict(filters), rerank=rerank)
+
+    @staticmethod
+    def _histogram(counts: Counter) -> Dict[str, int]:
+        """Bucket counts by powers of two: '0', '1', '2-3', '4-7', ..."""
+        buckets = {}
+        for value, count in sorted(counts.items()):
+            low = 1 << (value.bit_length() - 1) if value else 0
+            label = str(value) if value < 2 else f"{low}-{2 * low - 1}"
+            buckets[label] = buckets.get(label, 0) + count
+        return buckets
+
+    def stats(self) -> Dict:
+        """Queue depth seen by arriving queries and batch-size histograms."""
+        n_batches = sum(self.batch_sizes.values())
+        n_queries = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            'queries': n_queries,
+            'batches': n_batches,
+            'mean_batch_size': n_queries / n_batches if n_batches else 0.0,
+            'batch_sizes': self._histogram(self.batch_sizes),
+            'queue_depths': self._histogram(self.queue_depths),
+        }
+
+    async def close(self):
+        """Stop the dispatcher and the worker thread."""
+        import asyncio
+        
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
             try:
-                pdf_text = self.extract_pdf_text(pdf_info['path'])
-                # Take first 2000 characters to avoid memory issues
-                if pdf_text:
-                    search_text_parts.append(pdf_text[:2000])
-            except:
+                await self._dispatcher
+            except asyncio.CancelledError:
                 pass
+            self._dispatcher = None
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> 'AsyncZoteroRAG':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def interactive_search(searcher, filters: Optional[Dict] = None):
+    """Interactive search over a ZoteroRAG or FederatedSearch.
+
+    ``filters`` apply to every query.
+    """
+    print("\n=== Zotero RAG Search System ===")
+    print("Enter your search query (or 'quit' to exit)")
+    print("Example: 'Proba Unlearn ICLR'")
+    print("-" * 40)
+    
+    while True:
+        query = input("\nSearch query: ").strip()
+        
+        if query.lower() in ['quit', 'exit', 'q']:
+            break
             
-            search_text = ' '.join(filter(None, search_text_parts))
-            corpus.append(search_text)
+        if not query:
+            continue
             
-        return corpus
-
-    def build_index(self):
-        """Build FAISS index for similarity search."""
-        print("Finding PDF files...")
-        self.documents = self.find_pdf_files()
+        results = searcher.search(query, top_k=5, filters=filters)
         
-        if not self.documents:
-            print("No PDF files found!")
-            return
+        if not results:
+            print("No results found.")
+            continue
             
-        print("Building search corpus...")
-        corpus = self.build_search_corpus(self.documents)
+        print(f"\nFound {len(results)} results:")
+        print("-" * 60)
         
-        print("Generating embeddings...")
-        embeddings = self.model.encode(corpus, show_progress_bar=True)
+        for i, (doc, score) in enumerate(results, 1):
+            print(f"{i}. [{score:.3f}] {doc['title']}")
+            if doc.get('library'):
+                print(f"   Library: {doc['library']}")
+            if doc['author']:
+                print(f"   Author: {doc['author']}")
+            if doc['year']:
+                print(f"   Year: {doc['year']}")
+            if doc['journal']:
+                print(f"   Journal: {doc['journal']}")
+            print(f"   File: {doc['filename']}")
+            for alternate in doc.get('duplicates', []):
+                print(f"   Also: {alternate['filename']} "
+                      f"({alternate['similarity']:.0%} similar)")
+            passage = doc.get('passage')
+            if passage and passage['end']:
+                print(f"   Best passage: characters "
+                      f"{passage['start']}-{passage['end']}")
+            print()
         
-        # Build FAISS index
-        print("Building FAISS index...")
-        dimension = embeddings.shape[1]
-        self.faiss_index = faiss.IndexFlatIP(dimension)  # Inner product (cosine similarity)
+        # Ask user which file to open
+        try:
+            choice = input("Enter number to open (or press Enter to search again): ").strip()
+            if choice and choice.isdigit():
+                idx = int(choice) - 1
+                if 0 <= idx < len(results):
+                    open_pdf(results[idx][0]['path'])
+                else:
+                    print("Invalid selection.")
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            print(f"Error: {e}")
+
+
+class FederatedSearch:
+    """Search several Zotero libraries, each indexed as an independent shard.
+    
+    Every library keeps its own ZoteroRAG and index directory, which are
+    built, updated and saved on their own. Searches query all shards in
+    parallel on a thread pool (FAISS, BM25 and the model release the GIL)
+    and merge the per-shard top-k by score. Each result is a copy of the
+    document carrying its library's name under 'library'.
+    
+    Queries are encoded once and the embeddings handed to every shard, so
+    all shards must be built with the same model. Dense similarities are
+    comparable across shards, and so are BM25 scores, as the shards' keyword
+    indexes share their term statistics (see LexicalIndex.share_statistics).
+    Hybrid searches merge the dense and the keyword rankings of all shards
+    separately and fuse the merged rankings, as fusion scores depend only on
+    ranks within a shard. Reranking runs once, on the merged candidates, so
+    one time budget covers all shards and scores are never mixed with the
+    first-stage scores of another shard.
+    """
+    
+    def __init__(self, workers: Optional[int] = None):
+        from concurrent.futures import ThreadPoolExecutor
         
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings)
-        self.faiss_index.add(embeddings.astype('float32'))
+        self.shards: Dict[str, ZoteroRAG] = {}
+        self.index_paths: Dict[str, str] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='zotero-rag-shard')
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def add_library(self, name: str, rag: 'ZoteroRAG', index_path: str):
+        """Add a library's ZoteroRAG as a shard whose index lives at ``index_path``."""
+        if name in self.shards:
+            raise ValueError(f"Library {name!r} added twice")
+        self.shards[name] = rag
+        self.index_paths[name] = resolve_index_path(index_path)
+
+    def _map(self, function, names: List[str]) -> Dict[str, object]:
+        """Call function(name) for every name on the thread pool: {name: result}."""
+        futures = {name: self._executor.submit(function, name) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _check_encoders(self, shards: Dict[str, 'ZoteroRAG']):
+        encoders = {(rag.model_name, rag.embedding_dim) for rag in shards.values()}
+        if len(encoders) > 1:
+            raise ValueError("Libraries were indexed with different models: " +
+                             ", ".join(f"{name}: {rag.model_name}" +
+                                       (f" at {rag.embedding_dim} dimensions"
+                                        if rag.embedding_dim else "")
+                                       for name, rag in shards.items()))
+
+    def load(self, verify: bool = False):
+        """Open every shard's saved index, in parallel."""
+        self._map(lambda name: self.shards[name].open_index(self.index_paths[name],
+                                                            verify),
+                  list(self.shards))
+        self._check_encoders(self.shards)
+        print(f"Loaded {len(self.shards)} libraries, "
+              f"{sum(len(rag.documents) for rag in self.shards.values())} documents")
+
+    def update(self, names: Optional[List[str]] = None):
+        """Update shards with the changes in their libraries, saving the changed ones.
         
-        self.embeddings = embeddings
-        print(f"Index built with {len(self.documents)} documents")
+        Libraries are updated one at a time, as updates are CPU-bound. Not
+        safe to run while the same FederatedSearch is being searched; use
+        reload() in the searching process instead.
+        """
+        for name in names or list(self.shards):
+            rag = self.shards[name]
+            build_id = rag.build_id
+            print(f"Updating library {name}...")
+            rag.update_index()
+            if rag.build_id != build_id:
+                rag.save_index(self.index_paths[name])
+                self.index_paths[name] = resolve_index_path(self.index_paths[name])
 
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[Dict, float]]:
-        """Search for relevant documents."""
-        if self.faiss_index is None:
-            print("Index not built. Please run build_index() first.")
-            return []
-            
-        print(f"Searching for: '{query}'")
+    def reload(self) -> List[str]:
+        """Reopen the shards whose index was rewritten; returns their names.
         
-        # Encode query
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        Only the manifests are read to tell: a shard whose build_id is
+        unchanged is skipped, so reloading costs little more than a file read
+        per unchanged library. Changed shards are opened as copies and swapped
+        in, so searches running meanwhile use the old ones. A shard that
+        cannot be opened (most likely caught mid-write) is kept as it was.
+        """
+        def reload_shard(name: str) -> Optional[ZoteroRAG]:
+            rag = self.shards[name]
+            path = self.index_paths[name]
+            try:
+                with open(os.path.join(path, 'manifest.json'), 'r',
+                          encoding='utf-8') as f:
+                    if json.load(f).get('build_id') == rag.build_id:
+                        return None
+                fresh = copy.copy(rag)
+                fresh.open_index(path)
+            except Exception as e:
+                print(f"Reloading library {name} failed: {e}")
+                return None
+            return fresh
         
-        # Search
-        scores, indices = self.faiss_index.search(query_embedding.astype('float32'), top_k)
+        reloaded = {name: rag
+                    for name, rag in self._map(reload_shard, list(self.shards)).items()
+                    if rag is not None}
+        if reloaded:
+            shards = dict(self.shards, **reloaded)
+            self._check_encoders(shards)
+            with self._lock:
+                self.shards = shards
+            self.reloads += len(reloaded)
+            print(f"Reloaded {', '.join(reloaded)}")
+        return list(reloaded)
+
+    def search(self, query: str, top_k: int = 5, **options) -> List[Tuple[Dict, float]]:
+        """Search every library; options are those of ZoteroRAG.search()."""
+        return self.search_many([query], top_k, **options)[0]
+
+    def search_many(self, queries: List[str], top_k: int = 5,
+                    mode: Optional[str] = None,
+                    rerank: Optional[bool] = None,
+                    **options) -> List[List[Tuple[Dict, float]]]:
+        """Search every library for each query and merge the results by score.
         
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.documents):
-                results.append((self.documents[idx], float(score)))
-                
-        return results
+        Each shard returns its own ``top_k``, so the merged ``top_k`` is the
+        same as one index over all libraries would return (for exact indexes
+        and dense or lexical search). Other options are those of
+        ZoteroRAG.search_many().
+        """
+        with self._lock:
+            shards = self.shards
+        if not shards:
+            return [[] for _ in queries]
+        lead = next(iter(shards.values()))
+        rerank = lead._use_reranker(rerank)
+        self._share_encoders(shards, queries, mode)
+        LexicalIndex.share_statistics(
+            [rag.lexical_index for rag in shards.values()
+             if rag.lexical_index is not None],
+            sorted([name, rag.build_id] for name, rag in shards.items()))
+        n_results = max(top_k, lead.rerank_candidates) if rerank else top_k
+        if (mode or lead.search_mode) == 'hybrid':
+            results = self._fused(shards, queries, n_results, options)
+        else:
+            results = self._merged(shards, queries, n_results, mode, options)
+        if not rerank:
+            return results
+        # Loaded before the first query's budget starts
+        lead.cross_encoder
+        with lead._stage('rerank', memory=False):
+            return [self._rerank(shards, query, hits, top_k)
+                    for query, hits in zip(queries, results)]
 
-    def open_pdf(self, pdf_path: str):
-        """Open PDF file in default browser/viewer."""
+    def _fused(self, shards: Dict[str, 'ZoteroRAG'], queries: List[str], top_k: int,
+               options: Dict) -> List[List[Tuple[Dict, float]]]:
+        """Hybrid search: fuse the dense and keyword rankings merged over all shards."""
+        n_candidates = top_k * HYBRID_CANDIDATES_PER_RESULT
+        dense = self._merged(shards, queries, n_candidates, 'dense', options)
+        keyword_shards = {name: rag for name, rag in shards.items()
+                          if rag.lexical_index is not None}
+        lexical = [[] for _ in queries]
+        if keyword_shards:
+            lexical = self._merged(keyword_shards, queries, n_candidates, 'lexical',
+                                   options)
+        fused = []
+        for dense_hits, lexical_hits in zip(dense, lexical):
+            # Dense hits last, so documents keep their best passage
+            docs = {(doc['library'], doc['path']): doc
+                    for doc, _ in lexical_hits + dense_hits}
+            keys = list(docs)
+            ids = {key: i for i, key in enumerate(keys)}
+            rankings = [[ids[(doc['library'], doc['path'])] for doc, _ in hits]
+                        for hits in (dense_hits, lexical_hits)]
+            fused.append([(docs[keys[i]], score)
+                          for i, score in reciprocal_rank_fusion(rankings)[:top_k]])
+        return fused
+
+    def _merged(self, shards: Dict[str, 'ZoteroRAG'], queries: List[str], top_k: int,
+                mode: Optional[str], options: Dict) -> List[List[Tuple[Dict, float]]]:
+        """Search the shards in parallel and merge each query's results by score."""
+        def search_shard(name):
+            return shards[name].search_many(queries, top_k, mode=mode, rerank=False,
+                                            **options)
+
+        per_shard = self._map(search_shard, list(shards))
+        merged = []
+        for i in range(len(queries)):
+            hits = [(dict(doc, library=name), score)
+                    for name, results in per_shard.items() for doc, score in results[i]]
+            merged.append(heapq.nlargest(top_k, hits, key=lambda hit: hit[1]))
+        return merged
+
+    @staticmethod
+    def _rerank(shards: Dict[str, 'ZoteroRAG'], query: str,
+                hits: List[Tuple[Dict, float]], top_k: int) -> List[Tuple[Dict, float]]:
+        """Reorder merged hits by cross-encoder score, as ZoteroRAG._rerank() does."""
+        texts = [None] * len(hits)
+        for name, rag in shards.items():
+            rows = [i for i, (doc, _) in enumerate(hits) if doc['library'] == name]
+            for i, text in zip(rows, rag._rerank_texts([hits[i][0] for i in rows])):
+                texts[i] = text
+        lead = next(iter(shards.values()))
+        scores = lead._cross_encoder_scores(query, texts)
+        return apply_rerank_scores(hits, scores)[:top_k]
+
+    @staticmethod
+    def _share_encoders(shards: Dict[str, 'ZoteroRAG'], queries: List[str],
+                        mode: Optional[str]):
+        """Load the model once for all shards, and encode the queries once."""
+        lead, *others = shards.values()
+        if any(rag._search_mode(mode) not in (None, 'lexical')
+               for rag in shards.values()):
+            embeddings = lead._encode_queries(queries)
+            for rag in others:
+                rag.model = lead.model
+                rag._cache_query_embeddings(queries, embeddings)
+
+    def close(self):
+        """Stop the thread pool and write the shards' query caches."""
+        self._executor.shutdown(wait=True)
+        for rag in self.shards.values():
+            if rag.query_cache is not None:
+                rag.query_cache.close()
+
+
+def result_to_json(doc: Dict, score: float) -> Dict:
+    """A search result as a JSON object: the document fields plus its score."""
+    return dict(doc, score=float(score))
+
+
+class SearchService:
+    """A loaded ZoteroRAG shared between server threads.
+    
+    Searches run one at a time against the current index. The index file is
+    polled for changes and a new copy is loaded in the background, then
+    swapped in, so searches never wait for a reload. The embedding model is
+    shared between the old and new copies and stays loaded.
+    """
+    
+    def __init__(self, rag: 'ZoteroRAG', index_path: str, poll_interval: float = 2.0):
+        self.rag = rag
+        self.index_path = os.path.abspath(index_path)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._stamp = self._index_stamp()
+        self._stop = threading.Event()
+        self.reloads = 0
+
+    def _index_stamp(self) -> Optional[Tuple[int, int]]:
+        """Identity of the index on disk, which changes whenever it is rewritten."""
+        path = self.index_path
+        if os.path.isdir(path):
+            path = os.path.join(path, 'manifest.json')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def warm_up(self, rag: Optional['ZoteroRAG'] = None):
+        """Load everything the first dense query would otherwise load."""
+        rag = rag or self.rag
+        if rag.search_mode != 'lexical':
+            # Both are loaded on first access
+            rag.model
+            rag.faiss_index
+        if rag.reranker is not None:
+            rag.cross_encoder
+
+    def reload_if_changed(self) -> bool:
+        """Swap in the index from disk if it was rewritten. Returns True on reload."""
+        stamp = self._index_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        rag = copy.copy(self.rag)
         try:
-            # Convert to file URL for browser
-            file_url = f"file://{os.path.abspath(pdf_path)}"
-            webbrowser.open(file_url)
-            print(f"Opened: {pdf_path}")
+            rag.open_index(self.index_path)
+            self.warm_up(rag)
         except Exception as e:
-            print(f"Error opening file: {e}")
+            # Most likely caught mid-write; the next poll tries again
+            print(f"Index reload failed: {e}")
+            return False
+        with self._lock:
+            self.rag = rag
+        self._stamp = stamp
+        self.reloads += 1
+        print(f"Reloaded index from {self.index_path} ({len(rag.documents)} documents)")
+        return True
+
+    def watch(self):
+        """Poll the index for changes until stop() is called."""
+        while not self._stop.wait(self.poll_interval):
+            self.reload_if_changed()
+
+    def stop(self):
+        self._stop.set()
 
-    def interactive_search(self):
-        """Interactive search interface."""
-        print("\n=== Zotero RAG Search System ===")
-        print("Enter your search query (or 'quit' to exit)")
-        print("Example: 'Proba Unlearn ICLR'")
-        print("-" * 40)
+    def search(self, query: str, top_k: int = 5, **options) -> List[Dict]:
+        with self._lock:
+            return [result_to_json(doc, score)
+                    for doc, score in self.rag.search(query, top_k=top_k, **options)]
+
+    def search_batch(self, queries: List[str], top_k: int = 5,
+                     **options) -> List[List[Dict]]:
+        with self._lock:
+            return [[result_to_json(doc, score) for doc, score in results]
+                    for results in self.rag.search_many(queries, top_k=top_k,
+                                                        **options)]
+
+    def status(self) -> Dict:
+        rag = self.rag
+        return {'index': self.index_path, 'build_id': rag.build_id,
+                'documents': len(rag.documents), 'reloads': self.reloads,
+                'query_cache': rag.query_cache.stats() if rag.query_cache else None}
+
+
+class LibraryWatcher:
+    """Keep a ZoteroRAG index up to date while the Zotero library changes.
+    
+    Every ``poll_interval`` seconds zotero.sqlite (and its journal) is
+    stat()ed. Only when it was written is it opened, read-only: first for
+    the item count and latest modification, and only if those moved are
+    the attachments' modification dates read and compared with the
+    previous read. Added,
+    changed and deleted attachments are collected until no new change has
+    been seen for ``debounce`` seconds (or the first is ``max_delay``
+    seconds old), then update_index() re-extracts and re-embeds just their
+    storage folders and drops their stale vectors. With ``index_path`` the
+    updated index is saved there, which a running search server picks up.
+    
+    Attachments whose file has not arrived in storage yet (e.g. still
+    syncing) are rechecked whenever their folder changes. The ZoteroRAG
+    must not be searched from another thread while the watcher runs.
+    """
+    
+    def __init__(self, rag: 'ZoteroRAG', index_path: Optional[str] = None,
+                 poll_interval: float = WATCH_POLL_INTERVAL,
+                 debounce: float = WATCH_DEBOUNCE, max_delay: float = WATCH_MAX_DELAY):
+        self.rag = rag
+        self.index_path = index_path
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._stop = threading.Event()
+        self.ticks = 0
+        self.tick_cpu_seconds = 0.0
+        self.database_reads = 0
+        self.updates = 0
+        self.attachments_updated = 0
+        # Seconds from each change being written to it being searchable
+        self.latencies = []
+        self._db_stamp = self._database_stamp()
+        self._summary = self._settled(self._read_summary())
+        # None until the database could be read; the first read is the baseline
+        self._attachments = self._read_attachments()
+        if self._attachments is None:
+            self._db_stamp = None
+        # Changed storage keys not indexed yet, when the first and the latest
+        # of them were seen, and the database write time of the first
+        self._pending = set()
+        self._first_seen = self._last_seen = None
+        self._changed_at = None
+        # Storage folder stamps of attachments still waiting for their file
+        self._awaiting_files = {}
         
-        while True:
-            query = input("\nSearch query: ").strip()
-            
-            if query.lower() in ['quit', 'exit', 'q']:
-                break
-                
-            if not query:
-                continue
-                
-            results = self.search(query, top_k=5)
-            
-            if not results:
-                print("No results found.")
-                continue
-                
-            print(f"\nFound {len(results)} results:")
-            print("-" * 60)
-            
-            for i, (doc, score) in enumerate(results, 1):
-                print(f"{i}. [{score:.3f}] {doc['title']}")
-                if doc['author']:
-                    print(f"   Author: {doc['author']}")
-                if doc['year']:
-                    print(f"   Year: {doc['year']}")
-                if doc['journal']:
-                    print(f"   Journal: {doc['journal']}")
-                print(f"   File: {doc['filename']}")
-                print()
-            
-            # Ask user which file to open
+    def _database_stamp(self) -> Tuple:
+        """Identity of the current database contents; Zotero writes change it."""
+        stamp = []
+        for path in (self.rag.db_path, self.rag.db_path + '-wal',
+                     self.rag.db_path + '-journal'):
             try:
-                choice = input("Enter number to open (or press Enter to search again): ").strip()
-                if choice and choice.isdigit():
-                    idx = int(choice) - 1
-                    if 0 <= idx < len(results):
-                        self.open_pdf(results[idx][0]['path'])
-                    else:
-                        print("Invalid selection.")
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                print(f"Error: {e}")
+                stat = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
 
-    def save_index(self, index_path: str = "zotero_index.json"):
-        """Save the built index to disk."""
-        if not self.documents:
-            print("No index to save.")
+    def _read_summary(self) -> Optional[Tuple]:
+        """Item and attachment counts and the latest modification (None if unreadable).
+        
+        Zotero also writes the database for settings, sync state and its
+        full-text index; these leave the summary unchanged.
+        """
+        if not os.path.exists(self.rag.db_path):
+            return None
+        try:
+            conn = connect_zotero_db(self.rag.db_path)
+            try:
+                return conn.execute(
+                    "SELECT (SELECT MAX(clientDateModified) FROM items), "
+                    "(SELECT COUNT(*) FROM items), "
+                    "(SELECT COUNT(*) FROM itemAttachments)").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+
+    @staticmethod
+    def _settled(summary: Optional[Tuple]) -> Optional[Tuple]:
+        """The summary, or None if a further change could share its latest timestamp.
+        
+        Modification times have whole seconds, so a change made within the
+        second of the latest one would leave the summary unchanged.
+        """
+        import calendar
+        
+        try:
+            latest = calendar.timegm(time.strptime(summary[0], '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            return None
+        return summary if latest + 1 < time.time() else None
+
+    def _read_attachments(self) -> Optional[Dict[str, Tuple[str, str]]]:
+        """Attachment modification stamps, or None if the database is unreadable now."""
+        if not os.path.exists(self.rag.db_path):
+            return {}
+        self.database_reads += 1
+        try:
+            return load_attachment_stamps(self.rag.db_path)
+        except sqlite3.Error as e:
+            print(f"Could not read the Zotero database, retrying: {e}")
+            return None
+
+    def _folder_stamp(self, key: str) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.rag.storage_dir, key)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _note_changes(self, keys, now: float, changed_at: float):
+        if not keys:
             return
-            
-        data = {
-            'documents': self.documents,
-            'zotero_dir': self.zotero_dir
-        }
+        if not self._pending:
+            self._first_seen = now
+            self._changed_at = changed_at
+        self._pending.update(keys)
+        self._last_seen = now
+
+    def poll(self) -> bool:
+        """Check for changes once and index them once settled. True if it updated."""
+        cpu_start = time.thread_time()
+        now = time.monotonic()
+        self.ticks += 1
+        stamp = self._database_stamp()
+        summary = self._read_summary() if stamp != self._db_stamp else self._summary
+        if summary is not None and summary == self._summary and \
+                self._attachments is not None:
+            self._db_stamp = stamp
+        elif stamp != self._db_stamp:
+            attachments = self._read_attachments()
+            if attachments is not None:
+                self._db_stamp = stamp
+                self._summary = self._settled(summary)
+                if self._attachments is not None:
+                    changed = {key
+                               for key in attachments.keys() | self._attachments.keys()
+                               if attachments.get(key) != self._attachments.get(key)}
+                    self._note_changes(changed, now, os.path.getmtime(self.rag.db_path))
+                self._attachments = attachments
+        folder_stamps = {key: self._folder_stamp(key) for key in self._awaiting_files}
+        arrived = {key: folder_stamp for key, folder_stamp in folder_stamps.items()
+                   if folder_stamp != self._awaiting_files[key]}
+        if arrived:
+            changed_at = max(stamp or 0 for stamp in arrived.values()) / 1e9
+            self._note_changes(arrived, now, changed_at)
+        self.tick_cpu_seconds += time.thread_time() - cpu_start
         
-        with open(index_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-            
-        # Save FAISS index
-        if self.faiss_index:
-            faiss.write_index(self.faiss_index, index_path.replace('.json', '.faiss'))
-            
-        print(f"Index saved to {index_path}")
+        if self._pending and (now - self._last_seen >= self.debounce
+                              or now - self._first_seen >= self.max_delay):
+            self.apply()
+            return True
+        return False
 
-    def load_index(self, index_path: str = "zotero_index.json"):
-        """Load a previously saved index."""
+    def apply(self):
+        """Index the pending changes now; they stay pending if the database is busy."""
+        keys = sorted(self._pending)
+        print(f"Library changed: updating {len(keys)} attachments")
         try:
-            with open(index_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            self.documents = data['documents']
+            self._update(keys)
+        except sqlite3.Error as e:
+            print(f"Could not read the Zotero database, retrying: {e}")
+            self._last_seen = time.monotonic()
+            return
+        self._pending = set()
+        self.updates += 1
+        self.attachments_updated += len(keys)
+        self.latencies.append(time.time() - self._changed_at)
+        print(f"Changes indexed {self.latencies[-1]:.1f} s after they were made")
+        
+        for key in keys:
+            if key in (self._attachments or {}) and not self._has_pdf(key):
+                self._awaiting_files[key] = self._folder_stamp(key)
+            else:
+                self._awaiting_files.pop(key, None)
+
+    def catch_up(self):
+        """Index changes made while nothing was watching, with a full update_index()."""
+        self._update(None)
+
+    def _update(self, keys: Optional[List[str]]):
+        build_id = self.rag.build_id
+        self.rag.update_index(keys)
+        if self.index_path and self.rag.build_id != build_id:
+            self.rag.save_index(self.index_path)
+
+    def _has_pdf(self, key: str) -> bool:
+        folder = os.path.join(self.rag.storage_dir, key)
+        return any(file.lower().endswith('.pdf')
+                   for _, _, files in os.walk(folder) for file in files)
+
+    def _next_wait(self) -> float:
+        """Seconds until the next poll, or until pending changes are due."""
+        if not self._pending:
+            return self.poll_interval
+        now = time.monotonic()
+        due = min(self._last_seen + self.debounce, self._first_seen + self.max_delay)
+        return max(0.0, min(self.poll_interval, due - now))
+
+    def run(self):
+        """Poll until stop() is called."""
+        print(f"Watching {self.rag.db_path} for changes (Ctrl+C to stop)")
+        while not self._stop.wait(self._next_wait()):
+            self.poll()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        """Polling cost and change-to-searchable latency so far."""
+        latencies = self.latencies
+        return {
+            'ticks': self.ticks,
+            'cpu_ms_per_tick': (self.tick_cpu_seconds / self.ticks * 1000
+                                if self.ticks else 0.0),
+            'database_reads': self.database_reads,
+            'updates': self.updates,
+            'attachments_updated': self.attachments_updated,
+            'awaiting_files': len(self._awaiting_files),
+            'mean_latency_s': sum(latencies) / len(latencies) if latencies else None,
+            'max_latency_s': max(latencies) if latencies else None,
+        }
+
+
+def _search_options(request: Dict) -> Dict:
+    """Validated ZoteroRAG.search() keyword arguments from a request body."""
+    options = {'top_k': int(request.get('top_k', 5))}
+    for name in ('nprobe', 'ef_search'):
+        if request.get(name) is not None:
+            options[name] = int(request[name])
+    for name, value in options.items():
+        # FAISS asserts on these rather than raising
+        if value < 1:
+            raise ValueError(f"{name} must be at least 1")
+    if request.get('mode') is not None:
+        if request['mode'] not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {SEARCH_MODES}")
+        options['mode'] = request['mode']
+    if request.get('rerank') is not None:
+        rerank = request['rerank']
+        if isinstance(rerank, str):
+            # GET parameters arrive as strings
+            rerank = rerank.lower() not in ('0', 'false', 'no')
+        options['rerank'] = bool(rerank)
+    # Filters come as a "filters" object or, in GET requests, as parameters
+    filters = dict(request.get('filters') or {})
+    for name in ['year', *FILTER_FIELDS]:
+        if request.get(name) is not None:
+            filters[name] = request[name]
+    if filters:
+        normalize_filters(filters)
+        options['filters'] = filters
+    return options
+
+
+def make_server(service: SearchService, host: str = SERVER_HOST,
+                port: int = SERVER_PORT):
+    """Create the HTTP server for a SearchService.
+    
+    Endpoints (JSON in and out):
+      GET  /status
+      GET  /search?q=...&top_k=5&mode=hybrid&year=2020-2023&journal=...
+      POST /search        {"query": ..., "top_k": 5, "mode": ..., "filters": {...},
+                           "rerank": false, "index": ...}
+      POST /search_batch  {"queries": [...], "top_k": 5, ...}
+    A request naming a different "index" than the served one gets 409, so
+    clients never receive results from an index they did not ask for.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+    
+    class SearchRequestHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Dict):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, path: str, request: Dict):
+            if path == '/status':
+                return self._send(200, service.status())
+            if path not in ('/search', '/search_batch'):
+                return self._send(404, {'error': f"unknown endpoint {path}"})
+            index = request.get('index')
+            if index and os.path.abspath(index) != service.index_path:
+                return self._send(409, {'error': f"serving {service.index_path}"})
+            try:
+                options = _search_options(request)
+                if path == '/search':
+                    if not request.get('query'):
+                        raise ValueError("missing query")
+                    results = service.search(request['query'], **options)
+                    return self._send(200, {'results': results})
+                queries = request.get('queries')
+                if not isinstance(queries, list):
+                    raise ValueError("queries must be a list")
+                results = service.search_batch(queries, **options)
+                return self._send(200, {'results': results})
+            except (TypeError, ValueError) as e:
+                return self._send(400, {'error': str(e)})
+            except Exception as e:
+                print(f"Search failed: {e!r}")
+                return self._send(500, {'error': f"search failed: {e}"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            request = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if 'q' in request:
+                request['query'] = request.pop('q')
+            self._handle(url.path, request)
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self._send(400, {'error': "request body must be JSON"})
+            if not isinstance(request, dict):
+                return self._send(400, {'error': "request body must be a JSON object"})
+            self._handle(urlparse(self.path).path, request)
+
+        def log_message(self, format, *args):
+            # Searches already log their queries
+            pass
+    
+    return ThreadingHTTPServer((host, port), SearchRequestHandler)
+
+
+def serve(rag: 'ZoteroRAG', index_path: str, host: str = SERVER_HOST,
+          port: int = SERVER_PORT, poll_interval: float = 2.0, watch: bool = False,
+          watch_interval: float = WATCH_POLL_INTERVAL,
+          watch_debounce: float = WATCH_DEBOUNCE):
+    """Serve searches over a loaded index until interrupted.
+    
+    With ``watch``, changes to the Zotero library are indexed into a
+    separate copy of the index and saved to ``index_path``, from where the
+    server reloads it, so searches never see a half-updated index.
+    """
+    service = SearchService(rag, index_path, poll_interval)
+    print("Warming up...")
+    service.warm_up()
+    server = make_server(service, host, port)
+    reloader = threading.Thread(target=service.watch, daemon=True)
+    reloader.start()
+    library_watcher = None
+    if watch:
+        indexer = copy.copy(service.rag)
+        indexer.open_index(index_path)
+        library_watcher = LibraryWatcher(indexer, index_path, watch_interval,
+                                         watch_debounce)
+    print(f"Serving {index_path} on http://{host}:{server.server_address[1]}")
+    try:
+        if library_watcher is None:
+            server.serve_forever()
+        else:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            library_watcher.catch_up()
+            library_watcher.run()
+    finally:
+        service.stop()
+        if library_watcher is not None:
+            library_watcher.stop()
+            server.shutdown()
+        server.server_close()
+
+
+def query_server(path: str, request: Dict, host: str = SERVER_HOST,
+                 port: int = SERVER_PORT, timeout: float = 60.0) -> Optional[Dict]:
+    """POST a request to a running search server.
+    
+    Returns the decoded response, or None if no server is listening or it
+    cannot answer the request (e.g. it serves a different index).
+    """
+    import http.client
+    
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('POST', path, json.dumps(request),
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+    finally:
+        connection.close()
+    return body if response.status == 200 else None
+
+
+def write_search_results(rag, queries_path: str, output_path: Optional[str] = None,
+                         top_k: int = 5, filters: Optional[Dict] = None):
+    """Search every non-empty line of a file and write one JSON line per query.
+    
+    Queries are searched in chunks with ``rag.search_many()`` (a ZoteroRAG
+    or FederatedSearch) and each chunk is written as soon as it is done.
+    """
+    with open(queries_path, 'r', encoding='utf-8') as f:
+        queries = [line.strip() for line in f if line.strip()]
+        
+    out = open(output_path, 'w', encoding='utf-8') if output_path else sys.stdout
+    try:
+        for start in range(0, len(queries), SEARCH_MANY_CHUNK_SIZE):
+            chunk = queries[start:start + SEARCH_MANY_CHUNK_SIZE]
+            for query, results in zip(chunk,
+                                      rag.search_many(chunk, top_k=top_k,
+                                                      filters=filters)):
+                line = {'query': query,
+                        'results': [result_to_json(doc, score)
+                                    for doc, score in results]}
+                out.write(json.dumps(line, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def search_libraries(args, rag_options: Dict, filters: Dict):
+    """The CLI with --library: open, build or update every shard, then search them."""
+    federation = FederatedSearch()
+    try:
+        for name, zotero_dir, index_path in args.library:
+            rag = ZoteroRAG(zotero_dir,
+                            text_cache_path=_sidecar_path(index_path,
+                                                          '.textcache.sqlite'),
+                            embedding_cache_path=_sidecar_path(index_path,
+                                                               '.embcache.sqlite'),
+                            query_cache_path=_sidecar_path(index_path,
+                                                           '.querycache.sqlite'),
+                            **rag_options)
+            if args.no_query_cache:
+                rag.query_cache = None
+            rag.nprobe = args.nprobe
+            rag.ef_search = args.ef_search
+            federation.add_library(name, rag, index_path)
             
-            # Load FAISS index
-            faiss_path = index_path.replace('.json', '.faiss')
-            if os.path.exists(faiss_path):
-                self.faiss_index = faiss.read_index(faiss_path)
-                
-            print(f"Index loaded from {index_path}")
-            print(f"Loaded {len(self.documents)} documents")
+        # Libraries are built one at a time; each build already uses every core
+        missing = [name for name, path in federation.index_paths.items()
+                   if args.build_index or not os.path.exists(path)]
+        for name in missing:
+            print(f"Building the index of library {name} (this may take a while)...")
+            rag, index_path = federation.shards[name], federation.index_paths[name]
+            rag.build_index(_sidecar_path(index_path, '.build'))
+            rag.save_index(index_path)
+        federation.load(verify=args.verify_index)
+        if args.update_index:
+            federation.update([name for name in federation.shards
+                               if name not in missing])
             
-        except Exception as e:
-            print(f"Error loading index: {e}")
+        if args.queries_file:
+            write_search_results(federation, args.queries_file, args.output, args.top_k,
+                                 filters)
+        elif args.query:
+            results = federation.search(args.query, top_k=args.top_k, filters=filters)
+            if results:
+                best = results[0][0]
+                print(f"Best match: {best['title']} ({best['library']})")
+                open_pdf(best['path'])
+            else:
+                print("No results found.")
+        else:
+            interactive_search(federation, filters)
+    except KeyboardInterrupt:
+        print("\nExiting...")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        federation.close()
 
 
 def main():
     parser = argparse.ArgumentParser(description="Zotero RAG Search System")
+    parser.add_argument("command", nargs="?", choices=["serve"],
+                        help="'serve' keeps the model and --load-index warm in a local "
+                             "HTTP server")
     parser.add_argument("--zotero-dir", help="Path to Zotero data directory")
     parser.add_argument("--build-index", action="store_true", help="Build search index")
-    parser.add_argument("--load-index", help="Load existing index file")
-    parser.add_argument("--save-index", help="Save index to file")
+    parser.add_argument("--update-index", action="store_true",
+                        help="Update a loaded index with new, changed or deleted "
+                             "attachments")
+    parser.add_argument("--load-index",
+                        help="Load existing index directory (or legacy .json file)")
+    parser.add_argument("--library", nargs=3, action="append",
+                        metavar=("NAME", "ZOTERO_DIR", "INDEX"),
+                        help="Search several libraries, each with its own index "
+                             "directory (built if missing); repeat for every library")
+    parser.add_argument("--save-index", help="Save index to a directory")
+    parser.add_argument("--verify-index", action="store_true",
+                        help="Check the checksums of every index file when loading")
+    parser.add_argument("--convert-index", nargs=2, metavar=("OLD_JSON", "NEW_DIR"),
+                        help="Convert a legacy JSON index to the directory format and "
+                             "exit")
     parser.add_argument("--query", help="Search query")
+    parser.add_argument("--queries-file",
+                        help="Search every line of this file and write JSON lines of "
+                             "results")
+    parser.add_argument("--output",
+                        help="File for --queries-file results (default: stdout)")
+    parser.add_argument("--top-k", type=int, default=5, help="Results per query")
     parser.add_argument("--gpu", action="store_true", help="Use GPU acceleration for embeddings")
+    parser.add_argument("--model", metavar="NAME",
+                        help="Sentence transformer to build with (default: "
+                             f"{MODEL_NAME}); a loaded index must have been built "
+                             "with it")
+    parser.add_argument("--embedding-dim", type=int,
+                        help="Truncate embeddings to this many dimensions "
+                             "(Matryoshka models)")
+    parser.add_argument("--encoder-backend", choices=ENCODER_BACKENDS, default="torch",
+                        help="Run the model in fp32 torch, int8-quantized torch (CPU) "
+                             "or ONNX Runtime")
+    parser.add_argument("--encode-workers", type=int, default=1,
+                        help="Encode documents in this many processes, splitting the "
+                             "CPU cores between them")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used for PDF text extraction")
+    parser.add_argument("--extract-timeout", type=float, default=120.0,
+                        help="Seconds before giving up on a single PDF "
+                             "(with --workers > 1)")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Index the full text of each PDF as overlapping passages")
+    parser.add_argument("--no-dedup", dest="deduplicate", action="store_false",
+                        help="Index every PDF, including identical and near-duplicate "
+                             "copies")
+    parser.add_argument("--near-duplicate-threshold", type=float,
+                        default=NEAR_DUPLICATE_THRESHOLD,
+                        help="Text similarity at which PDFs are indexed once as "
+                             "near-duplicates; 0 to group identical files only")
+    parser.add_argument("--passage-aggregation", choices=["max", "sum"], default="max",
+                        help="Score documents by their best passage or the sum of "
+                             "their top 3")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="auto",
+                        help="FAISS index type; 'auto' chooses by number of vectors")
+    parser.add_argument("--nprobe", type=int,
+                        help="Inverted lists visited per query (IVF indexes)")
+    parser.add_argument("--ef-search", type=int,
+                        help="Search depth per query (HNSW indexes)")
+    parser.add_argument("--search-mode", choices=SEARCH_MODES, default="hybrid",
+                        help="Rank by embeddings, BM25 keywords (no model load) or "
+                             "both")
+    parser.add_argument("--rerank", nargs="?", const=RERANKER_MODEL, metavar="MODEL",
+                        help=f"Rerank the best candidates with a cross-encoder "
+                             f"(default: {RERANKER_MODEL})")
+    parser.add_argument("--rerank-candidates", type=int, default=RERANK_CANDIDATES,
+                        help="First-stage candidates reranked per query")
+    parser.add_argument("--rerank-budget", type=float, default=RERANK_TIME_BUDGET,
+                        help="Seconds reranking may take per query; 0 for no limit")
+    parser.add_argument("--year",
+                        help="Only return papers from this year or range, e.g. "
+                             "2019-2023")
+    parser.add_argument("--author",
+                        help="Only return papers by an author matching these words")
+    parser.add_argument("--journal",
+                        help="Only return papers from a journal matching these words")
+    parser.add_argument("--tag", help="Only return papers with this Zotero tag")
+    parser.add_argument("--collection",
+                        help="Only return papers in this Zotero collection")
+    parser.add_argument("--checkpoint-dir",
+                        help="Build checkpoint directory used to resume an interrupted "
+                             "--build-index (default: next to --save-index)")
+    parser.add_argument("--text-cache",
+                        help="Extracted text cache file "
+                             "(default: next to the index file)")
+    parser.add_argument("--embedding-cache",
+                        help="Embedding cache file (default: next to the index file)")
+    parser.add_argument("--query-cache",
+                        help="Query embedding and result cache file "
+                             "(default: next to the index file)")
+    parser.add_argument("--no-query-cache", action="store_true",
+                        help="Do not cache query embeddings and results")
+    parser.add_argument("--prune-text-cache", action="store_true",
+                        help="Remove cached text for attachments that no longer exist "
+                             "and exit")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep the index at --load-index/--save-index up to date "
+                             "as the Zotero library changes, until interrupted (also "
+                             "with serve)")
+    parser.add_argument("--watch-interval", type=float, default=WATCH_POLL_INTERVAL,
+                        help="Seconds between checks of the Zotero database with "
+                             "--watch")
+    parser.add_argument("--watch-debounce", type=float, default=WATCH_DEBOUNCE,
+                        help="Seconds a burst of changes must settle before it is "
+                             "indexed")
+    parser.add_argument("--host", default=SERVER_HOST, help="Search server address")
+    parser.add_argument("--port", type=int, default=SERVER_PORT,
+                        help="Search server port")
+    parser.add_argument("--no-server", action="store_true",
+                        help="Answer --query in this process even if a search server "
+                             "is running")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Write a JSON report of stage timings, the slowest PDFs, "
+                             "encoding throughput and memory to PATH on exit")
     
     args = parser.parse_args()
+    filters = {name: getattr(args, name) for name in ['year', *FILTER_FIELDS]
+               if getattr(args, name)}
+    try:
+        normalize_filters(filters)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.watch and not (args.load_index or args.save_index):
+        parser.error("--watch needs an index path: use --load-index or --save-index")
+    if args.library and (args.command or args.watch or args.zotero_dir
+                         or args.load_index or args.save_index or args.checkpoint_dir
+                         or args.text_cache or args.embedding_cache or args.query_cache
+                         or args.profile):
+        parser.error("--library sets each library's directory, index and caches, and "
+                     "does not work with serve, --watch, --profile or the "
+                     "single-library path options")
     
+    # Saving to a legacy .json path writes a .zrag directory next to it; follow
+    # it, and convert a legacy index that this run saves back to up front, so
+    # the index the server polls and the watcher saves are the same directory
+    if args.save_index and args.save_index.endswith('.json'):
+        args.save_index = _sidecar_path(args.save_index, '.zrag')
+    if args.load_index:
+        args.load_index = resolve_index_path(args.load_index)
+        if args.load_index.endswith('.json') and not args.save_index and (
+                args.update_index or args.watch):
+            directory = _sidecar_path(args.load_index, '.zrag')
+            convert_legacy_index(args.load_index, directory)
+            print(f"Converted {args.load_index} to the directory format as {directory}")
+            args.load_index = directory
+    
+    if args.convert_index:
+        old_path, new_path = args.convert_index
+        manifest = convert_legacy_index(old_path, new_path)
+        print(f"Converted {manifest['n_documents']} documents to {new_path}")
+        return
+    
+    # A plain query on --load-index is sent to a running server that has that index
+    # loaded already; a server serving another index refuses it, and the query is
+    # answered here. The server reranks with its own cross-encoder settings, so
+    # --rerank queries are answered here too
+    one_shot = not (args.command or args.build_index or args.update_index
+                    or args.save_index or args.prune_text_cache or args.profile
+                    or args.watch or args.rerank)
+    if (args.query and args.load_index and one_shot and not args.no_server
+            and not args.library):
+        request = {'query': args.query, 'mode': args.search_mode, 'top_k': args.top_k,
+                   'nprobe': args.nprobe, 'ef_search': args.ef_search,
+                   'filters': filters, 'rerank': False,
+                   'index': os.path.abspath(args.load_index)}
+        response = query_server('/search', request, args.host, args.port)
+        if response is not None:
+            if response['results']:
+                print(f"Best match: {response['results'][0]['title']}")
+                open_pdf(response['results'][0]['path'])
+            else:
+                print("No results found.")
+            return
+    
+    text_cache_path = args.text_cache
+    embedding_cache_path = args.embedding_cache
+    query_cache_path = args.query_cache
+    index_path = args.save_index or args.load_index
+    if index_path:
+        text_cache_path = (text_cache_path
+                           or _sidecar_path(index_path, '.textcache.sqlite'))
+        embedding_cache_path = (embedding_cache_path
+                                or _sidecar_path(index_path, '.embcache.sqlite'))
+        query_cache_path = (query_cache_path
+                            or _sidecar_path(index_path, '.querycache.sqlite'))
+    
+    rag_options = dict(use_gpu=args.gpu, workers=args.workers,
+                       extract_timeout=args.extract_timeout,
+                       chunked=args.chunked,
+                       passage_aggregation=args.passage_aggregation,
+                       index_type=args.index_type, search_mode=args.search_mode,
+                       model_name=args.model, embedding_dim=args.embedding_dim,
+                       encoder_backend=args.encoder_backend,
+                       encode_workers=args.encode_workers,
+                       reranker=args.rerank, rerank_candidates=args.rerank_candidates,
+                       rerank_budget=args.rerank_budget or None,
+                       deduplicate=args.deduplicate,
+                       near_duplicate_threshold=args.near_duplicate_threshold or None)
+    if args.library:
+        search_libraries(args, rag_options, filters)
+        return
+    
+    rag = None
     try:
         # Initialize system
-        rag = ZoteroRAG(args.zotero_dir, args.gpu)
+        rag = ZoteroRAG(args.zotero_dir, text_cache_path=text_cache_path,
+                        embedding_cache_path=embedding_cache_path,
+                        query_cache_path=query_cache_path, **rag_options)
+        if args.no_query_cache:
+            rag.query_cache = None
+        if args.profile:
+            rag.profiler = Profiler()
+        rag.nprobe = args.nprobe
+        rag.ef_search = args.ef_search
         
+        if args.prune_text_cache:
+            if rag.text_cache is None:
+                print("No text cache configured. Use --text-cache or --load-index.")
+            else:
+                print(f"Pruned {rag.text_cache.prune()} missing files from the text "
+                      "cache")
+            return
+        
+        if args.command == 'serve':
+            if not (args.load_index and os.path.exists(args.load_index)):
+                print("serve needs an existing index: use --load-index PATH")
+                return
+            rag.open_index(args.load_index, verify=args.verify_index)
+            serve(rag, args.load_index, args.host, args.port, watch=args.watch,
+                  watch_interval=args.watch_interval,
+                  watch_debounce=args.watch_debounce)
+            return
+        
+        # Read the library state before indexing it, so changes made meanwhile are
+        # caught
+        watcher = None
+        if args.watch:
+            watcher = LibraryWatcher(rag, args.save_index or args.load_index,
+                                     args.watch_interval, args.watch_debounce)
+            
         # Load or build index
         if args.load_index and os.path.exists(args.load_index):
-            rag.load_index(args.load_index)
+            rag.load_index(args.load_index, verify=args.verify_index)
+            if args.update_index or args.watch:
+                rag.update_index()
+                if not args.save_index:
+                    rag.save_index(args.load_index)
         else:
             print("Building index (this may take a while)...")
-            rag.build_index()
+            checkpoint_dir = args.checkpoint_dir
+            if not checkpoint_dir and args.save_index:
+                checkpoint_dir = _sidecar_path(args.save_index, '.build')
+            rag.build_index(checkpoint_dir)
+            if watcher is not None and not args.save_index:
+                rag.save_index(args.load_index)
             
         # Save index if requested
         if args.save_index:
             rag.save_index(args.save_index)
             
+        if watcher is not None:
+            watcher.run()
+            return
+            
         # Handle query or start interactive mode
-        if args.query:
-            results = rag.search(args.query)
+        if args.queries_file:
+            write_search_results(rag, args.queries_file, args.output, args.top_k,
+                                 filters)
+        elif args.query:
+            results = rag.search(args.query, top_k=args.top_k, filters=filters)
             if results:
                 print(f"Best match: {results[0][0]['title']}")
                 rag.open_pdf(results[0][0]['path'])
             else:
                 print("No results found.")
         else:
-            rag.interactive_search()
+            rag.interactive_search(filters)
             
     except KeyboardInterrupt:
         print("\nExiting...")
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        if rag is not None and rag.query_cache is not None:
+            rag.query_cache.close()
+        if rag is not None and rag.profiler is not None:
+            rag.profiler.write(args.profile)
+            print(f"Profile written to {args.profile}")
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
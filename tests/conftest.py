@@ -0,0 +1,21 @@
+"""
+Shared fixtures. The repository root is put on sys.path, so tests import
+fast_pdf_opener, the benchmark helpers and tests.helpers from it.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import create_library  # noqa: E402
+
+
+@pytest.fixture
+def library(tmp_path):
+    """A synthetic library of 40 one-page papers, as (zotero_dir, attachment keys)."""
+    zotero_dir = str(tmp_path / "zotero")
+    keys = create_library(zotero_dir, 40, page_range=(1, 1))
+    return zotero_dir, keys
@@ -0,0 +1,31 @@
+"""
+ZoteroRAG instances that embed with HashingEncoder, so no model is
+downloaded or loaded, and helpers for comparing search results.
+"""
+
+import contextlib
+import io
+
+from benchmarks.encoders import HashingEncoder
+from fast_pdf_opener import ZoteroRAG
+
+DIMENSION = 64
+
+
+def make_rag(zotero_dir: str, **options) -> ZoteroRAG:
+    """A ZoteroRAG over ``zotero_dir`` with a hashing encoder and no query cache."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = ZoteroRAG(zotero_dir, **options)
+    rag.query_cache = None
+    rag.model = HashingEncoder(DIMENSION)
+    return rag
+
+
+def quietly(function, *args, **kwargs):
+    """Call function with its progress output suppressed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def paths(results):
+    return [doc['path'] for doc, _ in results]
@@ -0,0 +1,74 @@
+"""
+AsyncZoteroRAG: coalescing concurrent searches into search_many() calls.
+"""
+
+import asyncio
+
+import pytest
+
+from fast_pdf_opener import AsyncZoteroRAG
+
+from tests.helpers import make_rag, quietly
+
+
+@pytest.fixture
+def rag(library):
+    """A built flat index whose search_many() calls are recorded in ``rag.calls``."""
+    zotero_dir, _ = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    search_many = rag.search_many
+    rag.calls = []
+
+    def recording(queries, **options):
+        rag.calls.append((list(queries), options['mode']))
+        return quietly(search_many, queries, **options)
+
+    rag.search_many = recording
+    return rag
+
+
+def test_concurrent_searches_share_a_batch(rag):
+    queries = [f"synthetic paper {i}" for i in range(10)]
+
+    async def run():
+        async with AsyncZoteroRAG(rag, max_wait=0.05) as async_rag:
+            searches = [async_rag.search(query, top_k=3) for query in queries]
+            searches += [async_rag.search(query, top_k=3, mode='lexical')
+                         for query in queries[:2]]
+            return await asyncio.gather(*searches), async_rag.stats()
+
+    results, stats = asyncio.run(run())
+    # Queries with different options go to separate search_many() calls
+    assert rag.calls == [(queries, None), (queries[:2], 'lexical')]
+    assert stats['batches'] == 1 and stats['queries'] == 12
+    for query, found in zip(queries, results):
+        assert found == quietly(rag.search, query, top_k=3)
+    for query, found in zip(queries[:2], results[10:]):
+        assert found == quietly(rag.search, query, top_k=3, mode='lexical')
+
+
+def test_batches_are_capped(rag):
+    queries = [f"synthetic paper {i}" for i in range(10)]
+
+    async def run():
+        async with AsyncZoteroRAG(rag, max_wait=0.05, max_batch=4) as async_rag:
+            await asyncio.gather(*[async_rag.search(query) for query in queries])
+            return async_rag.stats()
+
+    stats = asyncio.run(run())
+    assert [len(batch) for batch, _ in rag.calls] == [4, 4, 2]
+    assert stats['batch_sizes'] == {'2-3': 1, '4-7': 2}
+
+
+def test_errors_reach_only_their_callers(rag):
+    async def run():
+        async with AsyncZoteroRAG(rag, max_wait=0.05) as async_rag:
+            return await asyncio.gather(async_rag.search("paper", rerank=True),
+                                        async_rag.search("paper"),
+                                        return_exceptions=True)
+
+    failed, found = asyncio.run(run())
+    # No reranker is configured
+    assert isinstance(failed, ValueError)
+    assert found == quietly(rag.search, "paper")
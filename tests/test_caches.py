@@ -0,0 +1,207 @@
+"""
+The extracted text cache, the embedding cache and the query cache.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+import fast_pdf_opener
+from benchmarks.encoders import HashingEncoder
+from benchmarks.pdfgen import build_pdf
+from benchmarks.synthetic import add_paper, delete_paper
+from fast_pdf_opener import EmbeddingCache, QueryCache, TextCache
+
+from tests.helpers import DIMENSION, make_rag, quietly
+
+
+class CountingEncoder(HashingEncoder):
+    """HashingEncoder that counts the texts it encodes."""
+
+    def __init__(self, dimension: int = DIMENSION):
+        super().__init__(dimension)
+        self.texts = 0
+
+    def encode(self, sentences, **kwargs):
+        self.texts += len(sentences)
+        return super().encode(sentences, **kwargs)
+
+
+def write_pdf(path: str, line: str) -> str:
+    with open(path, 'wb') as f:
+        f.write(build_pdf([[line]]))
+    return path
+
+
+def test_text_cache(tmp_path):
+    cache = TextCache(str(tmp_path / "text.sqlite"))
+    pdf = write_pdf(str(tmp_path / "a.pdf"), "first version")
+    assert cache.get(pdf, "v1") is None
+    cache.put(pdf, "v1", "first version")
+    assert cache.get(pdf, "v1") == "first version"
+    # Entries are per extraction settings
+    assert cache.get(pdf, "v2") is None
+
+    # A copy with the same content hits; a rewritten file misses
+    copy = str(tmp_path / "copy.pdf")
+    shutil.copy(pdf, copy)
+    assert cache.get(copy, "v1") == "first version"
+    write_pdf(pdf, "second version")
+    os.utime(pdf, (1, 1))
+    assert cache.get(pdf, "v1") is None
+
+    # Pruning drops missing files, and texts no remaining file refers to
+    os.remove(copy)
+    cache.put(pdf, "v1", "second version")
+    cache.flush()
+    assert cache.prune() == 1
+    assert cache.get(pdf, "v1") == "second version"
+    os.remove(pdf)
+    assert cache.prune() == 1
+    assert cache.conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0] == 0
+    cache.close()
+
+
+def test_text_cache_eviction(tmp_path):
+    cache = TextCache(str(tmp_path / "text.sqlite"), max_bytes=250)
+    for i in range(5):
+        pdf = write_pdf(str(tmp_path / f"{i}.pdf"), f"paper {i}")
+        cache.put(pdf, "v1", str(i) * 100)
+    cache.flush()
+    # Least recently used texts go first, down to 90% of the limit
+    assert [cache.get(str(tmp_path / f"{i}.pdf"), "v1") is not None
+            for i in range(5)] == [False, False, False, True, True]
+    cache.close()
+
+
+def test_build_extracts_only_cache_misses(library, tmp_path, monkeypatch):
+    zotero_dir, keys = library
+    text_cache_path = str(tmp_path / "text.sqlite")
+    reference = make_rag(zotero_dir, index_type='flat')
+    quietly(reference.build_index)
+    rag = make_rag(zotero_dir, index_type='flat', text_cache_path=text_cache_path)
+    quietly(rag.build_index)
+
+    extracted = []
+    iter_extracted_texts = fast_pdf_opener.iter_extracted_texts
+
+    def recording(pdf_paths, **options):
+        extracted.extend(pdf_paths)
+        return iter_extracted_texts(pdf_paths, **options)
+
+    monkeypatch.setattr(fast_pdf_opener, 'iter_extracted_texts', recording)
+    rag = make_rag(zotero_dir, index_type='flat', text_cache_path=text_cache_path)
+    quietly(rag.build_index)
+    assert extracted == []
+    assert [doc['path'] for doc in rag.documents] == [
+        doc['path'] for doc in reference.documents]
+    assert (rag.embeddings == reference.embeddings).all()
+
+    # Changing the text budget invalidates every entry
+    rag = make_rag(zotero_dir, index_type='flat', text_cache_path=text_cache_path)
+    rag.max_text_chars = 500
+    quietly(rag.build_index)
+    assert len(extracted) == len(keys)
+
+
+def test_embedding_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    vectors = np.arange(6, dtype='float32').reshape(2, 3)
+    cache.put_many("model-a", ["one", "two"], vectors)
+    found = cache.get_many("model-a", ["two", "three", "one"])
+    assert np.array_equal(found[0], vectors[1])
+    assert found[1] is None
+    assert np.array_equal(found[2], vectors[0])
+    assert cache.get_many("model-b", ["one"]) == [None]
+
+    # Pruning drops the given model's vectors not used since, and no others
+    cache.put_many("model-b", ["one"], vectors[:1])
+    cache.conn.execute("UPDATE embeddings SET last_used = 0")
+    cache.get_many("model-a", ["one"])
+    assert cache.prune("model-a", 1) == 1
+    assert cache.get_many("model-a", ["one", "two"])[1] is None
+    assert cache.get_many("model-b", ["one"])[0] is not None
+    cache.close()
+
+
+def embedding_rows(rag) -> int:
+    return rag.embedding_cache.conn.execute(
+        "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_build_reuses_cached_embeddings(library, tmp_path):
+    zotero_dir, keys = library
+    embedding_cache_path = str(tmp_path / "embeddings.sqlite")
+    rag = make_rag(zotero_dir, index_type='flat',
+                   embedding_cache_path=embedding_cache_path)
+    quietly(rag.build_index)
+    assert embedding_rows(rag) == len(keys)
+
+    rebuilt = make_rag(zotero_dir, index_type='flat',
+                       embedding_cache_path=embedding_cache_path)
+    rebuilt.model = CountingEncoder()
+    quietly(rebuilt.build_index)
+    assert rebuilt.model.texts == 0
+    assert np.allclose(rebuilt.embeddings, rag.embeddings)
+
+    # A full build prunes the vectors of papers that are gone
+    for key in keys[:3]:
+        delete_paper(zotero_dir, key)
+    rebuilt.model = CountingEncoder()
+    quietly(rebuilt.build_index)
+    assert rebuilt.model.texts == 0
+    assert embedding_rows(rebuilt) == len(keys) - 3
+
+
+def test_query_cache(tmp_path):
+    db_path = str(tmp_path / "queries.sqlite")
+    cache = QueryCache(max_embeddings=2, max_results=2, db_path=db_path)
+    for i, query in enumerate(["one", "two", "three"]):
+        cache.put_embedding("model", query, np.full(3, i, dtype='float32'))
+    # Least recently used first out; queries match up to whitespace
+    assert cache.get_embedding("model", "one") is None
+    assert cache.get_embedding("model", " two ") is not None
+    assert cache.get_embedding("other model", "two") is None
+
+    assert cache.get_results("build-1", "query", (5, 'dense')) is None
+    cache.put_results("build-1", "query", (5, 'dense'), [[0, 1.0, None]])
+    assert cache.get_results("build-1", "query", (5, 'dense')) == [[0, 1.0, None]]
+    assert cache.get_results("build-1", "query", (6, 'dense')) is None
+    # Results of another index version are dropped
+    assert cache.get_results("build-2", "query", (5, 'dense')) is None
+    cache.put_results("build-1", "query", (5, 'dense'), [[0, 1.0, None]])
+    assert cache.get_results("build-2", "query", (5, 'dense')) is None
+    cache.put_results("build-2", "query", (5, 'dense'), [[1, 0.5, None]])
+    cache.close()
+
+    # close() persists both caches
+    loaded = QueryCache(db_path=db_path)
+    assert np.array_equal(loaded.get_embedding("model", "three"), np.full(3, 2))
+    assert loaded.get_results("build-2", "query", (5, 'dense')) == [(1, 0.5, None)]
+    assert loaded.stats()['embeddings'] == 2
+
+
+def test_search_answers_repeated_queries_from_cache(library):
+    zotero_dir, _ = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    rag.query_cache = QueryCache()
+    expected = quietly(rag.search, "synthetic paper 4", top_k=5)
+
+    rag.model = CountingEncoder()
+    assert quietly(rag.search, "synthetic  paper 4", top_k=5) == expected
+    # Other options miss the result cache, but reuse the query embedding
+    quietly(rag.search, "synthetic paper 4", top_k=3)
+    assert rag.model.texts == 0
+    stats = rag.query_cache.stats()
+    assert (stats['result_hits'], stats['result_misses']) == (1, 2)
+
+    # An update invalidates the results but not the query embedding
+    pdf = build_pdf([["synthetic paper 4 synthetic paper 4"]])
+    add_paper(zotero_dir, "Synthetic paper 4 revisited", pdf, seed=1)
+    quietly(rag.update_index)
+    rag.model = CountingEncoder()
+    (best, _), *_ = quietly(rag.search, "synthetic paper 4", top_k=5)
+    assert best['title'] == "Synthetic paper 4 revisited"
+    assert rag.model.texts == 0
@@ -0,0 +1,29 @@
+"""
+EncodePool: encoding in worker processes, with a small generated transformer.
+"""
+
+import numpy as np
+import pytest
+
+from benchmarks.encoders import create_tiny_transformer
+from fast_pdf_opener import EncodePool, encode_texts, load_encoder
+
+pytest.importorskip("transformers")
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    return create_tiny_transformer(str(tmp_path_factory.mktemp("tiny")),
+                                   hidden_size=64, layers=1)
+
+
+def test_encode_pool_matches_one_process(model_path):
+    texts = [f"synthetic paper on topic {i} " * (1 + i % 5) for i in range(11)]
+    expected = encode_texts(load_encoder(model_path), texts)
+    pool = EncodePool(model_path, workers=2, threads=1)
+    try:
+        # Texts are dealt out by length; the rows come back in input order
+        assert np.allclose(pool.encode(texts), expected, atol=1e-5)
+        assert pool.encode(texts[:1]).shape == (1, expected.shape[1])
+    finally:
+        pool.close()
@@ -0,0 +1,66 @@
+"""
+FederatedSearch: merging the results of one index per library.
+"""
+
+import copy
+import uuid
+
+import faiss
+import numpy as np
+import pytest
+
+from benchmarks import bench_federated
+from benchmarks.bench_index_io import synthetic_documents
+from fast_pdf_opener import FederatedSearch
+
+from tests.helpers import DIMENSION, quietly
+
+
+@pytest.fixture
+def libraries(tmp_path):
+    """One index over 90 documents, and a FederatedSearch over three thirds of them."""
+    documents = list(synthetic_documents(90))
+    embeddings = np.random.default_rng(0).standard_normal(
+        (len(documents), DIMENSION)).astype('float32')
+    faiss.normalize_L2(embeddings)
+    single = bench_federated.make_rag(str(tmp_path), documents, embeddings)
+    federation = FederatedSearch(workers=3)
+    for i, start in enumerate(range(0, len(documents), 30)):
+        rag = bench_federated.make_rag(str(tmp_path), documents[start:start + 30],
+                                       embeddings[start:start + 30])
+        index_path = str(tmp_path / f"library{i}.zrag")
+        quietly(rag.save_index, index_path)
+        federation.add_library(f"library{i}", rag, index_path)
+    yield single, federation
+    federation.close()
+
+
+@pytest.mark.parametrize('mode', ['dense', 'lexical', 'hybrid', 'rerank'])
+def test_merged_results_match_one_index(libraries, mode):
+    single, federation = libraries
+    options = (dict(mode='hybrid', rerank=True) if mode == 'rerank'
+               else dict(mode=mode, rerank=False))
+    queries = [f"Synthetic paper {i} Author {i % 997}" for i in (3, 31, 62, 89)]
+    expected = quietly(single.search_many, queries, 7, **options)
+    merged = quietly(federation.search_many, queries, 7, **options)
+    for want, found in zip(expected, merged):
+        assert [doc['path'] for doc, _ in found] == [doc['path'] for doc, _ in want]
+        assert [score for _, score in found] == pytest.approx(
+            [score for _, score in want], rel=1e-5)
+        for doc, _ in found:
+            number = int(doc['filename'][len("paper_"):-len(".pdf")])
+            assert doc['library'] == f"library{number // 30}"
+
+
+def test_reload_reopens_rewritten_libraries(libraries):
+    _, federation = libraries
+    quietly(federation.load)
+    assert quietly(federation.reload) == []
+    writer = copy.copy(federation.shards['library1'])
+    writer.build_id = uuid.uuid4().hex
+    quietly(writer.save_index, federation.index_paths['library1'])
+    assert quietly(federation.reload) == ['library1']
+    assert federation.shards['library1'].build_id == writer.build_id
+
+    with pytest.raises(ValueError):
+        federation.add_library('library0', writer, federation.index_paths['library0'])
@@ -0,0 +1,230 @@
+"""
+Building, updating, saving and converting indexes.
+"""
+
+import json
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+import fast_pdf_opener
+from benchmarks.pdfgen import build_pdf
+from benchmarks.synthetic import add_paper, delete_paper, rename_paper, topic_words
+from fast_pdf_opener import DocumentStore, convert_legacy_index, resolve_index_path
+
+from tests.helpers import make_rag, paths, quietly
+
+INDEX_TYPES = ['flat', 'hnsw', 'ivf-flat', 'ivf-pq']
+
+
+def ranking(rag, query, top_k=10, **options):
+    """(path, score) pairs of a search, with scores rounded for comparison."""
+    return [(doc['path'], round(score, 4))
+            for doc, score in quietly(rag.search, query, top_k=top_k, **options)]
+
+
+def search_all(rag, query):
+    """Every document a dense search can reach, searching IVF/HNSW exhaustively."""
+    return paths(quietly(rag.search, query, top_k=len(rag.documents) + 10, mode='dense',
+                         nprobe=1000, ef_search=1000))
+
+
+def test_update_matches_fresh_build(library):
+    zotero_dir, keys = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    pdf = build_pdf([["zebrafish fin regrowth"]])
+    add_paper(zotero_dir, "Zebrafish regeneration", pdf, seed=1)
+    rename_paper(zotero_dir, keys[1], "Axolotl limb study")
+    delete_paper(zotero_dir, keys[2])
+    quietly(rag.update_index)
+
+    fresh = make_rag(zotero_dir, index_type='flat')
+    quietly(fresh.build_index)
+    assert sorted(doc['path'] for doc in rag.documents) == sorted(
+        doc['path'] for doc in fresh.documents)
+    # Rank every document, so ties at the cut-off cannot differ
+    for query in ["zebrafish fin", "axolotl limb", " ".join(topic_words(5))]:
+        for mode in ('dense', 'lexical'):
+            assert sorted(ranking(rag, query, top_k=100, mode=mode)) == sorted(
+                ranking(fresh, query, top_k=100, mode=mode))
+    best, _ = quietly(rag.search, "axolotl limb", top_k=1, mode='lexical')[0]
+    assert best['title'] == "Axolotl limb study"
+    assert not any(keys[2] in path for path in search_all(rag, "synthetic paper"))
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+@pytest.mark.parametrize('index_type', INDEX_TYPES)
+def test_remove_vectors(library, tmp_path, index_type, chunked):
+    zotero_dir, keys = library
+    options = dict(index_type=index_type, chunked=chunked, search_mode='dense')
+    rag = make_rag(zotero_dir, **options)
+    quietly(rag.build_index)
+    n_vectors = rag.faiss_index.ntotal
+    vectors_per_doc = n_vectors // len(keys)
+    for key in keys[:4]:
+        delete_paper(zotero_dir, key)
+    quietly(rag.update_index)
+
+    assert len(rag.documents) == len(keys) - 4
+    if index_type == 'flat':
+        assert rag.vector_rows is None
+        assert rag.faiss_index.ntotal == n_vectors - 4 * vectors_per_doc
+    else:
+        # Removed vectors stay in the index as tombstones
+        assert rag.faiss_index.ntotal == n_vectors
+        assert int((rag.vector_rows < 0).sum()) == 4 * vectors_per_doc
+    found = search_all(rag, "synthetic paper method results")
+    assert not any(key in path for key in keys[:4] for path in found)
+    assert len(found) == len(rag.documents)
+
+    # Tombstones survive a save and load
+    index_path = str(tmp_path / "index.zrag")
+    quietly(rag.save_index, index_path)
+    loaded = make_rag(zotero_dir, **options)
+    quietly(loaded.load_index, index_path)
+    loaded.model = rag.model
+    assert search_all(loaded, "synthetic paper method results") == found
+
+    # Past TOMBSTONE_MAX_FRACTION the index is compacted
+    for key in keys[4:12]:
+        delete_paper(zotero_dir, key)
+    quietly(loaded.update_index)
+    assert loaded.vector_rows is None
+    assert loaded.faiss_index.ntotal == (len(keys) - 12) * vectors_per_doc
+    found = search_all(loaded, "synthetic paper method results")
+    assert sorted(found) == sorted(doc['path'] for doc in loaded.documents)
+
+
+def test_checkpoint_resume(library, tmp_path, monkeypatch):
+    zotero_dir, _ = library
+    monkeypatch.setattr(fast_pdf_opener, 'BUILD_CHUNK_DOCUMENTS', 10)
+    checkpoint_dir = str(tmp_path / "index.build")
+    reference = make_rag(zotero_dir, index_type='flat')
+    quietly(reference.build_index)
+
+    rag = make_rag(zotero_dir, index_type='flat')
+    embed = rag._embed_documents
+    calls = []
+
+    def interrupted(documents, lexical_index=None):
+        calls.append(len(documents))
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return embed(documents, lexical_index)
+
+    rag._embed_documents = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        quietly(rag.build_index, checkpoint_dir)
+    assert len(os.listdir(os.path.join(checkpoint_dir, 'chunks'))) == 2
+
+    rag = make_rag(zotero_dir, index_type='flat')
+    embed = rag._embed_documents
+    embedded = []
+    rag._embed_documents = lambda documents, lexical_index=None: (
+        embedded.extend(documents) or embed(documents, lexical_index))
+    quietly(rag.build_index, checkpoint_dir)
+    assert len(embedded) == 20
+    for query in ["synthetic paper 7", " ".join(topic_words(3))]:
+        for mode in ('dense', 'lexical'):
+            assert sorted(ranking(rag, query, mode=mode)) == sorted(
+                ranking(reference, query, mode=mode))
+
+    quietly(rag.save_index, str(tmp_path / "index.zrag"))
+    assert not os.path.exists(checkpoint_dir)
+
+
+def test_temporary_checkpoint_is_removed(library, monkeypatch):
+    zotero_dir, _ = library
+    created = []
+    mkdtemp = fast_pdf_opener.tempfile.mkdtemp
+
+    def recording(**options):
+        created.append(mkdtemp(**options))
+        return created[-1]
+
+    monkeypatch.setattr(fast_pdf_opener.tempfile, 'mkdtemp', recording)
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    assert len(created) == 1 and not os.path.exists(created[0])
+    # The embeddings no longer refer to the removed checkpoint's file
+    assert not isinstance(rag.embeddings, np.memmap) and rag.embeddings.flags.owndata
+    assert len(rag.embeddings) == rag.faiss_index.ntotal
+
+
+def write_legacy_index(rag, json_path: str):
+    """Save a built, unchunked index in the JSON format of earlier versions."""
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({'documents': list(rag.documents), 'chunked': False,
+                   'zotero_dir': rag.zotero_dir}, f)
+    faiss.write_index(rag.faiss_index,
+                      fast_pdf_opener._sidecar_path(json_path, '.faiss'))
+    lexical = rag.lexical_index
+    matrix = lexical.matrix
+    terms = sorted(lexical.vocabulary, key=lexical.vocabulary.get)
+    np.savez(fast_pdf_opener._sidecar_path(json_path, '.lexical.npz'),
+             params=np.array([lexical.k1, lexical.b]), data=matrix.data,
+             indices=matrix.indices, indptr=matrix.indptr, shape=np.array(matrix.shape),
+             terms=np.frombuffer("\n".join(terms).encode('utf-8'), dtype=np.uint8))
+
+
+def test_convert_legacy_index(library, tmp_path):
+    zotero_dir, _ = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    # Legacy indexes were built without text prefixes
+    rag.text_prefixes = {'query': '', 'passage': ''}
+    quietly(rag.build_index)
+    json_path = str(tmp_path / "index.json")
+    write_legacy_index(rag, json_path)
+
+    legacy = make_rag(zotero_dir)
+    quietly(legacy.load_index, json_path)
+    legacy.model = rag.model
+    converted_path = str(tmp_path / "converted.zrag")
+    manifest = quietly(convert_legacy_index, json_path, converted_path)
+    assert manifest['n_documents'] == len(rag.documents)
+    converted = make_rag(zotero_dir)
+    quietly(converted.load_index, converted_path, verify=True)
+    converted.model = rag.model
+    assert converted.embeddings.shape == (len(rag.documents), rag.faiss_index.d)
+    for query in ["synthetic paper 12", " ".join(topic_words(8))]:
+        for mode in ('dense', 'lexical', 'hybrid'):
+            expected = ranking(rag, query, mode=mode)
+            assert ranking(legacy, query, mode=mode) == expected
+            assert ranking(converted, query, mode=mode) == expected
+
+
+def test_json_index_paths_resolve_to_directory(library, tmp_path):
+    zotero_dir, _ = library
+    json_path = str(tmp_path / "index.json")
+    directory = str(tmp_path / "index.zrag")
+    assert resolve_index_path(json_path) == directory
+
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    write_legacy_index(rag, json_path)
+    assert resolve_index_path(json_path) == json_path
+    # Saving to a legacy path writes the directory, which loads from then on
+    quietly(rag.save_index, json_path)
+    assert os.path.isdir(directory)
+    assert resolve_index_path(json_path) == directory
+    loaded = make_rag(zotero_dir)
+    quietly(loaded.load_index, json_path)
+    assert loaded.build_id == rag.build_id
+
+
+def test_document_store_round_trip(tmp_path):
+    documents = [{'title': "Über Zotero", 'year': 2001, 'score': 0.5, 'tags': ['a']},
+                 {'title': "", 'year': 2002, 'score': 1, 'extra': {'n': 1}},
+                 {'title': "Third", 'year': 2003, 'score': 2.5, 'tags': []}]
+    directory = str(tmp_path / "documents")
+    store = DocumentStore(directory, DocumentStore.write(directory, documents))
+    assert list(store) == documents
+    assert store[-1] == documents[-1]
+    with pytest.raises(IndexError):
+        store[len(documents)]
+    # Lookups index plain views of the mapped files, not np.memmap objects
+    assert not any(isinstance(array, np.memmap) for arrays in store._arrays.values()
+                   for array in (arrays if isinstance(arrays, tuple) else [arrays]))
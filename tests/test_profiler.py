@@ -0,0 +1,59 @@
+"""
+Profiler measurements of builds and searches, and its hooks.
+"""
+
+import json
+
+from fast_pdf_opener import Profiler
+
+from tests.helpers import make_rag, quietly
+
+
+def test_profiler_hooks_and_report(library, tmp_path):
+    zotero_dir, keys = library
+    events = []
+    rag = make_rag(zotero_dir, index_type='flat')
+    rag.profiler = Profiler(hooks=[lambda event, data: events.append((event, data))],
+                            slowest=5)
+    quietly(rag.build_index)
+    quietly(rag.search_many, ["synthetic paper 1", "synthetic paper 2"], mode='dense')
+
+    files = [data for event, data in events if event == 'file']
+    assert sorted(data['path'] for data in files) == sorted(
+        doc['path'] for doc in rag.documents)
+    assert all(data['status'] == 'ok' and data['chars'] > 0 for data in files)
+    encoded = [data for event, data in events if event == 'encode']
+    assert sum(data['texts'] for data in encoded
+               if data['kind'] == 'documents') == len(keys)
+    assert sum(data['texts'] for data in encoded if data['kind'] == 'queries') == 2
+    stages = {data['name'] for event, data in events if event == 'stage'}
+    assert {'zotero_metadata', 'scan_storage', 'search'} <= stages
+    searches = [data for event, data in events if event == 'faiss_search']
+    assert [data['queries'] for data in searches] == [2]
+
+    report = rag.profiler.report()
+    assert report['extraction']['files'] == len(keys)
+    assert len(report['extraction']['slowest']) == 5
+    seconds = [entry['seconds'] for entry in report['extraction']['slowest']]
+    assert seconds == sorted(seconds, reverse=True)
+    assert report['encoding']['documents']['texts'] == len(keys)
+    assert report['faiss_search']['queries'] == 2
+    assert report['stages']['search']['calls'] == 1
+    path = str(tmp_path / "profile.json")
+    rag.profiler.write(path)
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['stages'].keys() == report['stages'].keys()
+
+
+def test_hooks_added_later_see_later_events():
+    profiler = Profiler()
+    with profiler.stage('untracked'):
+        pass
+    events = []
+    profiler.add_hook(lambda event, data: events.append((event, data['name'])))
+    with profiler.stage('tracked', memory=False):
+        pass
+    profiler.record('tracked', 0.5, calls=2)
+    assert events == [('stage', 'tracked'), ('stage', 'tracked')]
+    assert profiler.stages['tracked']['calls'] == 3
+    assert profiler.stages['untracked']['calls'] == 1
@@ -0,0 +1,495 @@
+"""
+Ranking: chunked passages, keyword and hybrid search, filters, duplicate
+grouping and the search server.
+"""
+
+import json
+import math
+import os
+import random
+import re
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+import fast_pdf_opener
+from benchmarks.encoders import HashingEncoder, PhraseCrossEncoder
+from benchmarks.pdfgen import build_pdf
+from benchmarks.synthetic import COMMON_WORDS, add_paper, topic_words
+from fast_pdf_opener import (HYBRID_CANDIDATES_PER_RESULT, NEAR_DUPLICATE_THRESHOLD,
+                             PDF_TEXT_CHARS, LexicalIndex, NearDuplicateIndex,
+                             Profiler, QueryCache, SearchService, apply_rerank_scores,
+                             extract_pdf_text, make_server, normalize_filters,
+                             reciprocal_rank_fusion)
+
+from tests.helpers import DIMENSION, make_rag, paths, quietly
+
+FILTERS = [
+    {'year': 2000},
+    {'year': "1995-2004"},
+    {'year': "2010-"},
+    {'tag': "tag3"},
+    {'tag': ["TAG3", "tag17"]},
+    {'collection': "Collection 5"},
+    {'journal': "journal 12"},
+    {'author': "Author7"},
+    {'year': "1990-2010", 'tag': ["tag1", "tag2", "tag3"]},
+    {'tag': "no such tag"},
+]
+
+
+def filler_pages(rng: random.Random, pages: int, lines: int = 40):
+    return [[" ".join(rng.choice(COMMON_WORDS) for _ in range(12))
+             for _ in range(lines)] for _ in range(pages)]
+
+
+def test_chunked_search_finds_late_passages(library):
+    zotero_dir, _ = library
+    # Past the first PDF_TEXT_CHARS, with passages of nothing else
+    pages = filler_pages(random.Random(0), 2) + [["zebrafish fin regrowth " * 4] * 40]
+    add_paper(zotero_dir, "A long paper", build_pdf(pages), seed=1)
+    query = "zebrafish fin regrowth"
+
+    unchunked = make_rag(zotero_dir, index_type='flat')
+    quietly(unchunked.build_index)
+    titles = [doc['title'] for doc, _ in quietly(unchunked.search, query, top_k=5,
+                                                 mode='lexical')]
+    assert "A long paper" not in titles
+
+    rag = make_rag(zotero_dir, index_type='flat', chunked=True)
+    quietly(rag.build_index)
+    for mode in ('dense', 'hybrid'):
+        (doc, _), *_ = quietly(rag.search, query, top_k=5, mode=mode)
+        assert doc['title'] == "A long paper"
+        text = extract_pdf_text(doc['path'])
+        assert text.index("zebrafish") > PDF_TEXT_CHARS
+        assert "zebrafish" in text[doc['passage']['start']:doc['passage']['end']]
+
+
+def test_passage_aggregation(tmp_path):
+    rag = make_rag(str(tmp_path))
+    rag.passage_doc = np.array([0, 0, 0, 1, 1, 2])
+    rag.passage_spans = np.array([[i * 10, i * 10 + 10] for i in range(6)])
+    # Passage hits best first, as the vector search returns them
+    scores = np.array([0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.0])
+    indices = np.array([3, 0, 1, 2, 4, 5, -1])
+
+    rag.passage_aggregation = 'max'
+    hits = rag._aggregate_passages(scores, indices, top_k=3)
+    assert [(doc, round(score, 6)) for doc, score, _ in hits] == [
+        (1, 0.9), (0, 0.8), (2, 0.4)]
+    assert [(passage['start'], passage['end']) for _, _, passage in hits] == [
+        (30, 40), (0, 10), (50, 60)]
+
+    rag.passage_aggregation = 'sum'
+    hits = rag._aggregate_passages(scores, indices, top_k=2)
+    # A document sums its three best passages
+    assert [(doc, round(score, 6)) for doc, score, _ in hits] == [(0, 2.1), (1, 1.4)]
+    assert hits[0][2] == {'start': 0, 'end': 10, 'score': 0.8}
+
+
+def test_bm25_scores(tmp_path):
+    texts = ["zebrafish fin regrowth", "zebrafish zebrafish heart",
+             "axolotl limb regrowth study", "mouse liver"]
+    index = LexicalIndex(k1=1.5, b=0.75)
+    index.add(texts[:2])
+    index.add(texts[2:])
+    lengths = [3, 3, 4, 2]
+    average = sum(lengths) / 4
+
+    def bm25(doc, term):
+        tf = texts[doc].split().count(term)
+        df = sum(term in text.split() for text in texts)
+        idf = math.log(1 + (4 - df + 0.5) / (df + 0.5))
+        return idf * tf * 2.5 / (tf + 1.5 * (0.25 + 0.75 * lengths[doc] / average))
+
+    expected = [bm25(doc, "zebrafish") + bm25(doc, "regrowth") for doc in range(4)]
+    assert np.allclose(index.scores("Zebrafish regrowth?"), expected)
+    assert [row for row, _ in index.search("zebrafish regrowth", top_k=10)] == [0, 1, 2]
+    mask = np.array([False, True, True, True])
+    assert [row for row, _ in index.search("zebrafish regrowth", 10, mask)] == [1, 2]
+
+    index.save(str(tmp_path / "lexical"))
+    loaded = LexicalIndex.load(str(tmp_path / "lexical"))
+    assert np.allclose(loaded.scores("zebrafish regrowth"), expected)
+    loaded.remove([0])
+    assert [row for row, _ in loaded.search("mouse", 10)] == [2]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+    assert [item for item, _ in fused] == [1, 3, 2]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[2][1] == pytest.approx(1 / 62)
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_hybrid_fuses_dense_and_keyword_rankings(library, chunked):
+    zotero_dir, _ = library
+    rag = make_rag(zotero_dir, index_type='flat', chunked=chunked)
+    quietly(rag.build_index)
+    top_k = 5
+    n_candidates = top_k * HYBRID_CANDIDATES_PER_RESULT
+    for query in ["synthetic paper 3", "method results topic 7"]:
+        dense = quietly(rag.search, query, top_k=n_candidates, mode='dense')
+        lexical = quietly(rag.search, query, top_k=n_candidates, mode='lexical')
+        fused = reciprocal_rank_fusion([paths(dense), paths(lexical)])[:top_k]
+        hybrid = quietly(rag.search, query, top_k=top_k, mode='hybrid')
+        assert [(doc['path'], score) for doc, score in hybrid] == fused
+        # Hybrid results keep the best passage their dense hit found
+        passages = {doc['path']: doc.get('passage') for doc, _ in dense}
+        assert all(doc.get('passage') == passages.get(doc['path']) for doc, _ in hybrid)
+
+
+def rounded(results):
+    return [(doc['path'], round(score, 5), doc.get('passage'))
+            for doc, score in results]
+
+
+class BatchCountingEncoder(HashingEncoder):
+    """HashingEncoder that counts its encode() calls."""
+
+    def __init__(self, dimension: int = DIMENSION):
+        super().__init__(dimension)
+        self.calls = 0
+
+    def encode(self, sentences, **kwargs):
+        self.calls += 1
+        return super().encode(sentences, **kwargs)
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_search_many_matches_search(library, monkeypatch, chunked):
+    zotero_dir, _ = library
+    monkeypatch.setattr(fast_pdf_opener, 'SEARCH_MANY_CHUNK_SIZE', 4)
+    rag = make_rag(zotero_dir, index_type='flat', chunked=chunked)
+    quietly(rag.build_index)
+    queries = [f"synthetic paper {i}" for i in range(5)] + [
+        " ".join(topic_words(i)) for i in range(5)] + ["no such words", "paper 3"]
+    for mode in ('dense', 'lexical', 'hybrid'):
+        expected = [rounded(quietly(rag.search, query, top_k=7, mode=mode))
+                    for query in queries]
+        rag.model = BatchCountingEncoder()
+        batched = quietly(rag.search_many, queries, top_k=7, mode=mode)
+        assert [rounded(results) for results in batched] == expected
+        if mode != 'lexical':
+            # One encoder call per chunk of SEARCH_MANY_CHUNK_SIZE queries
+            assert rag.model.calls == 3
+
+
+def matches(doc, filters) -> bool:
+    """Whether ``doc`` matches normalized ``filters``, checked field by field."""
+    for field, value in filters:
+        if field == 'year':
+            year = re.search(r"\d{4}", doc.get('year', ''))
+            low, high = value
+            if year is None or (low is not None and int(year.group()) < low) or \
+                    (high is not None and int(year.group()) > high):
+                return False
+        elif field in ('author', 'journal'):
+            if field == 'author':
+                values = doc.get('authors') or [doc.get('author', '')]
+            else:
+                values = [doc.get('journal', '')]
+            words = [set(re.findall(r"\w+", item.lower())) for item in values]
+            if not any(set(re.findall(r"\w+", alternative)) <= item_words
+                       for alternative in value for item_words in words):
+                return False
+        else:
+            names = doc.get('item_tags' if field == 'tag' else 'collections', [])
+            if not {name.lower() for name in names} & set(value):
+                return False
+    return True
+
+
+@pytest.mark.parametrize('filters', FILTERS, ids=[json.dumps(f) for f in FILTERS])
+def test_filter_mask(library, filters):
+    zotero_dir, _ = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    normalized = normalize_filters(filters)
+    expected = np.array([matches(doc, normalized) for doc in rag.documents])
+    assert expected.any() == (filters != {'tag': "no such tag"})
+    assert np.array_equal(quietly(rag._filter_mask, normalized), expected)
+
+    allowed = {doc['path'] for doc, match in zip(rag.documents, expected) if match}
+    for mode in ('dense', 'lexical', 'hybrid'):
+        found = paths(quietly(rag.search, "synthetic paper topic",
+                              top_k=len(rag.documents), mode=mode, filters=filters))
+        assert set(found) <= allowed
+        if mode != 'lexical':
+            # Every document gets a dense score, so all the allowed ones are found
+            assert set(found) == allowed
+
+
+def test_filter_validation():
+    assert normalize_filters({'tag': " Tag3 ", 'year': None}) == (('tag', ('tag3',)),)
+    for filters in [{'color': "red"}, {'year': "recent"}, {'tag': [3]}]:
+        with pytest.raises(ValueError):
+            normalize_filters(filters)
+
+
+def reranking_rag(zotero_dir: str, seconds_per_pair: float = 0.0):
+    """A built flat index reranked by the stand-in cross-encoder."""
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    rag.reranker = "stand-in"
+    rag.cross_encoder = PhraseCrossEncoder(seconds_per_pair)
+    return rag
+
+
+def test_rerank_orders_candidates_by_cross_encoder(library):
+    zotero_dir, _ = library
+    rag = reranking_rag(zotero_dir)
+    query = "paper 12 on topic 12"
+    results = quietly(rag.search, query, top_k=5, mode='dense')
+    assert results[0][0]['title'] == "Synthetic paper 12 on topic 12"
+    expected = rag.cross_encoder.predict([(query, rag._metadata_text(doc))
+                                          for doc, _ in results])
+    assert [score for _, score in results] == pytest.approx(expected.tolist())
+    assert expected.tolist() == sorted(expected, reverse=True)
+    # The candidates come from the first stage
+    first_stage = quietly(rag.search, query, top_k=rag.rerank_candidates,
+                          mode='dense', rerank=False)
+    assert set(paths(results)) <= set(paths(first_stage))
+
+
+def test_rerank_budget(library):
+    zotero_dir, keys = library
+    rag = reranking_rag(zotero_dir, seconds_per_pair=0.005)
+    rag.rerank_candidates = len(keys)
+    rag.rerank_budget = None
+    rag.query_cache = QueryCache()
+    rag.profiler = Profiler()
+    quietly(rag.search, "paper 3 on topic 3", mode='dense')
+    assert rag.cross_encoder.pairs_scored == len(keys)
+
+    # With the measured cost per pair, only part of the candidates fit
+    rag.rerank_budget = 0.05
+    query = "paper 12 on topic 12"
+    first_stage = quietly(rag.search, query, top_k=len(keys), mode='dense',
+                          rerank=False)
+    for expected_searches in (1, 2):
+        scored = rag.cross_encoder.pairs_scored
+        results = quietly(rag.search, query, top_k=len(keys), mode='dense')
+        scored = rag.cross_encoder.pairs_scored - scored
+        assert 0 < scored < len(keys)
+        # Rankings cut short are not cached
+        assert rag.profiler.counters['rerank_budget_exceeded'] == expected_searches
+
+        # Unscored candidates follow in first-stage order, scored below the rest
+        scores = [score for _, score in results]
+        assert scores == sorted(scores, reverse=True)
+        assert max(scores[scored:]) < min(scores[:scored])
+        assert paths(results[scored:]) == paths(first_stage[scored:])
+        assert set(paths(results[:scored])) == set(paths(first_stage[:scored]))
+
+
+def test_apply_rerank_scores():
+    hits = [(0, 0.9, None), (1, 0.8, None), (2, 0.7, {'start': 0, 'end': 0}),
+            (3, 0.6, None)]
+    reranked = apply_rerank_scores(hits, [-2.0, 3.0])
+    assert [hit[0] for hit in reranked] == [1, 0, 2, 3]
+    assert [hit[1] for hit in reranked[:2]] == [3.0, -2.0]
+    assert -2.0 > reranked[2][1] > reranked[3][1]
+    assert reranked[2][2] == {'start': 0, 'end': 0}
+    assert apply_rerank_scores(hits, []) == hits
+
+
+def test_chunked_rerank_reads_the_best_passage(library):
+    zotero_dir, _ = library
+    pages = filler_pages(random.Random(0), 2) + [["zebrafish fin regrowth " * 4] * 40]
+    add_paper(zotero_dir, "A long paper", build_pdf(pages), seed=1)
+    rag = make_rag(zotero_dir, index_type='flat', chunked=True)
+    quietly(rag.build_index)
+    rag.reranker = "stand-in"
+    rag.cross_encoder = PhraseCrossEncoder(0)
+    query = "zebrafish fin regrowth"
+    (doc, score), *_ = quietly(rag.search, query, top_k=5, mode='dense')
+    assert doc['title'] == "A long paper"
+    start, end = doc['passage']['start'], doc['passage']['end']
+    text = f"A long paper {extract_pdf_text(doc['path'])[start:end]}"
+    assert score == pytest.approx(rag.cross_encoder.predict([(query, text)])[0])
+    # The metadata alone has none of the query's phrases
+    assert score > rag.cross_encoder.predict([(query, rag._metadata_text(doc))])[0] + 1
+
+
+def revised_versions(rng: random.Random, lines: int = 40):
+    """Pages of a paper and of a revision of it with one line rewritten."""
+    vocabulary = COMMON_WORDS + ["revision", "finding", "dataset"]
+    original = ["Revised study"] + [" ".join(rng.choice(vocabulary) for _ in range(12))
+                                    for _ in range(lines - 1)]
+    revision = list(original)
+    line = " ".join(rng.choice(vocabulary) for _ in range(12))
+    revision[rng.randrange(1, lines)] = line
+    return [original], [revision]
+
+
+def attachment_path(zotero_dir: str, key: str) -> str:
+    folder = os.path.join(zotero_dir, "storage", key)
+    return os.path.join(folder, os.listdir(folder)[0])
+
+
+@pytest.fixture
+def duplicated_library(library):
+    """The library with an identical copy of one paper and a paper in two versions."""
+    zotero_dir, keys = library
+    original = attachment_path(zotero_dir, keys[5])
+    with open(original, 'rb') as f:
+        copy_key = add_paper(zotero_dir, "Synthetic paper 5 on topic 5", f.read(),
+                             seed=100)
+    v1, v2 = revised_versions(random.Random(0))
+    v1_key = add_paper(zotero_dir, "Revised study", build_pdf(v1), seed=101)
+    v2_key = add_paper(zotero_dir, "Revised Study.", build_pdf(v2), seed=102)
+    groups = {frozenset([original, attachment_path(zotero_dir, copy_key)]),
+              frozenset([attachment_path(zotero_dir, v1_key),
+                         attachment_path(zotero_dir, v2_key)])}
+    return zotero_dir, keys, groups
+
+
+def duplicate_groups(rag):
+    return {frozenset([doc['path']] + [alt['path'] for alt in doc['duplicates']])
+            for doc in rag.documents if doc.get('duplicates')}
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_duplicate_grouping(duplicated_library, chunked):
+    zotero_dir, keys, groups = duplicated_library
+    rag = make_rag(zotero_dir, index_type='flat', chunked=chunked, deduplicate=True)
+    quietly(rag.build_index)
+    assert duplicate_groups(rag) == groups
+    assert len(rag.documents) == len(keys) + 1
+    similarities = sorted(alt['similarity'] for doc in rag.documents
+                          for alt in doc.get('duplicates') or [])
+    assert similarities[-1] == 1.0
+    assert NEAR_DUPLICATE_THRESHOLD <= similarities[0] < 1.0
+
+    hits = quietly(rag.search, "Revised study revision finding", top_k=5,
+                   mode='lexical')
+    titles = [doc['title'].lower().rstrip('.') for doc, _ in hits]
+    assert titles.count("revised study") == 1
+
+
+def test_other_papers_are_not_grouped(library):
+    zotero_dir, keys = library
+    # Scanner watermarks say nothing about the paper; titles tell papers apart
+    watermark = build_pdf([["Scanned with CamScanner app for free"]])
+    add_paper(zotero_dir, "Quantum chromodynamics lattice review", watermark, seed=100)
+    add_paper(zotero_dir, "Coral reef bleaching survey", watermark, seed=101)
+    v1, v2 = revised_versions(random.Random(0))
+    add_paper(zotero_dir, "Revised study", build_pdf(v1), seed=102)
+    add_paper(zotero_dir, "A different study", build_pdf(v2), seed=103)
+    rag = make_rag(zotero_dir, index_type='flat', deduplicate=True)
+    quietly(rag.build_index)
+    assert len(rag.documents) == len(keys) + 4
+    assert not duplicate_groups(rag)
+    (best, _), *_ = quietly(rag.search, "quantum chromodynamics", mode='lexical')
+    assert best['title'] == "Quantum chromodynamics lattice review"
+
+    near_duplicates = NearDuplicateIndex()
+    signature = near_duplicates.signature("Scanned with CamScanner app for free")
+    near_duplicates.add("scan.pdf", signature)
+    assert near_duplicates.match(signature) is None
+
+
+def test_duplicate_grouping_off(duplicated_library):
+    zotero_dir, keys, groups = duplicated_library
+    rag = make_rag(zotero_dir, index_type='flat', deduplicate=False)
+    quietly(rag.build_index)
+    assert len(rag.documents) == len(keys) + 3
+    assert not duplicate_groups(rag)
+
+
+@pytest.fixture
+def server(library, tmp_path):
+    """Base URL and served index path of a search server on a free port."""
+    zotero_dir, _ = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    index_path = str(tmp_path / "index.zrag")
+    quietly(rag.save_index, index_path)
+    httpd = make_server(SearchService(rag, index_path), host='127.0.0.1', port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", index_path
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def request(url: str, body=None):
+    """(status, decoded JSON) of a GET, or of a POST of ``body`` (bytes or JSON)."""
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body),
+                                    timeout=30) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_server_errors(server):
+    url, index_path = server
+    invalid = [{'query': "topic", 'top_k': 0}, {'query': "topic", 'nprobe': 0},
+               {'query': "topic", 'ef_search': -1}, {'query': "topic", 'top_k': "many"},
+               {'query': "topic", 'mode': "fuzzy"},
+               {'query': "topic", 'filters': {'color': "red"}},
+               {'top_k': 3}, {'queries': "topic"}]
+    for body in invalid:
+        path = '/search_batch' if 'queries' in body else '/search'
+        status, response = request(url + path, body)
+        assert status == 400, body
+        assert response['error']
+    assert request(url + "/search", b"not json")[0] == 400
+    assert request(url + "/search", b"[1, 2]")[0] == 400
+    assert request(url + "/search?q=topic&top_k=0")[0] == 400
+    assert request(url + "/nowhere")[0] == 404
+    other_index = {'query': "topic", 'index': index_path + ".other"}
+    assert request(url + "/search", other_index)[0] == 409
+
+    # The server keeps answering after errors
+    status, response = request(url + "/search", {'query': "synthetic paper", 'top_k': 3,
+                                                 'index': index_path})
+    assert status == 200
+    assert len(response['results']) == 3
+    status, response = request(url + "/search_batch",
+                               {'queries': ["topic", "paper"], 'top_k': 2})
+    assert status == 200
+    assert [len(results) for results in response['results']] == [2, 2]
+    assert request(url + "/status")[0] == 200
+
+
+def test_queries_go_to_a_server_serving_their_index(server, monkeypatch):
+    url, index_path = server
+    port = url.rsplit(':', 1)[1]
+    sent, opened, local = [], [], []
+    query_server = fast_pdf_opener.query_server
+
+    def recording(path, request, *args, **kwargs):
+        sent.append(request.get('index'))
+        return query_server(path, request, *args, **kwargs)
+
+    def local_search(*args, **kwargs):
+        # main() reports the error and exits
+        local.append(args)
+        raise RuntimeError("searching in-process")
+
+    monkeypatch.setattr(fast_pdf_opener, 'query_server', recording)
+    monkeypatch.setattr(fast_pdf_opener, 'open_pdf', opened.append)
+    monkeypatch.setattr(fast_pdf_opener, 'ZoteroRAG', local_search)
+
+    def main(*args):
+        monkeypatch.setattr('sys.argv', ['zotero-rag', '--port', port,
+                                         '--query', "synthetic paper", *args])
+        quietly(fast_pdf_opener.main)
+
+    main('--load-index', index_path)
+    assert sent == [os.path.abspath(index_path)] and len(opened) == 1 and not local
+    # Another index, or none named, is searched in this process
+    main('--load-index', index_path + ".other")
+    main()
+    assert len(sent) == 2 and len(opened) == 1 and len(local) == 2
@@ -0,0 +1,91 @@
+"""
+LibraryWatcher: polling the Zotero database and indexing changes once settled.
+"""
+
+import os
+import time
+
+from benchmarks.pdfgen import build_pdf
+from benchmarks.synthetic import add_paper, delete_paper, rename_paper
+from fast_pdf_opener import LibraryWatcher
+
+from tests.helpers import make_rag, quietly
+
+
+def titles(rag, query: str):
+    return [doc['title'] for doc, _ in quietly(rag.search, query, top_k=3,
+                                               mode='lexical')]
+
+
+def next_second():
+    """Wait until Zotero's whole-second modification dates would differ."""
+    time.sleep(1 - time.time() % 1 + 0.01)
+
+
+def test_watcher_indexes_changes(library, tmp_path):
+    zotero_dir, keys = library
+    index_path = str(tmp_path / "index.zrag")
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    watcher = LibraryWatcher(rag, index_path, poll_interval=0, debounce=0)
+    reads = watcher.database_reads
+    # An unchanged database is not opened
+    assert not quietly(watcher.poll)
+    assert watcher.database_reads == reads
+
+    key = add_paper(zotero_dir, "Platypus venom study",
+                    build_pdf([["platypus venom"]]), seed=1)
+    assert quietly(watcher.poll)
+    assert titles(rag, "platypus")[0] == "Platypus venom study"
+    saved = make_rag(zotero_dir, index_type='flat')
+    quietly(saved.load_index, index_path)
+    assert len(saved.documents) == len(keys) + 1
+
+    next_second()
+    rename_paper(zotero_dir, key, "Echidna venom study")
+    assert quietly(watcher.poll)
+    assert titles(rag, "echidna")[0] == "Echidna venom study"
+    delete_paper(zotero_dir, key)
+    assert quietly(watcher.poll)
+    assert "Echidna venom study" not in titles(rag, "echidna")
+    assert watcher.stats()['updates'] == watcher.updates == 3
+    assert len(rag.documents) == len(keys)
+
+
+def test_changes_are_debounced(library):
+    zotero_dir, keys = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    watcher = LibraryWatcher(rag, poll_interval=0, debounce=60, max_delay=60)
+    for i in range(3):
+        add_paper(zotero_dir, f"Platypus venom study {i}",
+                  build_pdf([[f"Platypus venom study {i}"]]), seed=i + 1)
+        assert not quietly(watcher.poll)
+    assert watcher.updates == 0
+    quietly(watcher.apply)
+    assert (watcher.updates, watcher.attachments_updated) == (1, 3)
+    assert len(rag.documents) == len(keys) + 3
+
+
+def test_attachments_wait_for_their_file(library):
+    zotero_dir, keys = library
+    rag = make_rag(zotero_dir, index_type='flat')
+    quietly(rag.build_index)
+    watcher = LibraryWatcher(rag, poll_interval=0, debounce=0)
+    pdf = build_pdf([["platypus venom"]])
+    key = add_paper(zotero_dir, "Platypus venom study", pdf, seed=1)
+    folder = os.path.join(zotero_dir, "storage", key)
+    (name,) = os.listdir(folder)
+    os.remove(os.path.join(folder, name))
+    assert quietly(watcher.poll)
+    assert watcher.stats()['awaiting_files'] == 1
+    assert len(rag.documents) == len(keys)
+
+    # The file arriving later is picked up from its folder changing
+    assert not quietly(watcher.poll)
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(pdf)
+    os.utime(folder, ns=(0, os.stat(folder).st_mtime_ns + 1))
+    assert quietly(watcher.poll)
+    assert watcher.stats()['awaiting_files'] == 0
+    assert titles(rag, "platypus")[0] == "Platypus venom study"
@@ -22,7 +22,7 @@ hiddenimports += collect_submodules('tokenizers')
 hiddenimports += collect_submodules('huggingface_hub')
 hiddenimports += collect_submodules('torch')
 hiddenimports += collect_submodules('numpy')
-hiddenimports += collect_submodules('sklearn')
+hiddenimports += collect_submodules('scipy.sparse')
 
 # Additional hidden imports that might be needed
 hiddenimports += [
@@ -33,11 +33,6 @@ hiddenimports += [
     'argparse',
     'PyPDF2',
     'faiss',
-    'sklearn.utils._cython_blas',
-    'sklearn.neighbors.typedefs',
-    'sklearn.neighbors.quad_tree',
-    'sklearn.tree',
-    'sklearn.tree._utils',
     'PIL._tkinter_finder',
 ]
 